@@ -11,7 +11,7 @@ https://docs.djangoproject.com/en/3.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -38,12 +38,15 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
     'corsheaders',
     'shop',
 ]
 
 MIDDLEWARE = [
+    # Первым: замеры запроса включают работу остальных middleware
+    'shop.metrics.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'corsheaders.middleware.CorsMiddleware',
@@ -52,6 +55,8 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    # Выбирает базу для чтений представления (основная или реплика), см. DATABASE_REPLICAS
+    'shop.routers.ReplicaRoutingMiddleware',
 ]
 
 ROOT_URLCONF = 'config.urls'
@@ -89,6 +94,22 @@ DATABASES = {
     }
 }
 
+# Реплики для чтения каталога: хосты через запятую (host или host:port), остальное как у default.
+# Запись кэша каталога после чтения с отстающей реплики может продержаться до CATALOG_CACHE_TIMEOUT
+DATABASE_REPLICAS = []
+for number, replica in enumerate(config('DB_REPLICA_HOSTS', default='', cast=Csv()), 1):
+    host, _, port = replica.partition(':')
+    DATABASES[f'replica{number}'] = {
+        **DATABASES['default'], 'HOST': host, 'PORT': port or DATABASES['default']['PORT'],
+        'TEST': {'MIRROR': 'default'},
+    }
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+
+# Сколько секунд после изменяющего запроса клиент читает только из основной базы
+REPLICA_PIN_SECONDS = config('REPLICA_PIN_SECONDS', default=5, cast=int)
+
 
 # Password validation
 # https://docs.djangoproject.com/en/3.2/ref/settings/#auth-password-validators
@@ -146,6 +167,8 @@ CORS_ALLOW_ALL_ORIGINS = True
 # REST Framework
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # Bearer-токен: пользователь из кэша, без чтения сессии и пользователя из БД (shop/auth.py)
+        'shop.auth.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -153,5 +176,36 @@ REST_FRAMEWORK = {
     ],
 }
 
+# Cache
+# По умолчанию кэш в памяти процесса; для нескольких воркеров подойдёт
+# django.core.cache.backends.filebased.FileBasedCache или Redis/Memcached
+CACHES = {
+    'default': {
+        'BACKEND': config('CACHE_BACKEND', default='django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': config('CACHE_LOCATION', default='magazin'),
+    }
+}
+
+# Сколько секунд живут записи кэша каталога; изменения товаров и категорий
+# сбрасывают их сразу, а остатки и рейтинги в списках могут отставать на это время
+CATALOG_CACHE_TIMEOUT = config('CATALOG_CACHE_TIMEOUT', default=60, cast=int)
+
+# Сессии веб-интерфейса: db (по умолчанию), cached_db — чтение сессии из кэша,
+# signed_cookies — сессия целиком в подписанной cookie, без обращений к БД и кэшу
+SESSION_ENGINE = config('SESSION_ENGINE', default='django.contrib.sessions.backends.db')
+
+# Сколько секунд пользователь API-токена живёт в кэше; выход, смена пароля, профиля
+# или баланса сбрасывают запись сразу
+API_TOKEN_CACHE_SECONDS = config('API_TOKEN_CACHE_SECONDS', default=300, cast=int)
+
 # Custom user model
 AUTH_USER_MODEL = 'shop.User'
+
+# Сколько минут товар в корзине удерживается за покупателем
+CART_RESERVATION_MINUTES = config('CART_RESERVATION_MINUTES', default=15, cast=int)
+
+# Процессы пула, в котором строятся миниатюры картинок товаров
+IMAGE_WORKERS = config('IMAGE_WORKERS', default=2, cast=int)
+
+# Токен для сборщика метрик (Authorization: Bearer ...); без него /metrics доступен только персоналу
+METRICS_TOKEN = config('METRICS_TOKEN', default='')
@@ -0,0 +1,13 @@
+"""
+Проверка маршрутизации чтений на реплику: вторая база replica — зеркало основной.
+
+python manage.py test shop.tests.ReplicaRoutingTests --settings=config.settings_replica_test
+
+Остальные тесты рассчитаны на одну базу и запускаются с обычными настройками.
+"""
+
+from .settings import *  # noqa: F401,F403
+from .settings import DATABASES
+
+DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = ['replica']
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
-from .models import User, Category, Product, CartItem, Order, Review
+from .models import (User, Category, Product, CartItem, Order, OrderLine, ArchivedOrder, ArchivedOrderLine, Review,
+                     SellerStats, StockReservation, BalanceEntry, ApiToken)
 
 
 @admin.register(User)
@@ -10,6 +11,8 @@ class UserAdmin(BaseUserAdmin):
     fieldsets = BaseUserAdmin.fieldsets + (
         ('Дополнительная информация', {'fields': ('user_type', 'balance', 'phone', 'address')}),
     )
+    # Баланс меняется только проводками журнала
+    readonly_fields = ['balance']
 
 
 @admin.register(Category)
@@ -30,14 +33,81 @@ class CartItemAdmin(admin.ModelAdmin):
     list_filter = ['added_at']
 
 
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ['product', 'cart_item', 'quantity', 'expires_at']
+    list_filter = ['expires_at']
+
+
+class OrderLineInline(admin.TabularInline):
+    model = OrderLine
+    raw_id_fields = ['product']
+    extra = 0
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
-    list_display = ['id', 'buyer', 'seller', 'product', 'quantity', 'total_price', 'status', 'created_at']
+    list_display = ['id', 'buyer', 'seller', 'items_count', 'total_price', 'status', 'created_at']
     list_filter = ['status', 'created_at']
-    search_fields = ['buyer__username', 'seller__username', 'product__name']
+    search_fields = ['buyer__username', 'seller__username']
+    inlines = [OrderLineInline]
+
+
+class ArchivedOrderLineInline(admin.TabularInline):
+    model = ArchivedOrderLine
+    raw_id_fields = ['product']
+    extra = 0
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'buyer', 'seller', 'items_count', 'total_price', 'status', 'created_at', 'archived_at']
+    list_filter = ['status']
+    search_fields = ['buyer__username', 'seller__username']
+    raw_id_fields = ['buyer', 'seller']
+    inlines = [ArchivedOrderLineInline]
 
 
 @admin.register(Review)
 class ReviewAdmin(admin.ModelAdmin):
     list_display = ['user', 'product', 'rating', 'created_at']
     list_filter = ['rating', 'created_at']
+
+
+@admin.register(SellerStats)
+class SellerStatsAdmin(admin.ModelAdmin):
+    list_display = ['seller', 'pending_count', 'received_count', 'cancelled_count',
+                    'received_revenue', 'pending_revenue', 'total_stock', 'updated_at']
+    readonly_fields = ['updated_at']
+
+
+@admin.register(BalanceEntry)
+class BalanceEntryAdmin(admin.ModelAdmin):
+    list_display = ['user', 'kind', 'amount', 'order', 'created_at']
+    list_filter = ['kind', 'created_at']
+    search_fields = ['user__username']
+    raw_id_fields = ['user', 'order']
+
+    # Журнал пишется только кодом вместе с балансом (shop/ledger.py)
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ApiToken)
+class ApiTokenAdmin(admin.ModelAdmin):
+    list_display = ['user', 'name', 'created_at']
+    search_fields = ['user__username', 'name']
+    raw_id_fields = ['user']
+
+    # Ключ показывается один раз при выпуске через API; в админке токен можно только отозвать
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
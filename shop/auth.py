@@ -0,0 +1,100 @@
+import hashlib
+import secrets
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+from .models import ApiToken
+
+KEYWORDS = (b'bearer', b'token')
+
+
+def hash_key(key):
+    return hashlib.sha256(key.encode()).hexdigest()
+
+
+def issue_token(user, name=''):
+    """Выпускает токен; ключ возвращается один раз, в базе остаётся только его хеш"""
+    key = secrets.token_urlsafe(32)
+    token = ApiToken.objects.create(user=user, name=name, key_hash=hash_key(key))
+    return token, key
+
+
+def _token_key(key_hash):
+    return f'auth:token:{key_hash}'
+
+
+def _user_version_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def _user_version(user_id):
+    key = _user_version_key(user_id)
+    cache.add(key, 1, None)
+    return cache.get(key, 1)
+
+
+def invalidate_user(user_id):
+    """Сбрасывает закэшированного пользователя у всех его токенов (выход, пароль, профиль, баланс)"""
+    key = _user_version_key(user_id)
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def forget_token(key_hash):
+    cache.delete(_token_key(key_hash))
+
+
+def resolve_token(key):
+    """Пользователь по ключу токена или None.
+
+    В кэше лежит (id пользователя, версия, пользователь): при попадании база не читается вовсе.
+    При промахе версия читается до загрузки пользователя, поэтому сброс, случившийся
+    в это время, не оставит в кэше устаревшую запись.
+    """
+    key_hash = hash_key(key)
+    entry = cache.get(_token_key(key_hash))
+    if entry is not None:
+        user_id, version, user = entry
+        if cache.get(_user_version_key(user_id)) == version:
+            return user if user.is_active else None
+
+    token = ApiToken.objects.filter(key_hash=key_hash).only('user_id').first()
+    if token is None:
+        return None
+    version = _user_version(token.user_id)
+    user = token.user
+    cache.set(_token_key(key_hash), (user.pk, version, user), settings.API_TOKEN_CACHE_SECONDS)
+    return user if user.is_active else None
+
+
+class CachedTokenAuthentication(BaseAuthentication):
+    """Authorization: Bearer <ключ> (или Token <ключ>); пользователь берётся из кэша.
+
+    В отличие от сессии не читает ни строку сессии, ни строку пользователя на каждый запрос.
+    request.auth — хеш ключа (по нему токен отзывается при выходе).
+    """
+
+    def authenticate(self, request):
+        header = get_authorization_header(request).split()
+        if not header or header[0].lower() not in KEYWORDS:
+            return None
+        if len(header) != 2:
+            raise AuthenticationFailed('Неверный заголовок авторизации')
+        try:
+            key = header[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Неверный токен')
+
+        user = resolve_token(key)
+        if user is None:
+            raise AuthenticationFailed('Недействительный токен')
+        return user, hash_key(key)
+
+    def authenticate_header(self, request):
+        return 'Bearer'
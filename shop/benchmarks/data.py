@@ -0,0 +1,163 @@
+import random
+from array import array
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+
+from shop.models import BalanceEntry, Category, Order, OrderLine, Product, Review, User
+from shop.ratings import rebuild_rating_aggregates
+
+WORDS = [
+    'телефон', 'смартфон', 'чехол', 'наушники', 'зарядка', 'кабель', 'ноутбук', 'планшет', 'клавиатура',
+    'мышь', 'монитор', 'куртка', 'ботинки', 'кроссовки', 'рюкзак', 'сумка', 'часы', 'лампа', 'чайник',
+    'кофеварка', 'пылесос', 'книга', 'игрушка', 'конструктор', 'мяч', 'велосипед', 'палатка', 'фонарик',
+    'красный', 'синий', 'чёрный', 'белый', 'большой', 'маленький', 'беспроводной', 'кожаный', 'детский',
+    'зимний', 'летний', 'новый', 'классический', 'складной', 'водонепроницаемый', 'металлический',
+]
+CATEGORIES = ['Электроника', 'Одежда', 'Обувь', 'Дом', 'Кухня', 'Книги', 'Игрушки', 'Спорт', 'Туризм', 'Аксессуары']
+# Все пользователи бенчмарка входят с этим паролем; хеш считается один раз на весь прогон
+PASSWORD = 'bench-pass'
+BUYER_BALANCE = Decimal('1000000')
+ORDER_STATUSES = ['pending', 'accepted', 'processing', 'shipped', 'delivered', 'received', 'cancelled']
+ORDER_STATUS_WEIGHTS = [5, 3, 3, 4, 5, 70, 10]
+
+
+def seller_name(index):
+    return f'bench_seller_{index}'
+
+
+def buyer_name(index):
+    return f'bench_buyer_{index}'
+
+
+class Seeder:
+    """Дозаполняет базу синтетическими данными до заданных объёмов.
+
+    Повторный запуск досоздаёт только недостающее, поэтому объёмы можно наращивать.
+    Выбор значений детерминирован зерном rng_seed, так что прогоны на разных коммитах
+    идут на одинаковых данных.
+    """
+
+    def __init__(self, batch_size=5000, rng_seed=42, log=print):
+        self.batch_size = batch_size
+        self.random = random.Random(rng_seed)
+        self.log = log
+        self.password = make_password(PASSWORD)
+
+    def seed(self, sellers, buyers, products, orders, reviews):
+        categories = self.seed_categories()
+        seller_ids = self.seed_users(seller_name, 'seller', sellers)
+        buyer_ids = self.seed_users(buyer_name, 'buyer', buyers)
+        self.seed_products(seller_ids, categories, products)
+        catalog = self.load_catalog(seller_ids)
+        self.seed_orders(buyer_ids, catalog, orders)
+        self.seed_reviews(buyer_ids, catalog, reviews)
+
+        # bulk_create обходит сигналы: счётчики продавцов пересчитываются целиком (все засеянные продавцы),
+        # кэш каталога сбрасывается, иначе сценарии читали бы страницы, закэшированные до заполнения
+        self.log('Пересчитываем агрегаты рейтингов и статистику продавцов')
+        rebuild_rating_aggregates(Product, Review, self.batch_size)
+        call_command('reconcile_seller_stats', stdout=StringIO())
+        cache.clear()
+
+    def seed_categories(self):
+        existing = set(Category.objects.filter(name__in=CATEGORIES).values_list('name', flat=True))
+        Category.objects.bulk_create([Category(name=name) for name in CATEGORIES if name not in existing])
+        return list(Category.objects.filter(name__in=CATEGORIES).values_list('id', flat=True))
+
+    def seed_users(self, name, user_type, total):
+        prefix = name('')
+        existing = User.objects.filter(username__startswith=prefix).count()
+        if existing < total:
+            self.log(f'Создаём пользователей {prefix}*: {total - existing}')
+        for start in range(existing, total, self.batch_size):
+            batch = [
+                User(username=name(index), password=self.password, user_type=user_type,
+                     balance=BUYER_BALANCE if user_type == 'buyer' else 0)
+                for index in range(start, min(start + self.batch_size, total))
+            ]
+            with transaction.atomic():
+                User.objects.bulk_create(batch)
+                if user_type == 'buyer':
+                    created = User.objects.filter(username__in=[user.username for user in batch]).values_list('id', flat=True)
+                    BalanceEntry.objects.bulk_create([
+                        BalanceEntry(user_id=user_id, kind=BalanceEntry.OPENING, amount=BUYER_BALANCE)
+                        for user_id in created
+                    ])
+        return array('q', User.objects.filter(username__startswith=prefix).order_by('id').values_list('id', flat=True))
+
+    def seed_products(self, seller_ids, categories, total):
+        missing = total - Product.objects.filter(seller_id__in=seller_ids).count()
+        if missing > 0:
+            self.log(f'Создаём товаров: {missing}')
+        while missing > 0:
+            batch = [
+                Product(
+                    seller_id=self.random.choice(seller_ids),
+                    category_id=self.random.choice(categories),
+                    name=' '.join(self.random.sample(WORDS, 3)),
+                    description=' '.join(self.random.choices(WORDS, k=40)),
+                    price=self.random.randint(100, 100000),
+                    stock=self.random.randint(0, 1000),
+                )
+                for _ in range(min(self.batch_size, missing))
+            ]
+            Product.objects.bulk_create(batch)
+            missing -= len(batch)
+
+    def load_catalog(self, seller_ids):
+        """id, продавец и цена товаров в компактных массивах (миллион товаров — десятки МБ)"""
+        ids, sellers, prices = array('q'), array('q'), array('q')
+        rows = (Product.objects.filter(seller_id__in=seller_ids).order_by('id')
+                .values_list('id', 'seller_id', 'price').iterator(chunk_size=self.batch_size))
+        for product_id, seller_id, price in rows:
+            ids.append(product_id)
+            sellers.append(seller_id)
+            prices.append(int(price * 100))
+        return ids, sellers, prices
+
+    def seed_orders(self, buyer_ids, catalog, total):
+        ids, sellers, prices = catalog
+        missing = total - Order.objects.filter(buyer_id__in=buyer_ids).count()
+        if missing > 0:
+            self.log(f'Создаём заказов: {missing}')
+        while missing > 0 and ids:
+            batch, lines = [], []
+            for _ in range(min(self.batch_size, missing)):
+                index = self.random.randrange(len(ids))
+                quantity = self.random.randint(1, 3)
+                status = self.random.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0]
+                total_price = Decimal(prices[index] * quantity) / 100
+                batch.append(Order(
+                    buyer_id=self.random.choice(buyer_ids), seller_id=sellers[index], items_count=quantity,
+                    total_price=total_price, status=status, is_received=status == 'received',
+                ))
+                lines.append(OrderLine(product_id=ids[index], quantity=quantity,
+                                       price=Decimal(prices[index]) / 100, total_price=total_price))
+            if connection.features.can_return_rows_from_bulk_insert:
+                Order.objects.bulk_create(batch)
+            else:
+                for order in batch:
+                    order.save()
+            for order, line in zip(batch, lines):
+                line.order = order
+            OrderLine.objects.bulk_create(lines)
+            missing -= len(batch)
+
+    def seed_reviews(self, buyer_ids, catalog, total):
+        ids = catalog[0]
+        total = min(total, len(ids) * len(buyer_ids))
+        existing = Review.objects.filter(user_id__in=buyer_ids).count()
+        if existing < total:
+            self.log(f'Создаём отзывов: {total - existing}')
+        # Пара (товар, покупатель) по номеру отзыва не повторяется — unique_together соблюдён без проверок
+        for start in range(existing, total, self.batch_size):
+            Review.objects.bulk_create([
+                Review(product_id=ids[index % len(ids)], user_id=buyer_ids[index // len(ids)],
+                       rating=self.random.choice((1, 2, 3, 4, 4, 5, 5, 5)), comment='')
+                for index in range(start, min(start + self.batch_size, total))
+            ], ignore_conflicts=True)
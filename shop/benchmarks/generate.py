@@ -0,0 +1,372 @@
+import math
+import multiprocessing
+import random
+from array import array
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from itertools import accumulate
+
+import django
+from django.contrib.auth.hashers import make_password
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+
+from shop.models import Category
+from .data import BUYER_BALANCE, CATEGORIES, ORDER_STATUS_WEIGHTS, ORDER_STATUSES, PASSWORD, WORDS
+
+RATINGS = (1, 2, 3, 4, 4, 5, 5, 5)
+# Столько строк склеивается в один кусок потока COPY
+LINES_PER_CHUNK = 1000
+# Таблицы с id, которые генератор выделяет сам (последовательности подправляются после загрузки)
+TABLES = ('shop_user', 'shop_product', 'shop_order', 'shop_orderline', 'shop_review', 'shop_cartitem')
+# Позиций в заказе: чаще одна, иногда несколько товаров того же продавца.
+# У позиций заказа n id из диапазона [n * MAX_LINES, (n + 1) * MAX_LINES): пропуски в id не мешают
+LINES_PER_ORDER = (1, 1, 1, 2, 3)
+MAX_LINES = max(LINES_PER_ORDER)
+# Сколько следующих по id товаров просматривается в поиске товаров того же продавца
+SAME_SELLER_SCAN = 64
+
+
+def copy_value(value):
+    """Значение в текстовом формате COPY"""
+    if value is None:
+        return '\\N'
+    if value is True:
+        return 't'
+    if value is False:
+        return 'f'
+    if isinstance(value, str):
+        return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+    return str(value)
+
+
+class CopyStream:
+    """Файлоподобный источник для copy_expert: строки генерируются по мере чтения,
+    поэтому память не зависит от объёма загрузки"""
+
+    def __init__(self, rows):
+        self._chunks = self._join(rows)
+        self._buffer = ''
+
+    @staticmethod
+    def _join(rows):
+        lines = []
+        for row in rows:
+            lines.append('\t'.join(map(copy_value, row)))
+            if len(lines) >= LINES_PER_CHUNK:
+                yield '\n'.join(lines) + '\n'
+                lines = []
+        if lines:
+            yield '\n'.join(lines) + '\n'
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buffer) < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            self._buffer += chunk
+        if size < 0:
+            data, self._buffer = self._buffer, ''
+        else:
+            data, self._buffer = self._buffer[:size], self._buffer[size:]
+        return data
+
+    readline = read
+
+
+@dataclass
+class Plan:
+    """Что и в каких диапазонах id создаётся; передаётся в процессы-воркеры"""
+    seed: int
+    prefix: str
+    sellers: int
+    buyers: int
+    products: int
+    orders: int
+    reviews: int
+    cart_items: int
+    whales: int
+    whale_share: float
+    zipf: float
+    password: str
+    now: datetime
+    category_ids: list = field(default_factory=list)
+    bases: dict = field(default_factory=dict)
+    # Заполняются в prepare(): продавец и цена (в копейках) каждого товара, веса популярности
+    product_sellers: array = None
+    product_prices: array = None
+    popularity: list = None
+    stride: int = 1
+
+    def rng(self, *parts):
+        return random.Random(':'.join(map(str, (self.seed, *parts))))
+
+    def prepare(self):
+        rng = self.rng('catalog')
+        # Киты: whales продавцов получают whale_share всех товаров, остальные — поровну
+        regular = self.sellers - self.whales
+        weights = [self.whale_share / self.whales] * self.whales if self.whales else []
+        weights += [(1 - self.whale_share if self.whales else 1) / regular] * regular if regular else []
+        seller_base = self.bases['shop_user']
+        sellers = rng.choices(range(self.sellers), cum_weights=list(accumulate(weights)), k=self.products)
+        self.product_sellers = array('q', (seller_base + index for index in sellers))
+        # Логнормальные цены: много дешёвого, немного дорогого
+        self.product_prices = array('q', (min(int(rng.lognormvariate(7.5, 1.2) * 100), 99_999_999)
+                                          for _ in range(self.products)))
+        # Закон Ципфа: вес товара с рангом r пропорционален 1 / r^s; ранги разбросаны по id шагом stride
+        self.popularity = list(accumulate(1 / (rank + 1) ** self.zipf for rank in range(self.products)))
+        self.stride = next(step for step in range(self.products // 2 + 1, 2 * self.products + 2)
+                           if math.gcd(step, self.products) == 1)
+
+    def popular_products(self, rng, k):
+        """Индексы товаров с учётом популярности"""
+        ranks = rng.choices(range(self.products), cum_weights=self.popularity, k=k)
+        return [rank * self.stride % self.products for rank in ranks]
+
+    def timestamp(self, rng, days=365):
+        return (self.now - timedelta(seconds=rng.random() * days * 86400)).isoformat(sep=' ')
+
+    def per_buyer(self, total, buyer):
+        """Сколько строк приходится на покупателя и номер первой из них"""
+        share, extra = divmod(total, self.buyers)
+        return share + (buyer < extra), buyer * share + min(buyer, extra)
+
+
+def money(kopecks):
+    return f'{kopecks // 100}.{kopecks % 100:02d}'
+
+
+def user_rows(plan, start, stop):
+    for index in range(start, stop):
+        user_id = plan.bases['shop_user'] + index
+        user_type = 'seller' if index < plan.sellers else 'buyer'
+        username = f'{plan.prefix}_{user_type}_{user_id}'
+        balance = '0.00' if user_type == 'seller' else f'{BUYER_BALANCE:.2f}'
+        yield (user_id, plan.password, None, False, username, '', '', f'{username}@example.com', False, True,
+               plan.now.isoformat(sep=' '), user_type, balance, '', '')
+
+
+USER_COLUMNS = ('id', 'password', 'last_login', 'is_superuser', 'username', 'first_name', 'last_name', 'email',
+                'is_staff', 'is_active', 'date_joined', 'user_type', 'balance', 'phone', 'address')
+
+
+def product_rows(plan, start, stop):
+    rng = plan.rng('products', start)
+    for index in range(start, stop):
+        product_id = plan.bases['shop_product'] + index
+        created = plan.timestamp(rng, days=730)
+        price = plan.product_prices[index]
+        yield (product_id, plan.product_sellers[index], rng.choice(plan.category_ids),
+               ' '.join(rng.sample(WORDS, 3)), f'GEN-{product_id}', ' '.join(rng.choices(WORDS, k=20)),
+               money(price), rng.randint(0, 500), '{}', created, created,
+               0, 0, 0, 0, 0, 0, 0)
+
+
+PRODUCT_COLUMNS = ('id', 'seller_id', 'category_id', 'name', 'sku', 'description', 'price', 'stock',
+                   'image_variants', 'created_at', 'updated_at', 'rating_sum', 'rating_count',
+                   'rating_1', 'rating_2', 'rating_3', 'rating_4', 'rating_5')
+
+
+def same_seller_products(plan, index, count):
+    """Товар index и до count - 1 следующих за ним по id товаров того же продавца"""
+    found = [index]
+    seller = plan.product_sellers[index]
+    for step in range(1, min(SAME_SELLER_SCAN, plan.products)):
+        if len(found) == count:
+            break
+        candidate = (index + step) % plan.products
+        if plan.product_sellers[candidate] == seller:
+            found.append(candidate)
+    return found
+
+
+def planned_orders(plan, start, stop):
+    """Заказы с номерами [start, stop): (номер, покупатель, статус, дата, [(индекс товара, количество)]).
+
+    Заголовки и позиции пишутся разными COPY, но из одной последовательности случайных чисел.
+    """
+    rng = plan.rng('orders', start)
+    buyer_base = plan.bases['shop_user'] + plan.sellers
+    products = plan.popular_products(rng, stop - start)
+    for offset, index in enumerate(products):
+        lines = [(line, rng.choice((1, 1, 1, 2, 3)))
+                 for line in same_seller_products(plan, index, rng.choice(LINES_PER_ORDER))]
+        status = rng.choices(ORDER_STATUSES, ORDER_STATUS_WEIGHTS)[0]
+        yield start + offset, buyer_base + rng.randrange(plan.buyers), status, plan.timestamp(rng), lines
+
+
+def order_rows(plan, start, stop):
+    for number, buyer_id, status, created, lines in planned_orders(plan, start, stop):
+        total = sum(plan.product_prices[index] * quantity for index, quantity in lines)
+        yield (plan.bases['shop_order'] + number, buyer_id, plan.product_sellers[lines[0][0]],
+               sum(quantity for _, quantity in lines), money(total), status, status == 'received', created, created)
+
+
+ORDER_COLUMNS = ('id', 'buyer_id', 'seller_id', 'items_count', 'total_price', 'status',
+                 'is_received', 'created_at', 'updated_at')
+
+
+def order_line_rows(plan, start, stop):
+    for number, _, _, _, lines in planned_orders(plan, start, stop):
+        for position, (index, quantity) in enumerate(lines):
+            price = plan.product_prices[index]
+            yield (plan.bases['shop_orderline'] + number * MAX_LINES + position, plan.bases['shop_order'] + number,
+                   plan.bases['shop_product'] + index, quantity, money(price), money(price * quantity))
+
+
+ORDER_LINE_COLUMNS = ('id', 'order_id', 'product_id', 'quantity', 'price', 'total_price')
+
+
+def distinct_products(plan, rng, count):
+    """count разных популярных товаров (уникальность пары товар-покупатель)"""
+    chosen = set()
+    while len(chosen) < min(count, plan.products):
+        chosen.update(plan.popular_products(rng, count - len(chosen)))
+    return sorted(chosen)
+
+
+def review_rows(plan, start, stop):
+    for buyer in range(start, stop):
+        rng = plan.rng('reviews', buyer)
+        count, first = plan.per_buyer(plan.reviews, buyer)
+        for offset, index in enumerate(distinct_products(plan, rng, count)):
+            yield (plan.bases['shop_review'] + first + offset, plan.bases['shop_product'] + index,
+                   plan.bases['shop_user'] + plan.sellers + buyer, rng.choice(RATINGS), '', plan.timestamp(rng))
+
+
+REVIEW_COLUMNS = ('id', 'product_id', 'user_id', 'rating', 'comment', 'created_at')
+
+
+def cart_rows(plan, start, stop):
+    for buyer in range(start, stop):
+        rng = plan.rng('cart', buyer)
+        count, first = plan.per_buyer(plan.cart_items, buyer)
+        for offset, index in enumerate(distinct_products(plan, rng, count)):
+            yield (plan.bases['shop_cartitem'] + first + offset, plan.bases['shop_user'] + plan.sellers + buyer,
+                   plan.bases['shop_product'] + index, rng.randint(1, 3), plan.timestamp(rng, days=14))
+
+
+CART_COLUMNS = ('id', 'user_id', 'product_id', 'quantity', 'added_at')
+
+WRITERS = {
+    'shop_user': (USER_COLUMNS, user_rows),
+    'shop_product': (PRODUCT_COLUMNS, product_rows),
+    'shop_order': (ORDER_COLUMNS, order_rows),
+    'shop_orderline': (ORDER_LINE_COLUMNS, order_line_rows),
+    'shop_review': (REVIEW_COLUMNS, review_rows),
+    'shop_cartitem': (CART_COLUMNS, cart_rows),
+}
+
+_plan = None
+
+
+def _init_worker(plan):
+    global _plan
+    django.setup()
+    _plan = plan
+
+
+def copy_chunk(task):
+    """Загружает диапазон строк одной командой COPY в отдельной транзакции воркера"""
+    table, start, stop = task
+    columns, rows = WRITERS[table]
+    with connection.cursor() as cursor:
+        cursor.copy_expert(f'COPY {table} ({", ".join(columns)}) FROM STDIN', CopyStream(rows(_plan, start, stop)))
+    return table, stop - start
+
+
+def chunks(table, total, size):
+    return [(table, start, min(start + size, total)) for start in range(0, total, size)]
+
+
+class Generator:
+    """Быстрая загрузка больших объёмов синтетических данных через COPY FROM STDIN (только PostgreSQL).
+
+    В отличие от Seeder данные только добавляются: id выделяются после текущего максимума,
+    строки генерируют и грузят параллельные процессы, пароль у всех один (хеш считается один раз).
+    """
+
+    def __init__(self, workers=4, chunk_size=50000, log=print, **options):
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.log = log
+        self.plan = Plan(password=make_password(PASSWORD), now=datetime.now(dt_timezone.utc), **options)
+
+    def allocate_ids(self):
+        existing = set(Category.objects.filter(name__in=CATEGORIES).values_list('name', flat=True))
+        Category.objects.bulk_create([Category(name=name) for name in CATEGORIES if name not in existing])
+        self.plan.category_ids = list(Category.objects.filter(name__in=CATEGORIES).values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            for table in TABLES:
+                cursor.execute(f'SELECT COALESCE(MAX(id), 0) + 1 FROM {table}')
+                self.plan.bases[table] = cursor.fetchone()[0]
+
+    def run(self):
+        self.allocate_ids()
+        self.log('Готовим каталог (продавцы, цены, популярность товаров)')
+        self.plan.prepare()
+
+        # Форкнутые процессы не должны унаследовать открытые соединения родителя
+        connections.close_all()
+        buyer_chunk = max(1, self.chunk_size // max(1, (self.plan.reviews + self.plan.cart_items) // self.plan.buyers))
+        phases = (
+            # Внешние ключи проверяются при фиксации каждого COPY, поэтому этапы идут по порядку
+            chunks('shop_user', self.plan.sellers + self.plan.buyers, self.chunk_size),
+            chunks('shop_product', self.plan.products, self.chunk_size),
+            chunks('shop_order', self.plan.orders, self.chunk_size)
+            + (chunks('shop_review', self.plan.buyers, buyer_chunk) if self.plan.reviews else [])
+            + (chunks('shop_cartitem', self.plan.buyers, buyer_chunk) if self.plan.cart_items else []),
+            chunks('shop_orderline', self.plan.orders, self.chunk_size),
+        )
+        with multiprocessing.Pool(self.workers, initializer=_init_worker, initargs=(self.plan,)) as pool:
+            for tasks in phases:
+                for table, count in pool.imap_unordered(copy_chunk, tasks):
+                    self.log(f'{table}: +{count}')
+        self.finish()
+
+    def finish(self):
+        plan = self.plan
+        buyers_from = plan.bases['shop_user'] + plan.sellers
+        products_from = plan.bases['shop_product']
+        with connection.cursor() as cursor:
+            self.log('Подправляем последовательности id')
+            for table in TABLES:
+                cursor.execute(
+                    f"SELECT setval(pg_get_serial_sequence(%s, 'id'), (SELECT COALESCE(MAX(id), 1) FROM {table}))",
+                    [table],
+                )
+            self.log('Начальные проводки балансов и агрегаты рейтингов')
+            cursor.execute(
+                "INSERT INTO shop_balanceentry (user_id, kind, amount, created_at) "
+                "SELECT id, 'opening', balance, %s FROM shop_user WHERE id >= %s AND balance <> 0",
+                [plan.now, buyers_from],
+            )
+            cursor.execute(
+                """
+                UPDATE shop_product AS p SET
+                    rating_sum = r.rating_sum, rating_count = r.rating_count,
+                    rating_1 = r.rating_1, rating_2 = r.rating_2, rating_3 = r.rating_3,
+                    rating_4 = r.rating_4, rating_5 = r.rating_5
+                FROM (
+                    SELECT product_id, SUM(rating) AS rating_sum, COUNT(*) AS rating_count,
+                           COUNT(*) FILTER (WHERE rating = 1) AS rating_1,
+                           COUNT(*) FILTER (WHERE rating = 2) AS rating_2,
+                           COUNT(*) FILTER (WHERE rating = 3) AS rating_3,
+                           COUNT(*) FILTER (WHERE rating = 4) AS rating_4,
+                           COUNT(*) FILTER (WHERE rating = 5) AS rating_5
+                    FROM shop_review WHERE product_id >= %s GROUP BY product_id
+                ) AS r
+                WHERE p.id = r.product_id
+                """,
+                [products_from],
+            )
+        self.log('Пересчитываем статистику продавцов')
+        call_command('reconcile_seller_stats', stdout=StringIO())
+        # COPY обходит сигналы — сбрасываем кэш каталога
+        cache.clear()
+        with connection.cursor() as cursor:
+            self.log('ANALYZE')
+            for table in TABLES + ('shop_balanceentry', 'shop_sellerstats'):
+                cursor.execute(f'ANALYZE {table}')
@@ -0,0 +1,233 @@
+import json
+import math
+import random
+import re
+import subprocess
+import threading
+import time
+from collections import defaultdict
+from http.cookiejar import CookieJar
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote, urlencode
+from urllib.request import HTTPCookieProcessor, Request, build_opener
+
+from django.conf import settings
+from django.db import connection, connections
+from django.test import Client
+from django.utils import timezone
+
+from shop.metrics import QueryTimer
+from shop.models import Order, Product, Review, User
+from .data import PASSWORD, WORDS, buyer_name, seller_name
+
+SCENARIOS = ('browse_index', 'search', 'product_detail', 'add_to_cart', 'checkout', 'seller_dashboard')
+SERVER_TIMING_QUERIES = re.compile(r'desc="(\d+) queries"')
+
+
+def percentile(ordered, q):
+    """Перцентиль по ближайшему рангу из отсортированного списка"""
+    if not ordered:
+        return None
+    return ordered[max(0, math.ceil(q * len(ordered)) - 1)]
+
+
+class Recorder:
+    """Собирает замеры из всех потоков: (задержка, число SQL-запросов, успех)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = defaultdict(list)
+
+    def add(self, name, latency, queries, ok):
+        with self._lock:
+            self._samples[name].append((latency, queries, ok))
+
+    def report(self, elapsed):
+        scenarios = {}
+        for name, samples in sorted(self._samples.items()):
+            latencies = sorted(latency * 1000 for latency, _, _ in samples)
+            queries = sorted(count for _, count, _ in samples if count is not None)
+            scenarios[name] = {
+                'requests': len(samples),
+                'errors': sum(1 for _, _, ok in samples if not ok),
+                'throughput_rps': round(len(samples) / elapsed, 2),
+                'latency_ms': {
+                    'p50': round(percentile(latencies, 0.50), 2),
+                    'p95': round(percentile(latencies, 0.95), 2),
+                    'p99': round(percentile(latencies, 0.99), 2),
+                    'mean': round(sum(latencies) / len(latencies), 2),
+                    'max': round(latencies[-1], 2),
+                },
+                'queries': {
+                    'mean': round(sum(queries) / len(queries), 2),
+                    'p95': percentile(queries, 0.95),
+                    'max': queries[-1],
+                } if queries else None,
+            }
+        total = sum(len(samples) for samples in self._samples.values())
+        return {
+            'scenarios': scenarios,
+            'total': {'requests': total, 'elapsed_s': round(elapsed, 3), 'throughput_rps': round(total / elapsed, 2)},
+        }
+
+
+class ClientSession:
+    """Запросы к представлениям через django.test.Client в этом процессе; SQL считает execute_wrapper"""
+
+    def __init__(self, recorder):
+        self.recorder = recorder
+        self.client = Client()
+
+    def login(self, username):
+        self.client.force_login(User.objects.get(username=username))
+
+    def request(self, name, method, path, data=None):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timer.track():
+            if method == 'get':
+                response = self.client.get(path)
+            else:
+                response = self.client.post(path, json.dumps(data or {}), content_type='application/json')
+        self.recorder.add(name, time.perf_counter() - started, timer.count, response.status_code < 400)
+        return response.status_code
+
+
+class HttpSession:
+    """Запросы к запущенному серверу по HTTP; число SQL-запросов берётся из Server-Timing,
+    если сервер его отдаёт (DEBUG или пользователь из персонала)"""
+
+    def __init__(self, recorder, base_url):
+        self.recorder = recorder
+        self.base_url = base_url.rstrip('/')
+        self.cookies = CookieJar()
+        self.opener = build_opener(HTTPCookieProcessor(self.cookies))
+
+    def csrf_token(self):
+        return next((cookie.value for cookie in self.cookies if cookie.name == 'csrftoken'), '')
+
+    def login(self, username):
+        url = f'{self.base_url}/login/'
+        self.opener.open(url, timeout=30).read()
+        data = urlencode({'username': username, 'password': PASSWORD, 'csrfmiddlewaretoken': self.csrf_token()})
+        self.opener.open(Request(url, data=data.encode(), headers={'Referer': url}), timeout=30).read()
+
+    def request(self, name, method, path, data=None):
+        headers = {'X-Server-Timing': '1', 'Referer': self.base_url + '/'}
+        body = None
+        if method != 'get':
+            body = json.dumps(data or {}).encode()
+            headers.update({'Content-Type': 'application/json', 'X-CSRFToken': self.csrf_token()})
+        request = Request(self.base_url + path, data=body, headers=headers, method=method.upper())
+        timing = None
+        started = time.perf_counter()
+        try:
+            with self.opener.open(request, timeout=30) as response:
+                response.read()
+                status, timing = response.status, response.headers.get('Server-Timing')
+        except HTTPError as e:
+            e.read()
+            status, timing = e.code, e.headers.get('Server-Timing')
+        except (URLError, OSError):
+            status = 0
+        latency = time.perf_counter() - started
+        match = SERVER_TIMING_QUERIES.search(timing or '')
+        self.recorder.add(name, latency, int(match.group(1)) if match else None, 0 < status < 400)
+        return status
+
+
+class Workload:
+    """Действия покупателя и продавца; товары и поисковые слова выбираются генератором потока"""
+
+    def __init__(self, buyer, seller, product_ids, rng):
+        self.buyer = buyer
+        self.seller = seller
+        self.product_ids = product_ids
+        self.random = rng
+
+    def browse_index(self):
+        self.buyer.request('browse_index', 'get', '/')
+
+    def search(self):
+        self.buyer.request('search', 'get', f'/api/products/?search={quote(self.random.choice(WORDS))}')
+
+    def product_detail(self):
+        self.buyer.request('product_detail', 'get', f'/product/{self.random.choice(self.product_ids)}/')
+
+    def add_to_cart(self):
+        self.buyer.request('add_to_cart', 'post', '/api/cart/',
+                           {'product_id': self.random.choice(self.product_ids), 'quantity': 1})
+
+    def checkout(self):
+        self.add_to_cart()
+        self.buyer.request('checkout', 'post', '/api/orders/checkout/')
+
+    def seller_dashboard(self):
+        self.seller.request('seller_dashboard', 'get', '/seller/')
+
+
+def git_revision():
+    try:
+        result = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                                capture_output=True, text=True, timeout=5)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
+
+
+def run(scenarios=SCENARIOS, threads=4, iterations=50, driver='client', base_url=None, rng_seed=42):
+    """Прогоняет сценарии в threads потоках по iterations раз и возвращает отчёт (словарь для JSON)"""
+    buyers = User.objects.filter(username__startswith=buyer_name('')).count()
+    sellers = User.objects.filter(username__startswith=seller_name('')).count()
+    # Товары с запасом, чтобы добавление в корзину и оформление не упирались в остатки
+    product_ids = list(Product.objects.filter(stock__gte=10).order_by('id').values_list('id', flat=True)[:10000])
+    if not (buyers and sellers and product_ids):
+        raise ValueError('Нет данных для бенчмарка: сначала заполните базу')
+
+    recorder = Recorder()
+
+    def make_session():
+        return HttpSession(recorder, base_url) if driver == 'http' else ClientSession(recorder)
+
+    def worker(index):
+        try:
+            buyer, seller = make_session(), make_session()
+            buyer.login(buyer_name(index % buyers))
+            seller.login(seller_name(index % sellers))
+            workload = Workload(buyer, seller, product_ids, random.Random(rng_seed + index))
+            for _ in range(iterations):
+                for name in scenarios:
+                    getattr(workload, name)()
+        finally:
+            if threads > 1:
+                connections.close_all()
+
+    started_at = timezone.now()
+    started = time.perf_counter()
+    if threads == 1:
+        worker(0)
+    else:
+        pool = [threading.Thread(target=worker, args=(index,)) for index in range(threads)]
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+    report = recorder.report(time.perf_counter() - started)
+
+    report['meta'] = {
+        'commit': git_revision(),
+        'started_at': started_at.isoformat(),
+        'driver': driver,
+        'base_url': base_url,
+        'threads': threads,
+        'iterations': iterations,
+        'database': connection.vendor,
+        'dataset': {
+            'sellers': sellers,
+            'buyers': buyers,
+            'products': Product.objects.count(),
+            'orders': Order.objects.count(),
+            'reviews': Review.objects.count(),
+        },
+    }
+    return report
@@ -0,0 +1,253 @@
+import csv
+import io
+import json
+from datetime import datetime, time, timedelta
+from itertools import chain, islice
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from . import cache as catalog_cache
+from .models import Category, Order, Product
+from .stats import adjust_seller_stats
+
+
+# Колонки файла; category — id категории
+FIELDS = ('sku', 'name', 'description', 'price', 'stock', 'category')
+# Строка выгрузки заказов — позиция заказа: колонки заголовка повторяются, total_price — сумма позиции
+ORDER_FIELDS = ('id', 'created_at', 'updated_at', 'status', 'is_received', 'buyer', 'seller',
+                'product_id', 'product', 'quantity', 'price', 'total_price')
+ORDER_COLUMNS = ('id', 'created_at', 'updated_at', 'status', 'is_received', 'buyer__username',
+                 'seller__username', 'lines__product_id', 'lines__product__name', 'lines__quantity',
+                 'lines__price', 'lines__total_price')
+REQUIRED_FIELDS = ('sku', 'name', 'price')
+CONTENT_TYPES = {'csv': 'text/csv; charset=utf-8', 'jsonl': 'application/x-ndjson; charset=utf-8'}
+UPDATE_FIELDS = ('name', 'description', 'price', 'stock', 'category', 'updated_at')
+BATCH_SIZE = 1000
+MAX_REPORTED_ERRORS = 1000
+# Попыток записать пачку, если параллельный импорт создал те же артикулы
+WRITE_ATTEMPTS = 2
+
+
+class ImportFormatError(ValueError):
+    """Файл целиком не удаётся разобрать"""
+
+
+def detect_format(filename, requested=None):
+    fmt = (requested or filename.rsplit('.', 1)[-1]).lower()
+    if fmt in ('jsonl', 'ndjson'):
+        return 'jsonl'
+    if fmt == 'csv':
+        return 'csv'
+    raise ImportFormatError('Поддерживаются только файлы CSV и JSONL')
+
+
+def read_rows(binary_file, fmt):
+    """Читает загрузку построчно, не загружая её в память: (номер строки, словарь или None)"""
+    text = io.TextIOWrapper(binary_file, encoding='utf-8-sig', newline='')
+    try:
+        if fmt == 'csv':
+            reader = csv.DictReader(text)
+            missing = [name for name in REQUIRED_FIELDS if name not in (reader.fieldnames or ())]
+            if missing:
+                raise ImportFormatError(f'В заголовке CSV нет колонок: {", ".join(missing)}')
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(text, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError:
+                    row = None
+                yield line_no, row if isinstance(row, dict) else None
+    except UnicodeDecodeError:
+        raise ImportFormatError('Файл должен быть в кодировке UTF-8')
+
+
+def clean_row(row, category_ids):
+    """Проверяет строку импорта теми же валидаторами, что и модель: (значения, ошибки)"""
+    values, errors = {}, {}
+    for name in ('sku', 'name', 'price', 'stock'):
+        raw = row.get(name)
+        if isinstance(raw, str):
+            raw = raw.strip()
+        if name == 'stock' and raw in (None, ''):
+            raw = 0
+        try:
+            values[name] = Product._meta.get_field(name).clean(raw, None)
+        except ValidationError as exc:
+            errors[name] = exc.messages
+    if not errors.get('sku') and not values.get('sku'):
+        errors['sku'] = ['Укажите артикул']
+    values['description'] = str(row.get('description') or '')
+
+    category = row.get('category')
+    values['category'] = None
+    if category not in (None, ''):
+        try:
+            values['category'] = int(category)
+        except (TypeError, ValueError):
+            values['category'] = None
+        if values['category'] not in category_ids:
+            errors['category'] = ['Категория не найдена']
+    return values, errors
+
+
+def import_products(seller, rows, batch_size=BATCH_SIZE):
+    """Создаёт и обновляет товары продавца по артикулу пачками.
+
+    Каждая пачка пишется своей транзакцией (bulk_create + bulk_update), поэтому
+    ошибочные строки не мешают остальным; они перечисляются в отчёте.
+    """
+    def add_error(line, errors):
+        report['error_count'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'line': line, 'errors': errors})
+
+    category_ids = set(Category.objects.values_list('id', flat=True))
+    report = {'created': 0, 'updated': 0, 'error_count': 0, 'errors': []}
+    seen = set()
+    rows = iter(rows)
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return report
+        valid, lines = {}, {}
+        for line, row in batch:
+            if row is None:
+                values, errors = None, {'row': ['Строка не является JSON-объектом']}
+            else:
+                values, errors = clean_row(row, category_ids)
+            if not errors and values['sku'] in seen:
+                errors = {'sku': ['Артикул повторяется в файле']}
+            if errors:
+                add_error(line, errors)
+                continue
+            seen.add(values['sku'])
+            valid[values['sku']] = values
+            lines[values['sku']] = line
+        for _ in range(WRITE_ATTEMPTS):
+            if not valid:
+                break
+            try:
+                _write_batch(seller, valid, report)
+                break
+            except IntegrityError:
+                # Параллельный импорт создал те же артикулы и уже закоммитил их:
+                # при повторе они найдутся и обновятся, а не вставятся второй раз
+                continue
+        else:
+            for sku in valid:
+                add_error(lines[sku], {'sku': ['Артикул одновременно создаётся другим импортом, повторите загрузку']})
+
+
+@transaction.atomic
+def _write_batch(seller, values_by_sku, report):
+    # Блокируем обновляемые товары в общем порядке (по id), чтобы не потерять
+    # параллельное списание остатка и верно посчитать изменение total_stock
+    existing = {
+        product.sku: product
+        for product in Product.objects.select_for_update().filter(seller=seller, sku__in=list(values_by_sku))
+        .only('id', 'sku', 'stock').order_by('id')
+    }
+    now = timezone.now()
+    to_create, to_update = [], []
+    stock_delta = 0
+    for sku, values in values_by_sku.items():
+        product = existing.get(sku)
+        if product is None:
+            product = Product(seller=seller)
+            to_create.append(product)
+        else:
+            stock_delta -= product.stock
+            to_update.append(product)
+        stock_delta += values['stock']
+        for name in ('sku', 'name', 'description', 'price', 'stock'):
+            setattr(product, name, values[name])
+        product.category_id = values['category']
+        product.updated_at = now
+
+    Product.objects.bulk_create(to_create, batch_size=BATCH_SIZE)
+    Product.objects.bulk_update(to_update, UPDATE_FIELDS, batch_size=BATCH_SIZE)
+    if stock_delta:
+        adjust_seller_stats(seller.pk, total_stock=stock_delta)
+    # Сигналы модели при массовых операциях не срабатывают — сбрасываем кэш сами
+    updated_ids = [product.pk for product in to_update]
+    transaction.on_commit(lambda: catalog_cache.bump('products', *map(catalog_cache.product_scope, updated_ids)))
+    report['created'] += len(to_create)
+    report['updated'] += len(to_update)
+
+
+class _Echo:
+    """Псевдобуфер для csv.writer: возвращает строку вместо записи"""
+
+    def write(self, value):
+        return value
+
+
+def stream_rows(fields, rows, fmt, chunk_size=2000):
+    """Превращает поток кортежей в куски CSV/JSONL по мере чтения"""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(fields)
+        lines = (writer.writerow(row) for row in rows)
+    else:
+        lines = (json.dumps(dict(zip(fields, row)), ensure_ascii=False, cls=DjangoJSONEncoder) + '\n' for row in rows)
+    # Отдаём кусками, а не по строке: меньше мелких записей в сокет
+    while True:
+        chunk = ''.join(islice(lines, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_products(queryset, fmt, chunk_size=2000):
+    """Построчно выгружает товары в CSV/JSONL; память не зависит от размера каталога"""
+    rows = (
+        queryset.order_by('id')
+        .values_list('sku', 'name', 'description', 'price', 'stock', 'category_id')
+        .iterator(chunk_size=chunk_size)
+    )
+    return stream_rows(FIELDS, rows, fmt, chunk_size)
+
+
+def parse_order_filters(seller=None, status=None, date_from=None, date_to=None):
+    """Разбирает фильтры выгрузки заказов (из GET-параметров или опций команды).
+
+    status — список через запятую; даты — ГГГГ-ММ-ДД включительно, в часовом поясе сайта.
+    """
+    filters = {}
+    if seller:
+        try:
+            filters['seller_id'] = int(seller)
+        except (TypeError, ValueError):
+            raise ValueError('Неверный продавец')
+    if status:
+        statuses = [value.strip() for value in status.split(',') if value.strip()]
+        unknown = set(statuses) - set(dict(Order.STATUS_CHOICES))
+        if unknown:
+            raise ValueError(f'Неверный статус: {", ".join(sorted(unknown))}')
+        filters['status__in'] = statuses
+    for name, value, shift in (('created_at__gte', date_from, 0), ('created_at__lt', date_to, 1)):
+        if value:
+            day = parse_date(value) if isinstance(value, str) else value
+            if day is None:
+                raise ValueError(f'Неверная дата: {value}')
+            # Сравнение с границами, а не __date: так работает индекс по created_at
+            filters[name] = timezone.make_aware(datetime.combine(day + timedelta(days=shift), time.min))
+    return filters
+
+
+def export_orders(querysets, fmt, chunk_size=2000):
+    """Построчно выгружает позиции заказов (выборки по очереди, например Order и ArchivedOrder);
+    на PostgreSQL .iterator() читает серверным курсором"""
+    rows = chain.from_iterable(
+        queryset.order_by('id', 'lines__id').values_list(*ORDER_COLUMNS).iterator(chunk_size=chunk_size)
+        for queryset in querysets
+    )
+    return stream_rows(ORDER_FIELDS, rows, fmt, chunk_size)
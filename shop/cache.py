@@ -0,0 +1,101 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+
+MISSING = object()
+LOCK_TIMEOUT = 10
+
+
+class CacheStats:
+    """Счётчики попаданий и промахов кэша каталога в текущем процессе"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts = Counter()
+
+    def record(self, group, event):
+        with self._lock:
+            self._counts[(group, event)] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._counts)
+
+
+stats = CacheStats()
+
+
+def _version_key(scope):
+    return f'catalog:version:{scope}'
+
+
+def get_versions(*scopes):
+    """Текущие версии областей кэша; отсутствующие версии создаются заново.
+
+    Версия могла быть вытеснена: новое значение берётся из времени, как в bump(),
+    иначе оно совпало бы с ключами ещё живых устаревших записей.
+    """
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            seed = time.time_ns()
+            cache.add(key, seed, None)
+            versions[key] = cache.get(key, seed)
+    return [versions[key] for key in keys]
+
+
+def bump(*scopes):
+    """Инвалидирует всё, что закэшировано с участием указанных областей"""
+    for scope in scopes:
+        key = _version_key(scope)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # Версии нет (вытеснена или ещё не создана): новое значение точно не совпадёт со старыми ключами
+            cache.set(key, time.time_ns(), None)
+
+
+def product_scope(product_id):
+    return f'product:{product_id}'
+
+
+def bump_products(product_ids):
+    bump(*(product_scope(product_id) for product_id in product_ids))
+
+
+def get_or_compute(group, name, scopes, compute, timeout=None):
+    """Значение из кэша по ключу с версиями scopes; при промахе пересчитывает ровно один процесс.
+
+    Остальные запросы на время пересчёта ждут его результата (не дольше LOCK_TIMEOUT),
+    так что истечение популярного ключа не превращается в лавину одинаковых запросов к базе.
+    """
+    versions = get_versions(*scopes)
+    key = f'catalog:{group}:{name}:' + '.'.join(str(version) for version in versions)
+    timeout = settings.CATALOG_CACHE_TIMEOUT if timeout is None else timeout
+
+    value = cache.get(key, MISSING)
+    if value is not MISSING:
+        stats.record(group, 'hit')
+        return value
+    stats.record(group, 'miss')
+
+    lock_key = f'{key}:lock'
+    if cache.add(lock_key, 1, LOCK_TIMEOUT):
+        try:
+            value = compute()
+            cache.set(key, value, timeout)
+        finally:
+            cache.delete(lock_key)
+        return value
+
+    deadline = time.monotonic() + LOCK_TIMEOUT
+    while time.monotonic() < deadline:
+        time.sleep(0.05)
+        value = cache.get(key, MISSING)
+        if value is not MISSING:
+            return value
+    return compute()
@@ -0,0 +1,93 @@
+from django.db import connection, transaction
+from django.db.models import OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .models import CartItem, Product
+from .reservations import hold_stock_many
+
+# Сколько товаров можно добавить одним запросом
+MAX_BATCH = 100
+
+UPSERT_SQL = """
+    INSERT INTO {table} (user_id, product_id, quantity, added_at) VALUES {values}
+    ON CONFLICT (user_id, product_id) DO UPDATE SET quantity = {table}.quantity + EXCLUDED.quantity
+    RETURNING id, product_id, quantity
+"""
+
+
+class CartError(ValueError):
+    """Пакет добавления в корзину отклонён целиком; текст показывается покупателю"""
+
+
+def parse_cart_items(value):
+    """[{"product_id": 1, "quantity": 2}, ...] → {id товара: количество}; повторы товара складываются"""
+    if not isinstance(value, list) or not value:
+        raise CartError('items должен быть непустым списком')
+    if len(value) > MAX_BATCH:
+        raise CartError(f'Не больше {MAX_BATCH} товаров за раз')
+    quantities = {}
+    for item in value:
+        try:
+            product_id, quantity = int(item['product_id']), int(item.get('quantity', 1))
+        except (KeyError, TypeError, ValueError, AttributeError):
+            raise CartError('Каждая позиция — {"product_id": id, "quantity": количество}')
+        if quantity < 1:
+            raise CartError('Неверное количество')
+        quantities[product_id] = quantities.get(product_id, 0) + quantity
+    return quantities
+
+
+@transaction.atomic
+def add_to_cart(user, quantities):
+    """Добавляет товары в корзину: одна проверка остатков и один INSERT ... ON CONFLICT DO UPDATE.
+
+    Товары блокируются по возрастанию id, доступный остаток считается с учётом чужих резервов
+    и того, что уже лежит в корзине. Ошибка по любому товару отменяет весь пакет.
+    Возвращает [(id позиции, id товара, новое количество)].
+    """
+    in_cart = CartItem.objects.filter(user=user, product=OuterRef('pk')).values('quantity')
+    products = list(
+        Product.objects.select_for_update(of=('self',)).filter(id__in=quantities).order_by('id')
+        .with_available_stock(exclude_user=user)
+        .annotate(in_cart=Coalesce(Subquery(in_cart), 0))
+        .only('id', 'name', 'stock')
+    )
+    missing = set(quantities) - {product.id for product in products}
+    if missing:
+        raise CartError(f'Товар не найден: {", ".join(map(str, sorted(missing)))}')
+    shortages = [
+        f'{product.name} (доступно: {max(product.available_stock, 0)} шт., в корзине: {product.in_cart} шт.)'
+        for product in products if product.in_cart + quantities[product.id] > product.available_stock
+    ]
+    if shortages:
+        raise CartError(f'Недостаточно товара: {", ".join(shortages)}')
+
+    now = timezone.now()
+    params = []
+    for product in products:
+        params += [user.pk, product.id, quantities[product.id], now]
+    table = connection.ops.quote_name(CartItem._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(UPSERT_SQL.format(table=table, values=', '.join(['(%s, %s, %s, %s)'] * len(products))), params)
+        items = cursor.fetchall()
+    hold_stock_many(items)
+    return items
+
+
+def cart_summary(user):
+    """Позиции корзины с суммами и итог; всё считает один запрос"""
+    items = list(
+        CartItem.objects.filter(user=user).with_totals().order_by('id')
+        .values('id', 'product_id', 'product__name', 'product__price', 'quantity', 'line_total',
+                'cart_total', 'cart_quantity')
+    )
+    return {
+        'items': [
+            {'id': item['id'], 'product_id': item['product_id'], 'name': item['product__name'],
+             'price': item['product__price'], 'quantity': item['quantity'], 'line_total': item['line_total']}
+            for item in items
+        ],
+        'items_count': items[0]['cart_quantity'] if items else 0,
+        'total_price': items[0]['cart_total'] if items else 0,
+    }
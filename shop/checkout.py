@@ -0,0 +1,167 @@
+import functools
+import random
+import time
+
+from django.db import OperationalError, connections, transaction
+from django.db.models import Case, F, OuterRef, When
+from django.utils import timezone
+from rest_framework import status
+
+from . import cache as catalog_cache
+from .ledger import charge, record_purchases
+from .models import CartItem, Order, OrderLine, Product, StockReservation
+from .stats import record_orders_created
+
+# serialization_failure и deadlock_detected: транзакцию можно безопасно повторить
+RETRYABLE_PGCODES = {'40001', '40P01'}
+
+
+class CheckoutError(Exception):
+    """Заказ нельзя оформить; текст ошибки показывается покупателю"""
+
+    def __init__(self, message, status_code=status.HTTP_400_BAD_REQUEST):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def retry_on_serialization_failure(attempts=3, backoff=0.02):
+    """Повторяет транзакцию при конфликте сериализации или взаимной блокировке.
+
+    Декорируемая функция должна сама открывать transaction.atomic() и не вызываться внутри чужой транзакции.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            for attempt in range(1, attempts + 1):
+                try:
+                    return func(*args, **kwargs)
+                except OperationalError as error:
+                    pgcode = getattr(error.__cause__, 'pgcode', None)
+                    if pgcode not in RETRYABLE_PGCODES or attempt == attempts:
+                        raise
+                    time.sleep(backoff * attempt * (1 + random.random()))
+        return wrapper
+    return decorator
+
+
+@retry_on_serialization_failure()
+def place_order(buyer, cart_item_id):
+    """Оформляет заказ по позиции корзины одной транзакцией.
+
+    Остаток и баланс списываются условными UPDATE ... WHERE stock >= n / balance >= total,
+    поэтому проверка и изменение неразделимы. Порядок блокировок во всех сценариях оформления
+    одинаков: позиции корзины, товары (по возрастанию id), покупатель, счётчики продавца.
+    """
+    with transaction.atomic():
+        cart_item = CartItem.objects.select_related('product').filter(id=cart_item_id, user=buyer).first()
+        if cart_item is None:
+            raise CheckoutError('Товар в корзине не найден', status.HTTP_404_NOT_FOUND)
+
+        # Удаление позиции блокирует её: повторный запрос с той же позицией дождётся нас и ничего не найдёт
+        deleted, _ = CartItem.objects.filter(pk=cart_item.pk).delete()
+        if not deleted:
+            raise CheckoutError('Заказ по этой позиции уже оформлен', status.HTTP_409_CONFLICT)
+
+        product = cart_item.product
+        quantity = cart_item.quantity
+        total_price = product.price * quantity
+        now = timezone.now()
+
+        # Свой резерв покупателю гарантирован, чужие живые резервы трогать нельзя
+        others_held = StockReservation.objects.held_quantity(OuterRef('pk'), exclude_user=buyer)
+        if not Product.objects.filter(pk=product.pk, stock__gte=others_held + quantity).update(
+                stock=F('stock') - quantity, updated_at=now):
+            raise CheckoutError('Недостаточно товара на складе')
+
+        if not charge(buyer, total_price):
+            raise CheckoutError('Недостаточно средств на балансе')
+
+        order = Order.objects.create(
+            buyer=buyer,
+            seller_id=product.seller_id,
+            items_count=quantity,
+            total_price=total_price
+        )
+        OrderLine.objects.create(order=order, product=product, quantity=quantity, price=product.price,
+                                 total_price=total_price)
+        record_orders_created([order])
+        record_purchases([order])
+        transaction.on_commit(lambda: catalog_cache.bump_products([product.pk]))
+
+    buyer.refresh_from_db(fields=['balance'])
+    return order
+
+
+@retry_on_serialization_failure()
+def checkout_cart(buyer, cart_item_ids=None):
+    """Оформляет всю корзину (или выбранные позиции) одной транзакцией, возвращает созданные заказы.
+
+    Один заказ на продавца, товары корзины становятся его позициями (OrderLine). Число запросов
+    не зависит от размера корзины: блокировка позиций и товаров, одно списание баланса,
+    bulk_create заказов и позиций, одно UPDATE остатков, одно DELETE корзины и по UPDATE
+    счётчиков на продавца.
+    """
+    with transaction.atomic():
+        cart = CartItem.objects.filter(user=buyer)
+        if cart_item_ids is not None:
+            cart = cart.filter(id__in=cart_item_ids)
+        items = list(cart.select_for_update().order_by('id').values_list('id', 'product_id', 'quantity'))
+        if not items:
+            raise CheckoutError('Корзина пуста')
+
+        products = {
+            product.id: product
+            for product in Product.objects.select_for_update().filter(
+                id__in={product_id for _, product_id, _ in items}
+            ).order_by('id').only('id', 'seller_id', 'name', 'price', 'stock').with_available_stock(exclude_user=buyer)
+        }
+        shortages = [products[product_id].name for _, product_id, quantity in items
+                     if products[product_id].available_stock < quantity]
+        if shortages:
+            raise CheckoutError(f'Недостаточно товара на складе: {", ".join(shortages)}')
+
+        lines_by_seller = {}
+        for _, product_id, quantity in items:
+            product = products[product_id]
+            lines_by_seller.setdefault(product.seller_id, []).append(
+                OrderLine(product=product, quantity=quantity, price=product.price, total_price=product.price * quantity)
+            )
+        sellers = sorted(lines_by_seller)
+        orders = [
+            Order(
+                buyer=buyer,
+                seller_id=seller_id,
+                items_count=sum(line.quantity for line in lines_by_seller[seller_id]),
+                total_price=sum(line.total_price for line in lines_by_seller[seller_id]),
+            )
+            for seller_id in sellers
+        ]
+        total_price = sum(order.total_price for order in orders)
+
+        if not charge(buyer, total_price):
+            raise CheckoutError('Недостаточно средств на балансе')
+
+        if connections[Order.objects.db].features.can_return_rows_from_bulk_insert:
+            Order.objects.bulk_create(orders)
+        else:
+            for order in orders:
+                order.save()
+        # order_id берётся при присваивании, поэтому только после вставки заказов
+        lines = []
+        for order in orders:
+            for line in lines_by_seller[order.seller_id]:
+                line.order = order
+                lines.append(line)
+        OrderLine.objects.bulk_create(lines)
+
+        Product.objects.filter(id__in=products).update(
+            stock=Case(*[When(id=product_id, then=F('stock') - quantity) for _, product_id, quantity in items]),
+            updated_at=timezone.now(),
+        )
+        CartItem.objects.filter(id__in=[item_id for item_id, _, _ in items]).delete()
+        record_orders_created(orders)
+        record_purchases(orders)
+        transaction.on_commit(lambda: catalog_cache.bump_products(products))
+
+    buyer.refresh_from_db(fields=['balance'])
+    return orders
@@ -0,0 +1,73 @@
+import hashlib
+from calendar import timegm
+
+from django.db.models import Count, Max
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date, quote_etag
+
+
+# Политики Cache-Control: клиент хранит ответ, но перед использованием
+# переспрашивает сервер — повторный запрос стоит одного запроса к БД и 304
+REVALIDATE = {'max_age': 0, 'must_revalidate': True}
+PUBLIC_REVALIDATE = {'public': True, **REVALIDATE}
+PRIVATE_REVALIDATE = {'private': True, 'no_cache': True}
+# Категории меняются редко, минуту клиент может не спрашивать
+CATEGORIES_CACHE_CONTROL = {'public': True, 'max_age': 60}
+
+
+def make_etag(*parts):
+    """Сильный ETag из произвольных частей версии"""
+    digest = hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+    return quote_etag(digest)
+
+
+def collection_validators(queryset, *extra):
+    """ETag и Last-Modified набора строк: max(updated_at) и число строк одним запросом.
+
+    Число строк ловит удаление, max(updated_at) — изменение и добавление.
+    """
+    summary = queryset.order_by().aggregate(last_modified=Max('updated_at'), count=Count('pk'))
+    last_modified = summary['last_modified']
+    return make_etag(summary['count'], last_modified, *extra), last_modified
+
+
+def not_modified(request, etag=None, last_modified=None):
+    """Ответ 304 (или 412), если у клиента актуальная версия, иначе None"""
+    if request.method not in ('GET', 'HEAD'):
+        return None
+    timestamp = timegm(last_modified.utctimetuple()) if last_modified else None
+    return get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def set_validators(response, etag=None, last_modified=None, cache_control=REVALIDATE):
+    """Проставляет ETag, Last-Modified и Cache-Control успешному или 304-ответу"""
+    if response.status_code not in (200, 304):
+        return response
+    if etag:
+        response['ETag'] = etag
+    if last_modified:
+        response['Last-Modified'] = http_date(timegm(last_modified.utctimetuple()))
+    patch_cache_control(response, **cache_control)
+    return response
+
+
+class ConditionalMixin:
+    """list/retrieve отвечают 304 до выборки и сериализации, если данные не менялись"""
+    list_cache_control = PUBLIC_REVALIDATE
+    detail_cache_control = PUBLIC_REVALIDATE
+
+    def get_list_validators(self, request):
+        return None, None
+
+    def get_detail_validators(self, request):
+        return None, None
+
+    def list(self, request, *args, **kwargs):
+        etag, last_modified = self.get_list_validators(request)
+        response = not_modified(request, etag, last_modified) or super().list(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified, self.list_cache_control)
+
+    def retrieve(self, request, *args, **kwargs):
+        etag, last_modified = self.get_detail_validators(request)
+        response = not_modified(request, etag, last_modified) or super().retrieve(request, *args, **kwargs)
+        return set_validators(response, etag, last_modified, self.detail_cache_control)
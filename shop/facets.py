@@ -0,0 +1,148 @@
+from django.db import connections
+from django.db.models import Case, Count, F, IntegerField, Value, When
+
+from . import cache as catalog_cache
+from .models import Category, Product, User
+
+# Диапазоны цен в рублях: [от, до), последний без верхней границы
+PRICE_RANGES = ((0, 500), (500, 1000), (1000, 5000), (5000, 20000), (20000, None))
+PRICE_KEYS = {f'{low}-{high or ""}': (low, high) for low, high in PRICE_RANGES}
+RATING_STEPS = (4, 3, 2, 1)
+# Сколько продавцов с наибольшим числом товаров попадает в фасет
+MAX_SELLERS = 20
+DIMENSIONS = ('category_id', 'seller_id', 'price_bucket', 'rating_bucket', 'in_stock')
+
+
+def parse_facet_filters(params):
+    """Фильтры каталога из GET-параметров: category, seller, price (ключ из PRICE_KEYS), in_stock, min_rating.
+
+    Возвращает словарь только с заданными фильтрами; ValueError с понятным текстом.
+    """
+    filters = {}
+    for name in ('category', 'seller'):
+        value = params.get(name)
+        if value:
+            try:
+                filters[name] = int(value)
+            except ValueError:
+                raise ValueError(f'Неверный параметр {name}')
+    price = params.get('price')
+    if price:
+        if price not in PRICE_KEYS:
+            raise ValueError(f'Неверный диапазон цен, допустимы: {", ".join(PRICE_KEYS)}')
+        filters['price'] = price
+    if params.get('in_stock') in ('1', 'true'):
+        filters['in_stock'] = True
+    rating = params.get('min_rating')
+    if rating:
+        try:
+            rating = int(rating)
+        except ValueError:
+            rating = 0
+        if not 1 <= rating <= 5:
+            raise ValueError('min_rating — целое число от 1 до 5')
+        filters['min_rating'] = rating
+    return filters
+
+
+def apply_facet_filters(queryset, filters):
+    if 'category' in filters:
+        queryset = queryset.filter(category_id=filters['category'])
+    if 'seller' in filters:
+        queryset = queryset.filter(seller_id=filters['seller'])
+    if 'price' in filters:
+        low, high = PRICE_KEYS[filters['price']]
+        queryset = queryset.filter(price__gte=low)
+        if high is not None:
+            queryset = queryset.filter(price__lt=high)
+    if filters.get('in_stock'):
+        # По складскому остатку, без учёта резервов корзин
+        queryset = queryset.filter(stock__gt=0)
+    if 'min_rating' in filters:
+        # Средняя оценка >= r без деления: rating_sum >= r * rating_count
+        queryset = queryset.filter(rating_count__gt=0, rating_sum__gte=F('rating_count') * filters['min_rating'])
+    return queryset
+
+
+def _facet_rows(filters):
+    """Товары выборки со значениями всех измерений фасетов"""
+    price_bucket = Case(
+        *[When(price__lt=high, then=Value(index)) for index, (_, high) in enumerate(PRICE_RANGES) if high],
+        default=Value(len(PRICE_RANGES) - 1), output_field=IntegerField(),
+    )
+    # Целая часть средней оценки: «не ниже r» — сумма корзин от r и выше
+    rating_bucket = Case(When(rating_count=0, then=Value(0)), default=F('rating_sum') / F('rating_count'),
+                         output_field=IntegerField())
+    in_stock = Case(When(stock__gt=0, then=Value(1)), default=Value(0), output_field=IntegerField())
+    return apply_facet_filters(Product.objects.order_by(), filters).annotate(
+        price_bucket=price_bucket, rating_bucket=rating_bucket, in_stock=in_stock,
+    )
+
+
+def _grouped_counts(rows):
+    """{измерение: {значение: число товаров}} одним запросом GROUP BY GROUPING SETS"""
+    sql, params = rows.values(*DIMENSIONS).query.sql_with_params()
+    columns = ', '.join(DIMENSIONS)
+    sets = ', '.join(f'({column})' for column in DIMENSIONS)
+    counts = {dimension: {} for dimension in DIMENSIONS}
+    with connections[rows.db].cursor() as cursor:
+        cursor.execute(
+            f'SELECT {columns}, GROUPING({columns}), COUNT(*) FROM ({sql}) AS facet_rows '
+            f'GROUP BY GROUPING SETS ({sets})',
+            params,
+        )
+        for *values, grouping, count in cursor.fetchall():
+            # В GROUPING() бит столбца равен 0, если по нему сгруппирована строка; старший бит — первый столбец
+            for position, dimension in enumerate(DIMENSIONS):
+                if not grouping >> (len(DIMENSIONS) - 1 - position) & 1:
+                    counts[dimension][values[position]] = count
+    return counts
+
+
+def _separate_counts(rows):
+    """То же отдельным GROUP BY на измерение (СУБД без GROUPING SETS)"""
+    return {
+        dimension: dict(rows.values(dimension).annotate(count=Count('*')).values_list(dimension, 'count'))
+        for dimension in DIMENSIONS
+    }
+
+
+def facet_counts(filters):
+    """Счётчики фасетов для выборки с фильтрами filters.
+
+    Все счётчики считает один сгруппированный запрос (на PostgreSQL — GROUPING SETS),
+    ещё два маленьких запроса подставляют названия категорий и имена продавцов.
+    """
+    rows = _facet_rows(filters)
+    if connections[rows.db].vendor == 'postgresql':
+        counts = _grouped_counts(rows)
+    else:
+        counts = _separate_counts(rows)
+
+    by_category = sorted(((count, category_id) for category_id, count in counts['category_id'].items()
+                          if category_id is not None), reverse=True)
+    names = dict(Category.objects.filter(id__in=[category_id for _, category_id in by_category])
+                 .values_list('id', 'name'))
+    top_sellers = sorted(((count, seller_id) for seller_id, count in counts['seller_id'].items()),
+                         reverse=True)[:MAX_SELLERS]
+    usernames = dict(User.objects.filter(id__in=[seller_id for _, seller_id in top_sellers])
+                     .values_list('id', 'username'))
+    ratings = counts['rating_bucket']
+    return {
+        'total': sum(counts['in_stock'].values()),
+        'categories': [{'id': category_id, 'name': names.get(category_id, ''), 'count': count}
+                       for count, category_id in by_category],
+        'sellers': [{'id': seller_id, 'username': usernames.get(seller_id, ''), 'count': count}
+                    for count, seller_id in top_sellers],
+        'price': [{'key': key, 'min': low, 'max': high, 'count': counts['price_bucket'].get(index, 0)}
+                  for index, (key, (low, high)) in enumerate(PRICE_KEYS.items())],
+        'rating': [{'min_rating': step, 'count': sum(count for bucket, count in ratings.items() if bucket >= step)}
+                   for step in RATING_STEPS],
+        'in_stock': counts['in_stock'].get(1, 0),
+    }
+
+
+def cached_facet_counts(filters):
+    """facet_counts с кэшем на каждое сочетание фильтров; сбрасывается вместе со списками каталога"""
+    name = '&'.join(f'{key}={value}' for key, value in sorted(filters.items())) or 'all'
+    return catalog_cache.get_or_compute('facets', name, ['products', 'categories'], lambda: facet_counts(filters))
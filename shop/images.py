@@ -0,0 +1,121 @@
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import django
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import connections, transaction
+from django.db.models.functions import Now
+from PIL import Image, ImageOps
+
+from . import cache as catalog_cache
+
+logger = logging.getLogger(__name__)
+
+# Ширины миниатюр для srcset и форматы: (ключ, формат Pillow, параметры сохранения)
+WIDTHS = (320, 640, 1280)
+FORMATS = (
+    ('webp', 'WEBP', {'quality': 80, 'method': 4}),
+    ('jpeg', 'JPEG', {'quality': 82, 'optimize': True, 'progressive': True}),
+)
+
+_executor = None
+
+
+def get_executor():
+    """Общий пул процессов: ресайз упирается в CPU, потоки тут не помогут из-за GIL"""
+    global _executor
+    if _executor is None:
+        # spawn, а не fork: форк процесса с открытыми соединениями к БД и потоками небезопасен
+        _executor = ProcessPoolExecutor(
+            max_workers=settings.IMAGE_WORKERS,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=django.setup,
+        )
+    return _executor
+
+
+def variant_name(name, digest, width, ext):
+    """products/photo.jpg → products/photo.<хеш>.640w.webp (рядом с оригиналом)"""
+    stem = os.path.splitext(name)[0]
+    return f'{stem}.{digest}.{width}w.{ext}'
+
+
+def build_variants(name):
+    """Строит миниатюры оригинала; выполняется в процессе пула.
+
+    Имена содержат хеш содержимого, поэтому повторный запуск не пересохраняет файлы,
+    а новые миниатюры не конфликтуют со старыми в кэше браузера и CDN.
+    """
+    with default_storage.open(name, 'rb') as original:
+        data = original.read()
+    digest = hashlib.sha256(data).hexdigest()[:12]
+    with Image.open(io.BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source)
+        image.load()
+    # Маленький оригинал не растягиваем: одна миниатюра его собственной ширины
+    widths = [width for width in WIDTHS if width < image.width] or [image.width]
+
+    variants = {key: [] for key, _, _ in FORMATS}
+    for width in widths:
+        resized = image.copy()
+        resized.thumbnail((width, width * 4), Image.LANCZOS)
+        for key, fmt, options in FORMATS:
+            target = variant_name(name, digest, resized.width, key)
+            if not default_storage.exists(target):
+                mode = 'RGBA' if key == 'webp' and 'A' in resized.getbands() else 'RGB'
+                buffer = io.BytesIO()
+                resized.convert(mode).save(buffer, fmt, **options)
+                saved = default_storage.save(target, ContentFile(buffer.getvalue()))
+                if saved != target:
+                    # Параллельное задание успело сохранить тот же файл (имя по хешу совпало)
+                    default_storage.delete(saved)
+            variants[key].append([resized.width, target])
+    return variants
+
+
+def apply_variants(product_id, name, variants):
+    """Записывает миниатюры товару, если за время обработки картинку не заменили"""
+    from .models import Product
+
+    previous = Product.objects.filter(pk=product_id).values_list('image_variants', flat=True).first() or {}
+    updated = Product.objects.filter(pk=product_id, image=name).update(image_variants=variants, updated_at=Now())
+    if not updated:
+        return False
+    current = {target for items in variants.values() for _, target in items}
+    for items in previous.values():
+        for _, target in items:
+            if target not in current:
+                default_storage.delete(target)
+    catalog_cache.bump('products', catalog_cache.product_scope(product_id))
+    return True
+
+
+def _store_result(product_id, name, submitter, future):
+    try:
+        apply_variants(product_id, name, future.result())
+    except Exception:
+        logger.exception('Не удалось построить миниатюры для товара %s', product_id)
+    finally:
+        # Обычно колбэк выполняется в служебном потоке пула — его соединение с БД закрываем.
+        # Если задание завершилось до add_done_callback, мы в потоке запроса: его соединение не трогаем
+        if threading.get_ident() != submitter:
+            connections.close_all()
+
+
+def schedule_variants(product_id, name):
+    """Отправляет картинку товара в пул; результат запишет колбэк в этом процессе"""
+    future = get_executor().submit(build_variants, name)
+    future.add_done_callback(partial(_store_result, product_id, name, threading.get_ident()))
+    return future
+
+
+def schedule_after_commit(product_id, name):
+    transaction.on_commit(lambda: schedule_variants(product_id, name))
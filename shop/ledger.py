@@ -0,0 +1,85 @@
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F, OuterRef, Subquery, Sum
+from django.db.models.functions import Coalesce
+
+from .auth import invalidate_user
+from .models import BalanceEntry, User
+
+CENT = Decimal('0.01')
+MAX_TOPUP = Decimal('1000000')
+
+
+def parse_amount(value):
+    """Сумма пополнения из запроса в Decimal с копейками; ValueError с понятным текстом"""
+    try:
+        amount = Decimal(str(value).strip().replace(',', '.'))
+    except (InvalidOperation, TypeError):
+        raise ValueError('Неверная сумма')
+    if not amount.is_finite():
+        raise ValueError('Неверная сумма')
+    amount = amount.quantize(CENT)
+    if amount <= 0:
+        raise ValueError('Сумма должна быть больше нуля')
+    if amount > MAX_TOPUP:
+        raise ValueError('Максимальная сумма пополнения: 1,000,000 ₽')
+    return amount
+
+
+@transaction.atomic
+def credit(user, amount, kind=BalanceEntry.TOPUP, order=None):
+    """Зачисляет сумму: UPDATE balance = balance + amount и проводка в одной транзакции"""
+    User.objects.filter(pk=user.pk).update(balance=F('balance') + amount)
+    _balance_changed(user.pk)
+    entry = BalanceEntry.objects.create(user_id=user.pk, kind=kind, amount=amount, order=order)
+    user.refresh_from_db(fields=['balance'])
+    return entry
+
+
+def charge(user, amount):
+    """Списывает сумму, если её хватает; проводки пишет record_purchases после создания заказов"""
+    charged = bool(User.objects.filter(pk=user.pk, balance__gte=amount).update(balance=F('balance') - amount))
+    if charged:
+        _balance_changed(user.pk)
+    return charged
+
+
+def _balance_changed(user_id):
+    # UPDATE мимо save() не шлёт post_save: закэшированный пользователь токена показал бы старый баланс
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+def record_purchases(orders):
+    BalanceEntry.objects.bulk_create([
+        BalanceEntry(user_id=order.buyer_id, kind=BalanceEntry.PURCHASE, amount=-order.total_price, order=order)
+        for order in orders
+    ])
+
+
+def users_with_drift():
+    """Пользователи, у которых баланс не совпадает с суммой проводок (атрибут ledger_balance)"""
+    ledger = (
+        BalanceEntry.objects.filter(user=OuterRef('pk')).order_by().values('user')
+        .annotate(total=Sum('amount')).values('total')
+    )
+    return (
+        User.objects.annotate(ledger_balance=Coalesce(Subquery(ledger), Decimal('0')))
+        .exclude(balance=F('ledger_balance'))
+        .only('id', 'username', 'balance')
+        .order_by('id')
+    )
+
+
+def refund_orders(orders):
+    """Возвращает оплату отменённых заказов: одно UPDATE на покупателя (по возрастанию id) и проводки по заказам"""
+    totals = {}
+    for order in orders:
+        totals[order.buyer_id] = totals.get(order.buyer_id, Decimal('0')) + order.total_price
+    for buyer_id in sorted(totals):
+        User.objects.filter(pk=buyer_id).update(balance=F('balance') + totals[buyer_id])
+        _balance_changed(buyer_id)
+    BalanceEntry.objects.bulk_create([
+        BalanceEntry(user_id=order.buyer_id, kind=BalanceEntry.REFUND, amount=order.total_price, order=order)
+        for order in orders
+    ])
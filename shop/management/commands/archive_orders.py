@@ -0,0 +1,19 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from shop.orders import archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Переносит полученные и отменённые заказы в архив (ArchivedOrder), чтобы таблица заказов '
+            'оставалась маленькой; история и API читают обе таблицы')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=30, help='Архивировать заказы, закрытые раньше стольких дней')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        before = timezone.now() - timedelta(days=options['days'])
+        moved = archive_orders(before, options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Перенесено в архив: {moved}'))
@@ -0,0 +1,73 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from shop.facets import PRICE_KEYS, RATING_STEPS, _facet_rows, facet_counts
+from shop.models import Category, Product
+
+
+class Command(BaseCommand):
+    help = 'Замеряет подсчёт фасетов каталога без кэша на случайных сочетаниях фильтров (только PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--combinations', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--budget-ms', type=float, default=None,
+                            help='Ошибка, если медиана какого-либо сочетания выше')
+        parser.add_argument('--seed', type=int, default=0)
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Бенчмарк рассчитан на PostgreSQL')
+        if not Product.objects.exists():
+            raise CommandError('Каталог пуст: сначала заполните базу командой generate_data')
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE shop_product')
+
+        rng = random.Random(options['seed'])
+        category_ids = list(Category.objects.values_list('id', flat=True))
+        combinations = [{}] + [self.random_filters(rng, category_ids) for _ in range(options['combinations'] - 1)]
+        medians = []
+        for filters in combinations:
+            timings = []
+            for _ in range(options['repeat']):
+                started = time.perf_counter()
+                total = facet_counts(filters)['total']
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            medians.append(statistics.median(timings))
+            label = '&'.join(f'{key}={value}' for key, value in sorted(filters.items())) or 'all'
+            self.stdout.write(
+                f'{label:48} товаров: {total:>8}  медиана: {medians[-1]:8.1f} мс  '
+                f'p95: {timings[int(0.95 * (len(timings) - 1))]:8.1f} мс  макс: {timings[-1]:8.1f} мс  '
+                f'индекс: {"да" if self.uses_index(filters) else "нет"}'
+            )
+
+        budget = options['budget_ms']
+        if budget is not None and max(medians) > budget:
+            raise CommandError(f'Медиана {max(medians):.1f} мс превышает бюджет {budget:.1f} мс')
+
+    @staticmethod
+    def random_filters(rng, category_ids):
+        filters = {}
+        if category_ids and rng.random() < 0.7:
+            filters['category'] = rng.choice(category_ids)
+        if rng.random() < 0.5:
+            filters['price'] = rng.choice(list(PRICE_KEYS))
+        if rng.random() < 0.3:
+            filters['min_rating'] = rng.choice(RATING_STEPS)
+        if rng.random() < 0.3:
+            filters['in_stock'] = True
+        return filters
+
+    @staticmethod
+    def uses_index(filters):
+        """Читает ли план выборку фасетов через покрывающий индекс product_facet_idx"""
+        rows = _facet_rows(filters).values('id')
+        sql, params = rows.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN {sql}', params)
+            return any('product_facet_idx' in line for line, in cursor.fetchall())
@@ -0,0 +1,80 @@
+import random
+import statistics
+import time
+
+from django.core.cache import cache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Q
+from shop.benchmarks.data import WORDS
+from shop.models import Category, Product, User
+from shop.search import search_products
+from shop.stats import refresh_seller_stats
+
+DEFAULT_QUERIES = ['наушники', 'беспроводные наушники', 'кожаная сумка', 'смартфон чехол', 'велосипед детский']
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает полнотекстовый поиск с icontains на каталоге заданного размера (только PostgreSQL)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--products', type=int, default=1_000_000,
+                            help='Размер каталога; недостающие товары будут созданы')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--query', action='append', dest='queries')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Бенчмарк рассчитан на PostgreSQL')
+
+        self.seed(options['products'], options['batch_size'])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE shop_product')
+
+        for query in options['queries'] or DEFAULT_QUERIES:
+            variants = (
+                ('icontains', Product.objects.filter(
+                    Q(name__icontains=query) | Q(description__icontains=query)).order_by('-id')),
+                ('fulltext', search_products(Product.objects.all(), query)),
+            )
+            for label, queryset in variants:
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.perf_counter()
+                    hits = queryset.count()
+                    list(queryset.values_list('id', flat=True)[:20])
+                    timings.append((time.perf_counter() - started) * 1000)
+                self.stdout.write(
+                    f'{query!r:32} {label:10} совпадений: {hits:>8}  '
+                    f'медиана: {statistics.median(timings):8.1f} мс  макс: {max(timings):8.1f} мс'
+                )
+
+    def seed(self, total, batch_size):
+        missing = total - Product.objects.count()
+        if missing <= 0:
+            return
+
+        seller, _ = User.objects.get_or_create(username='bench_seller', defaults={'user_type': 'seller'})
+        category, _ = Category.objects.get_or_create(name='Бенчмарк')
+        self.stdout.write(f'Создаём товаров: {missing}')
+
+        while missing > 0:
+            batch = [
+                Product(
+                    seller=seller,
+                    category=category,
+                    name=' '.join(random.sample(WORDS, 3)),
+                    description=' '.join(random.choices(WORDS, k=40)),
+                    price=random.randint(100, 100000),
+                    stock=random.randint(0, 100),
+                )
+                for _ in range(min(batch_size, missing))
+            ]
+            # search_vector заполнит триггер
+            Product.objects.bulk_create(batch)
+            missing -= len(batch)
+
+        # bulk_create обходит сигналы: пересчитываем остаток продавца и сбрасываем кэш каталога
+        refresh_seller_stats(seller.pk)
+        cache.clear()
@@ -0,0 +1,72 @@
+import statistics
+import threading
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from shop.ledger import credit, users_with_drift
+from shop.models import User
+
+
+class Command(BaseCommand):
+    help = 'Нагрузочный тест пополнений баланса из параллельных потоков; проверяет, что деньги не теряются'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8)
+        parser.add_argument('--topups', type=int, default=200, help='Пополнений на поток')
+        parser.add_argument('--users', type=int, default=1,
+                            help='Сколько пользователей пополнять; 1 — все потоки бьются в одну строку')
+
+    def handle(self, *args, **options):
+        users = [
+            User.objects.get_or_create(username=f'bench_topup_{i}', defaults={'user_type': 'buyer'})[0]
+            for i in range(options['users'])
+        ]
+        before = {user.pk: user.balance for user in User.objects.filter(pk__in=[user.pk for user in users])}
+        amount = Decimal('0.01')
+        latencies, errors = [], []
+        done = [0] * options['threads']
+
+        def worker(index):
+            user = User.objects.get(pk=users[index % len(users)].pk)
+            try:
+                for _ in range(options['topups']):
+                    started = time.perf_counter()
+                    credit(user, amount)
+                    latencies.append(time.perf_counter() - started)
+                    done[index] += 1
+            except Exception as e:
+                errors.append(e)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(options['threads'])]
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started
+
+        expected = dict(before)
+        for index, count in enumerate(done):
+            expected[users[index % len(users)].pk] += amount * count
+        lost = [user for user in User.objects.filter(pk__in=before) if user.balance != expected[user.pk]]
+        drift = users_with_drift().filter(pk__in=before).count()
+
+        if latencies:
+            ordered = sorted(latencies)
+            self.stdout.write(
+                f'Пополнений: {len(latencies)} за {elapsed:.2f} с — {len(latencies) / elapsed:.0f} в секунду; '
+                f'p50 {statistics.median(ordered) * 1000:.1f} мс, '
+                f'p95 {ordered[int(len(ordered) * 0.95) - 1] * 1000:.1f} мс'
+            )
+        for error in errors:
+            self.stderr.write(f'Ошибка в потоке: {error}')
+        if lost or drift:
+            self.stdout.write(self.style.ERROR(
+                f'Баланс не сошёлся у {len(lost)} пользователей, расхождение с журналом у {drift}'
+            ))
+        else:
+            self.stdout.write(self.style.SUCCESS('Балансы и журнал сошлись'))
@@ -0,0 +1,42 @@
+from concurrent.futures import as_completed
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from shop.images import apply_variants, build_variants, get_executor
+from shop.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Строит миниатюры WebP/JPEG для уже загруженных картинок товаров в пуле процессов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Перестроить и те, у которых миниатюры уже есть')
+
+    def handle(self, *args, **options):
+        products = Product.objects.exclude(image='').exclude(image__isnull=True)
+        if not options['all']:
+            products = products.filter(image_variants={})
+
+        # Заданий в пуле одновременно не больше window: память не растёт с размером каталога
+        executor = get_executor()
+        window = settings.IMAGE_WORKERS * 4
+        pending, done, failed = {}, 0, 0
+
+        def collect(futures):
+            nonlocal done, failed
+            for future in futures:
+                product_id, name = pending.pop(future)
+                try:
+                    apply_variants(product_id, name, future.result())
+                    done += 1
+                except Exception as e:
+                    failed += 1
+                    self.stderr.write(f'Товар {product_id} ({name}): {e}')
+
+        for product_id, name in products.values_list('id', 'image').iterator(chunk_size=1000):
+            pending[executor.submit(build_variants, name)] = (product_id, name)
+            if len(pending) >= window:
+                collect([next(as_completed(pending))])
+        collect(list(as_completed(pending)))
+
+        self.stdout.write(self.style.SUCCESS(f'Обработано картинок: {done}, ошибок: {failed}'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from shop.bulk import export_orders, parse_order_filters
+from shop.models import ArchivedOrder, Order
+
+
+class Command(BaseCommand):
+    help = 'Выгружает заказы в CSV/JSONL потоком (для бухгалтерии и пакетных задач)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', dest='file_format', choices=['csv', 'jsonl'], default='csv')
+        parser.add_argument('--seller', help='id продавца')
+        parser.add_argument('--status', help='Статусы через запятую')
+        parser.add_argument('--date-from', help='С даты (ГГГГ-ММ-ДД), включительно')
+        parser.add_argument('--date-to', help='По дату (ГГГГ-ММ-ДД), включительно')
+        parser.add_argument('--output', help='Файл для записи; по умолчанию stdout')
+        parser.add_argument('--chunk-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            filters = parse_order_filters(options['seller'], options['status'],
+                                          options['date_from'], options['date_to'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        querysets = [Order.objects.filter(**filters), ArchivedOrder.objects.filter(**filters)]
+        chunks = export_orders(querysets, options['file_format'], options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                for chunk in chunks:
+                    output.write(chunk)
+            self.stderr.write(self.style.SUCCESS(f'Заказы выгружены в {options["output"]}'))
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk, ending='')
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from shop.benchmarks.generate import Generator
+
+
+class Command(BaseCommand):
+    help = ('Быстро генерирует большие объёмы данных (пользователи, товары, заказы, отзывы, корзины) '
+            'с реалистичным перекосом: популярность товаров по Ципфу, несколько крупных продавцов. '
+            'Загрузка через COPY в параллельных процессах, только PostgreSQL')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sellers', type=int, default=1000)
+        parser.add_argument('--buyers', type=int, default=100000)
+        parser.add_argument('--products', type=int, default=1000000)
+        parser.add_argument('--orders', type=int, default=10000000)
+        parser.add_argument('--reviews', type=int, default=1000000)
+        parser.add_argument('--cart-items', type=int, default=200000)
+        parser.add_argument('--whales', type=int, default=10, help='Число крупных продавцов')
+        parser.add_argument('--whale-share', type=float, default=0.5, help='Доля товаров у крупных продавцов')
+        parser.add_argument('--zipf', type=float, default=1.1, help='Показатель закона Ципфа для популярности')
+        parser.add_argument('--workers', type=int, default=4, help='Параллельных процессов COPY')
+        parser.add_argument('--chunk-size', type=int, default=50000, help='Строк в одном COPY')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--prefix', default='gen', help='Префикс имён пользователей')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Генератор работает только с PostgreSQL (COPY FROM STDIN)')
+        if min(options['sellers'], options['buyers'], options['products']) < 1:
+            raise CommandError('Нужны хотя бы один продавец, покупатель и товар')
+        if not 0 <= options['whales'] <= options['sellers'] or not 0 < options['whale_share'] < 1:
+            raise CommandError('--whales не больше --sellers, --whale-share между 0 и 1')
+        if options['reviews'] > options['buyers'] * options['products']:
+            raise CommandError('Отзывов больше, чем пар покупатель-товар')
+
+        generator = Generator(
+            workers=options['workers'],
+            chunk_size=options['chunk_size'],
+            log=self.stderr.write,
+            seed=options['seed'],
+            prefix=options['prefix'],
+            sellers=options['sellers'],
+            buyers=options['buyers'],
+            products=options['products'],
+            orders=options['orders'],
+            reviews=options['reviews'],
+            cart_items=options['cart_items'],
+            whales=options['whales'],
+            whale_share=options['whale_share'],
+            zipf=options['zipf'],
+        )
+        generator.run()
+        self.stdout.write(self.style.SUCCESS('Данные сгенерированы'))
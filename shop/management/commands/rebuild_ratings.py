@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from shop.models import Product, Review
+from shop.ratings import rebuild_rating_aggregates
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает денормализованные агрегаты рейтинга товаров по отзывам'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        fixed = rebuild_rating_aggregates(Product, Review, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Исправлено товаров: {fixed}'))
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop.models import BalanceEntry
+from shop.ledger import users_with_drift
+
+
+class Command(BaseCommand):
+    help = 'Сверяет балансы пользователей с суммой проводок журнала'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true',
+                            help='Записать корректирующие проводки, чтобы журнал сошёлся с балансом')
+
+    def handle(self, *args, **options):
+        drifted = 0
+        for user in users_with_drift().iterator(chunk_size=1000):
+            drifted += 1
+            diff = user.balance - user.ledger_balance
+            self.stdout.write(f'{user.username} (id {user.pk}): баланс {user.balance}, '
+                              f'по журналу {user.ledger_balance}, разница {diff}')
+            if options['fix']:
+                with transaction.atomic():
+                    # Перепроверяем под блокировкой: баланс мог измениться после выборки
+                    user = users_with_drift().select_for_update(of=('self',)).filter(pk=user.pk).first()
+                    if user is not None:
+                        BalanceEntry.objects.create(user=user, kind=BalanceEntry.ADJUSTMENT,
+                                                    amount=user.balance - user.ledger_balance)
+
+        verb = 'Исправлено' if options['fix'] else 'Найдено'
+        style = self.style.SUCCESS if not drifted or options['fix'] else self.style.WARNING
+        self.stdout.write(style(f'{verb} расхождений: {drifted}'))
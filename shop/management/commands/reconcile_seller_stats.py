@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from shop.models import SellerStats
+from shop.stats import STATS_FIELDS, compute_seller_stats
+
+
+class Command(BaseCommand):
+    help = 'Сверяет таблицу SellerStats с заказами и товарами и исправляет расхождения'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Только показать расхождения')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = compute_seller_stats()
+            stored = {stats.seller_id: stats for stats in SellerStats.objects.select_for_update()}
+
+            drifted, missing = [], []
+            for seller_id, values in expected.items():
+                stats = stored.pop(seller_id, None)
+                if stats is None:
+                    missing.append(SellerStats(seller_id=seller_id, **values))
+                    continue
+                diff = {field: (getattr(stats, field), value) for field, value in values.items()
+                        if getattr(stats, field) != value}
+                if diff:
+                    self.stdout.write(f'Продавец {seller_id}: ' + ', '.join(
+                        f'{field} {old} → {new}' for field, (old, new) in diff.items()))
+                    for field, (_, value) in diff.items():
+                        setattr(stats, field, value)
+                    drifted.append(stats)
+
+            # Строки продавцов, у которых не осталось ни заказов, ни товаров
+            for stats in stored.values():
+                if any(getattr(stats, field) for field in STATS_FIELDS):
+                    for field in STATS_FIELDS:
+                        setattr(stats, field, 0)
+                    drifted.append(stats)
+
+            if not options['dry_run']:
+                SellerStats.objects.bulk_create(missing, batch_size=1000)
+                SellerStats.objects.bulk_update(drifted, STATS_FIELDS, batch_size=1000)
+
+        verb = 'Найдено' if options['dry_run'] else 'Исправлено'
+        self.stdout.write(self.style.SUCCESS(
+            f'{verb} расхождений: {len(drifted)}, создано строк: {0 if options["dry_run"] else len(missing)}'
+        ))
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from shop.reservations import release_expired_reservations
+
+
+class Command(BaseCommand):
+    help = 'Снимает истёкшие резервы товаров в корзинах (запускать периодически, например из cron)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Снято резервов: {released}'))
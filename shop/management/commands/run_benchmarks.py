@@ -0,0 +1,56 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from shop.benchmarks.data import Seeder
+from shop.benchmarks.runner import SCENARIOS, run
+
+
+class Command(BaseCommand):
+    help = ('Заполняет базу синтетическими данными и прогоняет сценарии (каталог, поиск, товар, корзина, '
+            'оформление, кабинет продавца); отчёт p50/p95/p99, пропускная способность и SQL-запросы в JSON')
+
+    def add_arguments(self, parser):
+        seed = parser.add_argument_group('данные')
+        seed.add_argument('--sellers', type=int, default=100, help='Например, 10000')
+        seed.add_argument('--buyers', type=int, default=1000)
+        seed.add_argument('--products', type=int, default=10000, help='Например, 1000000')
+        seed.add_argument('--orders', type=int, default=100000, help='Например, 10000000')
+        seed.add_argument('--reviews', type=int, default=50000, help='Например, 5000000')
+        seed.add_argument('--batch-size', type=int, default=5000)
+        seed.add_argument('--skip-seed', action='store_true', help='Не дозаполнять базу')
+
+        load = parser.add_argument_group('нагрузка')
+        load.add_argument('--driver', choices=['client', 'http'], default='client',
+                          help='client — тестовый клиент Django в процессе, http — запущенный сервер по --url')
+        load.add_argument('--url', default='http://127.0.0.1:8000')
+        load.add_argument('--threads', type=int, default=4)
+        load.add_argument('--iterations', type=int, default=50, help='Проходов по сценариям на поток')
+        load.add_argument('--scenario', action='append', dest='scenarios', choices=SCENARIOS)
+        load.add_argument('--seed', type=int, default=42, help='Зерно генератора данных и нагрузки')
+        load.add_argument('--output', help='Файл для JSON-отчёта; по умолчанию stdout')
+
+    def handle(self, *args, **options):
+        if not options['skip_seed']:
+            seeder = Seeder(options['batch_size'], options['seed'], log=self.stderr.write)
+            seeder.seed(options['sellers'], options['buyers'], options['products'],
+                        options['orders'], options['reviews'])
+
+        try:
+            report = run(
+                scenarios=options['scenarios'] or SCENARIOS,
+                threads=options['threads'],
+                iterations=options['iterations'],
+                driver=options['driver'],
+                base_url=options['url'] if options['driver'] == 'http' else None,
+                rng_seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as file:
+                file.write(output + '\n')
+            self.stderr.write(self.style.SUCCESS(f'Отчёт записан в {options["output"]}'))
+        else:
+            self.stdout.write(output)
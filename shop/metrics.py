@@ -0,0 +1,187 @@
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+
+from . import cache as catalog_cache
+from .auth import CachedTokenAuthentication
+
+# Границы корзин гистограмм (Prometheus: le — «меньше или равно»)
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SIZE_BUCKETS = (1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+# Метод приходит от клиента: прочие значения сводятся к одной метке, иначе число рядов не ограничено
+METHODS = frozenset(('GET', 'HEAD', 'POST', 'PUT', 'PATCH', 'DELETE', 'OPTIONS'))
+
+HISTOGRAMS = (
+    # (имя метрики, описание, корзины)
+    ('magazin_request_duration_seconds', 'Полное время обработки запроса', SECONDS_BUCKETS),
+    ('magazin_request_db_queries', 'Число SQL-запросов на запрос', QUERY_BUCKETS),
+    ('magazin_request_db_duration_seconds', 'Время SQL-запросов на запрос', SECONDS_BUCKETS),
+    ('magazin_response_size_bytes', 'Размер тела ответа', SIZE_BUCKETS),
+)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Гистограммы по имени URL в памяти процесса; у каждого воркера свои"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._responses = Counter()
+
+    def observe(self, view, duration, queries, db_duration, size=None):
+        values = (duration, queries, db_duration, size)
+        with self._lock:
+            for (name, _, buckets), value in zip(HISTOGRAMS, values):
+                if value is None:
+                    continue
+                histogram = self._histograms.get((name, view))
+                if histogram is None:
+                    histogram = self._histograms[(name, view)] = Histogram(buckets)
+                histogram.observe(value)
+
+    def reset(self):
+        with self._lock:
+            self._histograms.clear()
+            self._responses.clear()
+
+    def count_response(self, view, method, status):
+        with self._lock:
+            self._responses[(view, method, status)] += 1
+
+    def render(self):
+        """Текстовый формат Prometheus"""
+        lines = []
+        with self._lock:
+            for name, description, buckets in HISTOGRAMS:
+                lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+                for (metric, view), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(buckets + ('+Inf',), histogram.counts):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{{view="{view}",le="{bound}"}} {cumulative}')
+                    lines.append(f'{name}_sum{{view="{view}"}} {histogram.sum:g}')
+                    lines.append(f'{name}_count{{view="{view}"}} {histogram.count}')
+            lines += ['# HELP magazin_responses_total Ответы по представлению, методу и статусу',
+                      '# TYPE magazin_responses_total counter']
+            for (view, method, status), count in sorted(self._responses.items()):
+                lines.append(f'magazin_responses_total{{view="{view}",method="{method}",status="{status}"}} {count}')
+
+        lines += ['# HELP magazin_catalog_cache_events_total Попадания и промахи кэша каталога',
+                  '# TYPE magazin_catalog_cache_events_total counter']
+        for (group, event), count in sorted(catalog_cache.stats.snapshot().items()):
+            lines.append(f'magazin_catalog_cache_events_total{{group="{group}",event="{event}"}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class QueryTimer:
+    """Обёртка connection.execute_wrapper: считает запросы и их время"""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+    def track(self):
+        """Подключает счётчик ко всем соединениям (алиасам БД) текущего потока"""
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(self))
+        return stack
+
+
+class RequestMetricsMiddleware:
+    """Замеряет каждый запрос: SQL (число и время), полное время и размер ответа.
+
+    Стоит первым в MIDDLEWARE, чтобы учитывать и запросы сессий/аутентификации.
+    Заголовок запроса X-Server-Timing: 1 возвращает замеры в Server-Timing
+    (персоналу — по сессии или bearer-токену — или при DEBUG).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with timer.track():
+            response = self.get_response(request)
+
+        match = getattr(request, 'resolver_match', None)
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        method = request.method if request.method in METHODS else 'other'
+        registry.count_response(view, method, response.status_code)
+
+        if response.streaming:
+            # Потоковый ответ читает БД уже после выхода из middleware — досчитываем по мере отдачи
+            response.streaming_content = self.measure_stream(response.streaming_content, timer, started, view)
+        else:
+            duration = time.perf_counter() - started
+            registry.observe(view, duration, timer.count, timer.duration, len(response.content))
+            if self.wants_timing(request):
+                response['Server-Timing'] = (
+                    f'db;dur={timer.duration * 1000:.1f};desc="{timer.count} queries", '
+                    f'total;dur={duration * 1000:.1f}'
+                )
+        return response
+
+    @staticmethod
+    def measure_stream(content, timer, started, view):
+        size = 0
+        try:
+            with timer.track():
+                for chunk in content:
+                    size += len(chunk)
+                    yield chunk
+        finally:
+            registry.observe(view, time.perf_counter() - started, timer.count, timer.duration, size)
+
+    @staticmethod
+    def wants_timing(request):
+        """Персонал по сессии или по bearer-токену.
+
+        В API-представлениях DRF сам кладёт владельца токена в request.user; для остальных
+        страниц токен разбирается здесь (пользователь берётся из кэша, как в API).
+        """
+        if request.headers.get('X-Server-Timing') != '1':
+            return False
+        if settings.DEBUG:
+            return True
+        user = getattr(request, 'user', None)
+        if user is None or not user.is_authenticated:
+            try:
+                user, _ = CachedTokenAuthentication().authenticate(request) or (None, None)
+            except AuthenticationFailed:
+                return False
+        return bool(user and user.is_staff)
@@ -0,0 +1,55 @@
+# Generated by Django 3.2.19 on 2026-10-18 02:57
+
+from django.db import migrations, models
+
+from shop.ratings import rebuild_rating_aggregates
+
+
+def fill_rating_aggregates(apps, schema_editor):
+    rebuild_rating_aggregates(apps.get_model('shop', 'Product'), apps.get_model('shop', 'Review'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0004_auto_20251211_0535'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='rating_1',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_2',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_3',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_4',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_5',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='product',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(fill_rating_aggregates, migrations.RunPython.noop),
+    ]
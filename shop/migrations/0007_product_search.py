@@ -0,0 +1,68 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:40
+
+import django.contrib.postgres.search
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+SEARCH_VECTOR_SQL = """
+    setweight(to_tsvector('pg_catalog.russian', coalesce({row}.name, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.simple', coalesce({row}.name, '')), 'A') ||
+    setweight(to_tsvector('pg_catalog.russian', coalesce({row}.description, '')), 'B') ||
+    setweight(to_tsvector('pg_catalog.simple', coalesce({row}.description, '')), 'C')
+"""
+
+FORWARD_SQL = """
+CREATE OR REPLACE FUNCTION shop_product_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := {new_vector};
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER shop_product_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, description ON shop_product
+    FOR EACH ROW EXECUTE PROCEDURE shop_product_search_vector_update();
+
+UPDATE shop_product SET search_vector = {table_vector};
+
+CREATE INDEX product_search_idx ON shop_product USING gin (search_vector);
+CREATE INDEX product_name_trgm_idx ON shop_product USING gin (name gin_trgm_ops);
+""".format(
+    new_vector=SEARCH_VECTOR_SQL.format(row='NEW'),
+    table_vector=SEARCH_VECTOR_SQL.format(row='shop_product'),
+)
+
+REVERSE_SQL = """
+DROP INDEX IF EXISTS product_name_trgm_idx;
+DROP INDEX IF EXISTS product_search_idx;
+DROP TRIGGER IF EXISTS shop_product_search_vector_trigger ON shop_product;
+DROP FUNCTION IF EXISTS shop_product_search_vector_update();
+"""
+
+
+def create_search_objects(apps, schema_editor):
+    # Триггер и GIN-индексы есть только у PostgreSQL
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(FORWARD_SQL)
+
+
+def drop_search_objects(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(REVERSE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_keyset_indexes'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_objects, drop_search_objects),
+    ]
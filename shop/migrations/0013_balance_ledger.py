@@ -0,0 +1,47 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:17
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_ledger(apps, schema_editor):
+    """Текущие балансы становятся начальными проводками журнала"""
+    User = apps.get_model('shop', 'User')
+    BalanceEntry = apps.get_model('shop', 'BalanceEntry')
+    batch = []
+    for user_id, balance in User.objects.exclude(balance=0).values_list('id', 'balance').iterator(chunk_size=2000):
+        batch.append(BalanceEntry(user_id=user_id, kind='opening', amount=balance))
+        if len(batch) >= 2000:
+            BalanceEntry.objects.bulk_create(batch)
+            batch = []
+    BalanceEntry.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_product_image_variants'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BalanceEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('opening', 'Начальный баланс'), ('topup', 'Пополнение'), ('purchase', 'Оплата заказа'), ('refund', 'Возврат'), ('adjustment', 'Корректировка')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=12)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('order', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='balance_entries', to='shop.order')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balance_entries', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name_plural': 'Balance entries',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='balanceentry',
+            index=models.Index(fields=['user', '-created_at'], name='balance_entry_user_idx'),
+        ),
+        migrations.RunPython(open_ledger, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,72 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:39
+
+from decimal import Decimal
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+CENT = Decimal('0.01')
+
+
+def split_lines(apps, schema_editor):
+    """Каждый существующий заказ (и архивный) получает одну позицию с его товаром и количеством.
+
+    Старые заказы не объединяются: на их id ссылаются проводки журнала баланса.
+    """
+    for order_name, line_name in (('Order', 'OrderLine'), ('ArchivedOrder', 'ArchivedOrderLine')):
+        Order = apps.get_model('shop', order_name)
+        OrderLine = apps.get_model('shop', line_name)
+        Order.objects.update(items_count=models.F('quantity'))
+        batch = []
+        rows = Order.objects.order_by('id').values_list('id', 'product_id', 'quantity', 'total_price')
+        for order_id, product_id, quantity, total_price in rows.iterator(chunk_size=2000):
+            batch.append(OrderLine(order_id=order_id, product_id=product_id, quantity=quantity,
+                                   price=(total_price / quantity).quantize(CENT), total_price=total_price))
+            if len(batch) >= 2000:
+                OrderLine.objects.bulk_create(batch)
+                batch = []
+        OrderLine.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0016_archived_orders'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='items_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='OrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField(validators=[django.core.validators.MinValueValidator(1)])),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shop.order')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='order_lines', to='shop.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.IntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='shop.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_order_lines', to='shop.product')),
+            ],
+        ),
+        migrations.RunPython(split_lines, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:39
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # Отдельно от 0017: на PostgreSQL ALTER TABLE в одной транзакции с только что вставленными
+    # позициями упал бы с "pending trigger events" (отложенные проверки внешних ключей)
+
+    dependencies = [
+        ('shop', '0017_order_lines'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='archivedorder',
+            name='product',
+        ),
+        migrations.RemoveField(
+            model_name='archivedorder',
+            name='quantity',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='product',
+        ),
+        migrations.RemoveField(
+            model_name='order',
+            name='quantity',
+        ),
+    ]
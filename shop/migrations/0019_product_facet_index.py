@@ -0,0 +1,17 @@
+# Generated by Django 3.2.19 on 2026-10-18 03:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0018_remove_order_product'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category', 'price'], include=('seller', 'stock', 'rating_sum', 'rating_count'), name='product_facet_idx'),
+        ),
+    ]
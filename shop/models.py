@@ -1,5 +1,8 @@
 from django.db import models
+from django.db.models import DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Window
+from django.db.models.functions import Coalesce, Now
 from django.contrib.auth.models import AbstractUser
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import MinValueValidator, MaxValueValidator
 
 
@@ -22,6 +25,7 @@ class User(AbstractUser):
 class Category(models.Model):
     name = models.CharField(max_length=100)
     description = models.TextField(blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
 
     class Meta:
         verbose_name_plural = 'Categories'
@@ -30,29 +34,115 @@ class Category(models.Model):
         return self.name
 
 
+class ProductQuerySet(models.QuerySet):
+    def apply_rating(self, rating, delta=1):
+        """Атомарно меняет агрегаты рейтинга: delta=1 — отзыв добавлен, delta=-1 — удалён"""
+        rating = int(rating)
+        return self.update(**{
+            'rating_sum': F('rating_sum') + rating * delta,
+            'rating_count': F('rating_count') + delta,
+            f'rating_{rating}': F(f'rating_{rating}') + delta,
+            'updated_at': Now(),
+        })
+
+    def with_available_stock(self, exclude_user=None):
+        """Добавляет reserved_stock и available_stock = stock минус живые резервы (одним подзапросом)"""
+        return self.annotate(
+            reserved_stock=StockReservation.objects.held_quantity(OuterRef('pk'), exclude_user=exclude_user),
+            available_stock=F('stock') - F('reserved_stock'),
+        )
+
+
+class ProductManager(models.Manager.from_queryset(ProductQuerySet)):
+    def get_queryset(self):
+        # Поисковый вектор нужен только внутри SQL-условий, в Python его не читаем
+        return super().get_queryset().defer('search_vector')
+
+
 class Product(models.Model):
     seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='products')
-    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products')
+    # Отдельный индекс по FK не нужен: category — первая колонка product_category_created_idx
+    category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='products',
+                                 db_index=False)
     name = models.CharField(max_length=200)
+    # Артикул продавца: ключ массового импорта, уникален в пределах продавца
+    sku = models.CharField(max_length=64, blank=True, default='')
     description = models.TextField()
     price = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(0)])
     stock = models.IntegerField(default=0, validators=[MinValueValidator(0)])
     image = models.ImageField(upload_to='products/', blank=True, null=True)
+    # Миниатюры картинки по форматам: {"webp": [[ширина, путь], ...], "jpeg": [...]} (см. shop/images.py)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Денормализованные агрегаты отзывов (обновляются вместе с Review)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+    rating_1 = models.PositiveIntegerField(default=0)
+    rating_2 = models.PositiveIntegerField(default=0)
+    rating_3 = models.PositiveIntegerField(default=0)
+    rating_4 = models.PositiveIntegerField(default=0)
+    rating_5 = models.PositiveIntegerField(default=0)
 
+    # Заполняется триггером PostgreSQL из name и description (см. миграцию 0007),
+    # там же GIN-индексы по вектору и триграммам названия
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='product_created_idx'),
+            models.Index(fields=['updated_at'], name='product_updated_idx'),
+            # Каталог с фильтром по категории в порядке ключевой пагинации
+            models.Index(fields=['category', '-created_at', '-id'], name='product_category_created_idx'),
+            # Фасеты: в индексе все столбцы фильтров и счётчиков, поэтому COUNT читает только индекс
+            models.Index(fields=['category', 'price'], include=['seller', 'stock', 'rating_sum', 'rating_count'],
+                         name='product_facet_idx'),
+        ]
+        constraints = [
+            models.UniqueConstraint(fields=['seller', 'sku'], condition=~Q(sku=''), name='product_seller_sku_uniq'),
+        ]
 
     def __str__(self):
         return self.name
 
     @property
     def average_rating(self):
-        reviews = self.reviews.all()
-        if reviews:
-            return sum([r.rating for r in reviews]) / len(reviews)
+        if self.rating_count:
+            return self.rating_sum / self.rating_count
         return 0
 
+    @property
+    def rating_histogram(self):
+        """Количество отзывов по оценкам 1–5"""
+        return {rating: getattr(self, f'rating_{rating}') for rating in range(1, 6)}
+
+    @property
+    def image_srcset(self):
+        """Значения srcset по форматам; пусто, пока миниатюры не построены"""
+        if not self.image:
+            return {}
+        storage = self.image.storage
+        return {fmt: ', '.join(f'{storage.url(name)} {width}w' for width, name in variants)
+                for fmt, variants in self.image_variants.items()}
+
+
+class CartItemQuerySet(models.QuerySet):
+    def with_totals(self):
+        """Добавляет line_total (цена × количество) и итоги всей выборки cart_total и cart_quantity.
+
+        Итоги считает оконная функция SUM() OVER (), поэтому всё читается одним запросом.
+        """
+        line_total = ExpressionWrapper(F('quantity') * F('product__price'),
+                                       output_field=DecimalField(max_digits=14, decimal_places=2))
+        return self.annotate(
+            line_total=line_total,
+            cart_total=Window(Sum(line_total)),
+            cart_quantity=Window(Sum('quantity')),
+        )
+
 
 class CartItem(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='cart_items')
@@ -60,8 +150,14 @@ class CartItem(models.Model):
     quantity = models.IntegerField(default=1, validators=[MinValueValidator(1)])
     added_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
     class Meta:
         unique_together = ('user', 'product')
+        indexes = [
+            # Оформление блокирует корзину покупателя в порядке id
+            models.Index(fields=['user', 'id'], name='cartitem_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} x{self.quantity}"
@@ -71,6 +167,57 @@ class CartItem(models.Model):
         return self.product.price * self.quantity
 
 
+class StockReservationQuerySet(models.QuerySet):
+    def live(self):
+        return self.filter(expires_at__gt=Now())
+
+    def expired(self):
+        return self.filter(expires_at__lte=Now())
+
+    def held_quantity(self, product, exclude_user=None):
+        """Выражение: сколько единиц товара держат живые резервы (кроме резервов exclude_user)"""
+        held = self.live().filter(product=product)
+        if exclude_user is not None:
+            held = held.exclude(cart_item__user=exclude_user)
+        held = held.order_by().values('product').annotate(total=Sum('quantity')).values('total')
+        return Coalesce(Subquery(held, output_field=models.IntegerField()), 0)
+
+
+class StockReservation(models.Model):
+    """Остаток, удерживаемый под позицию корзины до expires_at"""
+    cart_item = models.OneToOneField(CartItem, on_delete=models.CASCADE, related_name='reservation')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='reservations')
+    quantity = models.IntegerField(validators=[MinValueValidator(1)])
+    expires_at = models.DateTimeField()
+
+    objects = StockReservationQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['product', 'expires_at'], name='reservation_product_idx'),
+            models.Index(fields=['expires_at'], name='reservation_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f"Резерв {self.product_id} x{self.quantity} до {self.expires_at:%d.%m.%Y %H:%M}"
+
+
+ACTIVE_ORDER_STATUSES = ('pending', 'accepted', 'processing', 'shipped', 'delivered')
+# is_received не бывает NULL, поэтому это то же самое, что exclude(is_received=True)
+ACTIVE_ORDERS = Q(status__in=ACTIVE_ORDER_STATUSES, is_received=False)
+
+
+class OrderQuerySet(models.QuerySet):
+    def active(self):
+        """Заказы, которые ещё не получены и не отменены"""
+        # Условие дословно совпадает с условием частичных индексов, иначе планировщик их не применит
+        return self.filter(ACTIVE_ORDERS)
+
+    def history(self):
+        """Полученные или отменённые заказы"""
+        return self.filter(Q(status__in=Order.HISTORY_STATUSES) | Q(is_received=True))
+
+
 class Order(models.Model):
     STATUS_CHOICES = (
         ('pending', 'Ожидает обработки'),
@@ -81,18 +228,46 @@ class Order(models.Model):
         ('received', 'Получен покупателем'),
         ('cancelled', 'Отменен'),
     )
+    ACTIVE_STATUSES = ACTIVE_ORDER_STATUSES
+    HISTORY_STATUSES = ('received', 'cancelled')
+    # Переходы, доступные продавцу: целевой статус → из каких можно в него перейти.
+    # Только вперёд по цепочке pending → accepted → processing → shipped → delivered (шаги можно пропускать),
+    # отмена — до отправки; received ставит только покупатель подтверждением получения
+    TRANSITIONS = {
+        'accepted': ('pending',),
+        'processing': ('pending', 'accepted'),
+        'shipped': ('pending', 'accepted', 'processing'),
+        'delivered': ('pending', 'accepted', 'processing', 'shipped'),
+        'cancelled': ('pending', 'accepted', 'processing'),
+    }
     
-    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders')
-    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    quantity = models.IntegerField(validators=[MinValueValidator(1)])
+    # Одиночные индексы по FK покрываются составными индексами ниже
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='orders', db_index=False)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sales', db_index=False)
+    # Итоги по позициям (OrderLine) хранятся в заголовке: спискам и счётчикам не нужно читать позиции
+    items_count = models.PositiveIntegerField(default=0)
     total_price = models.DecimalField(max_digits=10, decimal_places=2)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
     is_received = models.BooleanField(default=False)  # Подтверждение получения покупателем
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = OrderQuerySet.as_manager()
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='order_created_idx'),
+            # Списки покупателя и продавца (API, история) в порядке ключевой пагинации
+            models.Index(fields=['buyer', '-created_at', '-id'], name='order_buyer_created_idx'),
+            models.Index(fields=['seller', '-created_at', '-id'], name='order_seller_created_idx'),
+            # Выгрузка и отчёты продавца с фильтром по статусам
+            models.Index(fields=['seller', 'status', '-created_at'], name='order_seller_status_idx'),
+            # Активных заказов мало относительно истории: частичные индексы маленькие и горячие
+            models.Index(fields=['buyer', '-created_at', '-id'], condition=ACTIVE_ORDERS,
+                         name='order_buyer_active_idx'),
+            models.Index(fields=['seller', '-created_at', '-id'], condition=ACTIVE_ORDERS,
+                         name='order_seller_active_idx'),
+        ]
 
     def __str__(self):
         return f"Заказ #{self.id} - {self.buyer.username}"
@@ -100,7 +275,68 @@ class Order(models.Model):
     @property
     def is_in_history(self):
         """Заказ в истории если получен или отменён"""
-        return self.status in ['received', 'cancelled'] or self.is_received
+        return self.status in self.HISTORY_STATUSES or self.is_received
+
+
+class OrderLine(models.Model):
+    """Позиция заказа: товар, количество и цена на момент оформления"""
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='order_lines')
+    quantity = models.IntegerField(validators=[MinValueValidator(1)])
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    def __str__(self):
+        return f"Заказ #{self.order_id}: {self.product_id} x{self.quantity}"
+
+
+class ArchivedOrder(models.Model):
+    """Закрытый заказ (получен или отменён), перенесённый из Order командой archive_orders.
+
+    id совпадает с id исходного заказа; история и API читают обе таблицы, а горячая
+    таблица Order со временем содержит в основном активные заказы.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    buyer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_orders', db_index=False)
+    seller = models.ForeignKey(User, on_delete=models.CASCADE, related_name='archived_sales', db_index=False)
+    items_count = models.PositiveIntegerField(default=0)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    is_received = models.BooleanField(default=False)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    # Поля, которые копируются из Order
+    COPIED_FIELDS = ('id', 'buyer_id', 'seller_id', 'items_count', 'total_price', 'status',
+                     'is_received', 'created_at', 'updated_at')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['buyer', '-created_at', '-id'], name='archived_order_buyer_idx'),
+            models.Index(fields=['seller', '-created_at', '-id'], name='archived_order_seller_idx'),
+        ]
+
+    def __str__(self):
+        return f"Заказ #{self.id} (архив) - {self.buyer.username}"
+
+    @property
+    def is_in_history(self):
+        return True
+
+
+class ArchivedOrderLine(models.Model):
+    """Позиция архивного заказа; переносится вместе с заголовком"""
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name='lines')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_order_lines')
+    quantity = models.IntegerField()
+    price = models.DecimalField(max_digits=10, decimal_places=2)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+
+    COPIED_FIELDS = ('order_id', 'product_id', 'quantity', 'price', 'total_price')
+
+    def __str__(self):
+        return f"Заказ #{self.order_id} (архив): {self.product_id} x{self.quantity}"
 
 
 class Review(models.Model):
@@ -112,6 +348,87 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('product', 'user')
+        indexes = [
+            models.Index(fields=['-created_at', '-id'], name='review_created_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.product.name} ({self.rating}★)"
+
+
+class SellerStats(models.Model):
+    """Счётчики панели продавца, обновляются в тех же транзакциях, что и заказы (см. shop/stats.py)"""
+    seller = models.OneToOneField(User, on_delete=models.CASCADE, primary_key=True, related_name='stats')
+    pending_count = models.IntegerField(default=0)
+    accepted_count = models.IntegerField(default=0)
+    processing_count = models.IntegerField(default=0)
+    shipped_count = models.IntegerField(default=0)
+    delivered_count = models.IntegerField(default=0)
+    received_count = models.IntegerField(default=0)
+    cancelled_count = models.IntegerField(default=0)
+    received_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    pending_revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    total_stock = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = 'Seller stats'
+
+    def __str__(self):
+        return f"Статистика {self.seller.username}"
+
+    def status_count(self, status):
+        return getattr(self, f'{status}_count')
+
+    @property
+    def total_orders(self):
+        return sum(self.status_count(status) for status, _ in Order.STATUS_CHOICES)
+
+    @property
+    def active_orders(self):
+        return sum(self.status_count(status) for status in Order.ACTIVE_STATUSES)
+
+
+class BalanceEntry(models.Model):
+    """Проводка по балансу пользователя. Журнал только дополняется: сумма проводок равна балансу"""
+    OPENING = 'opening'
+    TOPUP = 'topup'
+    PURCHASE = 'purchase'
+    REFUND = 'refund'
+    ADJUSTMENT = 'adjustment'
+    KIND_CHOICES = (
+        (OPENING, 'Начальный баланс'),
+        (TOPUP, 'Пополнение'),
+        (PURCHASE, 'Оплата заказа'),
+        (REFUND, 'Возврат'),
+        (ADJUSTMENT, 'Корректировка'),
+    )
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balance_entries')
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    # Зачисления положительные, списания отрицательные
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    # Без внешнего ключа в БД: проводка остаётся и после удаления заказа
+    order = models.ForeignKey(Order, on_delete=models.DO_NOTHING, db_constraint=False, null=True, blank=True,
+                              related_name='balance_entries')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name_plural = 'Balance entries'
+        indexes = [
+            models.Index(fields=['user', '-created_at'], name='balance_entry_user_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username}: {self.amount} ({self.get_kind_display()})"
+
+
+class ApiToken(models.Model):
+    """Токен доступа к API (Authorization: Bearer <ключ>); в базе хранится только sha256 ключа"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='api_tokens')
+    name = models.CharField(max_length=100, blank=True)
+    key_hash = models.CharField(max_length=64, unique=True, editable=False)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"{self.user.username}: {self.name or self.key_hash[:8]}"
@@ -0,0 +1,101 @@
+from django.db import transaction
+from django.db.models import Case, F, When
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .ledger import refund_orders
+from .models import ArchivedOrder, ArchivedOrderLine, Order, OrderLine, Product
+from .stats import adjust_seller_stats, order_change_delta
+
+# Сколько заказов можно перевести одним запросом
+MAX_BATCH = 1000
+
+
+class TransitionError(ValueError):
+    """Запрос на смену статуса отклонён целиком; текст показывается продавцу"""
+
+
+def parse_order_ids(value):
+    if not isinstance(value, list) or not value:
+        raise TransitionError('ids должен быть непустым списком')
+    if len(value) > MAX_BATCH:
+        raise TransitionError(f'Не больше {MAX_BATCH} заказов за раз')
+    try:
+        return sorted({int(order_id) for order_id in value})
+    except (TypeError, ValueError):
+        raise TransitionError('Неверный id заказа')
+
+
+@transaction.atomic
+def transition_orders(seller, order_ids, target):
+    """Переводит заказы продавца в статус target, если это допускает Order.TRANSITIONS.
+
+    Подходящие строки блокируются (по возрастанию id) и меняются одним
+    UPDATE ... WHERE id IN (...) AND status IN (допустимые исходные). Отмена возвращает
+    покупателям деньги и товар на склад. Возвращает (изменённые id, отклонённые id).
+    """
+    allowed_from = Order.TRANSITIONS.get(target)
+    if allowed_from is None:
+        raise TransitionError('Недопустимый статус')
+
+    movable = Order.objects.filter(id__in=order_ids, seller=seller, status__in=allowed_from, is_received=False)
+    orders = list(movable.select_for_update().order_by('id').only(
+        'id', 'buyer_id', 'seller_id', 'total_price', 'status', 'is_received'
+    ))
+    changed = [order.id for order in orders]
+    changed_ids = set(changed)
+    rejected = [order_id for order_id in order_ids if order_id not in changed_ids]
+    if not orders:
+        return changed, rejected
+
+    Order.objects.filter(id__in=changed, status__in=allowed_from).update(status=target, updated_at=timezone.now())
+
+    delta = {}
+    for order in orders:
+        before = (order.status, False, order.total_price)
+        for field, value in order_change_delta(before, (target, False, order.total_price)).items():
+            delta[field] = delta.get(field, 0) + value
+
+    if target == 'cancelled':
+        restock = {}
+        for product_id, quantity in OrderLine.objects.filter(order_id__in=changed).values_list('product_id', 'quantity'):
+            restock[product_id] = restock.get(product_id, 0) + quantity
+        # Товары в порядке id, затем покупатели и счётчики продавца — общий порядок блокировок
+        products = Product.objects.filter(id__in=restock)
+        list(products.select_for_update().order_by('id').values_list('id', flat=True))
+        products.update(
+            stock=Case(*[When(id=product_id, then=F('stock') + quantity) for product_id, quantity in restock.items()]),
+            updated_at=timezone.now(),
+        )
+        refund_orders(orders)
+        delta['total_stock'] = sum(restock.values())
+        transaction.on_commit(lambda: catalog_cache.bump_products(restock))
+
+    adjust_seller_stats(seller.pk, **delta)
+    return changed, rejected
+
+
+def archive_orders(before, batch_size=5000):
+    """Переносит закрытые заказы, не менявшиеся с before, в ArchivedOrder; возвращает их число.
+
+    Каждая пачка — своя транзакция: копии заказов и их позиций вставляются и оригиналы удаляются вместе.
+    Счётчики SellerStats не меняются: пересчёт учитывает архив.
+    """
+    moved = 0
+    while True:
+        with transaction.atomic():
+            rows = list(
+                Order.objects.history().filter(updated_at__lt=before).order_by('id')
+                .select_for_update(skip_locked=True).values(*ArchivedOrder.COPIED_FIELDS)[:batch_size]
+            )
+            if not rows:
+                return moved
+            order_ids = [row['id'] for row in rows]
+            ArchivedOrder.objects.bulk_create([ArchivedOrder(**row) for row in rows])
+            lines = OrderLine.objects.filter(order_id__in=order_ids).order_by('id')
+            ArchivedOrderLine.objects.bulk_create([
+                ArchivedOrderLine(**line) for line in lines.values(*ArchivedOrderLine.COPIED_FIELDS)
+            ])
+            # Позиции удаляются каскадом одним DELETE
+            Order.objects.filter(id__in=order_ids).delete()
+        moved += len(rows)
@@ -0,0 +1,140 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+class KeysetPage:
+    """Страница выборки по ключу (created_at, id), от новых к старым"""
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_other_pages(self):
+        return bool(self.next_cursor or self.previous_cursor)
+
+
+def encode_cursor(obj, reverse=False):
+    payload = json.dumps([obj.created_at.isoformat(), obj.pk, int(reverse)], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        created_at, pk, reverse = json.loads(base64.urlsafe_b64decode(padded.encode()).decode())
+        created_at = parse_datetime(created_at)
+        if created_at is None:
+            raise ValueError
+        return created_at, int(pk), bool(reverse)
+    except (binascii.Error, UnicodeDecodeError, TypeError, ValueError):
+        raise InvalidCursor(cursor)
+
+
+def paginate_keyset(queryset, cursor=None, page_size=20):
+    """Возвращает KeysetPage; стоимость любой страницы одинакова благодаря индексу (created_at, id).
+
+    Вместо выборки можно передать список выборок с общим пространством id (заказы и их архив):
+    из каждой читается страница, результаты сливаются по ключу.
+    """
+    querysets = queryset if isinstance(queryset, (list, tuple)) else [queryset]
+    reverse = False
+    if cursor:
+        created_at, pk, reverse = decode_cursor(cursor)
+        # Граница по created_at задаёт диапазон индекса, условие по id разбивает равные даты
+        if reverse:
+            querysets = [part.filter(created_at__gte=created_at).filter(
+                Q(created_at__gt=created_at) | Q(id__gt=pk)
+            ) for part in querysets]
+        else:
+            querysets = [part.filter(created_at__lte=created_at).filter(
+                Q(created_at__lt=created_at) | Q(id__lt=pk)
+            ) for part in querysets]
+
+    ordering = ('created_at', 'id') if reverse else ('-created_at', '-id')
+    items = [item for part in querysets for item in part.order_by(*ordering)[:page_size + 1]]
+    if len(querysets) > 1:
+        items.sort(key=lambda item: (item.created_at, item.pk), reverse=not reverse)
+        items = items[:page_size + 1]
+    has_more = len(items) > page_size
+    items = items[:page_size]
+
+    if reverse:
+        items.reverse()
+        has_next, has_previous = True, has_more
+    else:
+        has_next, has_previous = has_more, bool(cursor)
+
+    if not items:
+        return KeysetPage(items)
+    return KeysetPage(
+        items,
+        next_cursor=encode_cursor(items[-1]) if has_next else None,
+        previous_cursor=encode_cursor(items[0], reverse=True) if has_previous else None,
+    )
+
+
+class KeysetPagination(BasePagination):
+    page_size = 20
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate_keyset(
+                queryset, request.query_params.get(self.cursor_query_param), self.get_page_size(request)
+            )
+        except InvalidCursor:
+            raise NotFound('Неверный курсор')
+        return self.page.items
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(page_size, 1), self.max_page_size)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.page.next_cursor)),
+            ('previous', self.get_link(self.page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
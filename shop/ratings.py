@@ -0,0 +1,40 @@
+from django.db import transaction
+from django.db.models import Count, Q, Sum
+
+RATING_FIELDS = ['rating_sum', 'rating_count'] + [f'rating_{rating}' for rating in range(1, 6)]
+
+
+def rebuild_rating_aggregates(product_model, review_model, batch_size=1000):
+    """Пересчитывает агрегаты рейтинга по таблице отзывов, возвращает число исправленных товаров.
+
+    Модели передаются параметрами, чтобы функцию можно было вызвать и из миграции.
+    """
+    totals = {
+        row.pop('product_id'): row
+        for row in review_model.objects.order_by().values('product_id').annotate(
+            rating_sum=Sum('rating'),
+            rating_count=Count('id'),
+            **{f'rating_{rating}': Count('id', filter=Q(rating=rating)) for rating in range(1, 6)}
+        )
+    }
+    empty = dict.fromkeys(RATING_FIELDS, 0)
+
+    fixed = 0
+    with transaction.atomic():
+        changed = []
+        products = product_model.objects.select_for_update().only('id', *RATING_FIELDS).order_by('id')
+        for product in products.iterator(chunk_size=batch_size):
+            expected = totals.get(product.id, empty)
+            if all(getattr(product, field) == expected[field] for field in RATING_FIELDS):
+                continue
+            for field in RATING_FIELDS:
+                setattr(product, field, expected[field])
+            changed.append(product)
+            if len(changed) >= batch_size:
+                product_model.objects.bulk_update(changed, RATING_FIELDS)
+                fixed += len(changed)
+                changed = []
+        if changed:
+            product_model.objects.bulk_update(changed, RATING_FIELDS)
+            fixed += len(changed)
+    return fixed
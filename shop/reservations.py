@@ -0,0 +1,59 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, Max, Sum
+from django.utils import timezone
+
+from . import cache as catalog_cache
+from .models import StockReservation
+
+
+def reservation_ttl():
+    return timedelta(minutes=settings.CART_RESERVATION_MINUTES)
+
+
+def hold_stock(cart_item):
+    """Резервирует под позицию корзины её текущее количество и продлевает срок резерва"""
+    StockReservation.objects.update_or_create(
+        cart_item=cart_item,
+        defaults={
+            'product_id': cart_item.product_id,
+            'quantity': cart_item.quantity,
+            'expires_at': timezone.now() + reservation_ttl(),
+        }
+    )
+    # Страница товара показывает остаток за вычетом резервов
+    transaction.on_commit(lambda: catalog_cache.bump_products([cart_item.product_id]))
+
+
+def hold_stock_many(items):
+    """То же для нескольких позиций, items — (id позиции, id товара, количество): два запроса на любой размер"""
+    expires_at = timezone.now() + reservation_ttl()
+    StockReservation.objects.filter(cart_item_id__in=[item_id for item_id, _, _ in items]).delete()
+    StockReservation.objects.bulk_create([
+        StockReservation(cart_item_id=item_id, product_id=product_id, quantity=quantity, expires_at=expires_at)
+        for item_id, product_id, quantity in items
+    ])
+    product_ids = {product_id for _, product_id, _ in items}
+    transaction.on_commit(lambda: catalog_cache.bump_products(product_ids))
+
+
+def reservations_version(products):
+    """Отпечаток живых резервов товаров выборки для ETag: меняется при резерве, продлении, снятии и истечении"""
+    reservations = StockReservation.objects.live()
+    if products.query.has_filters():
+        # Без фильтров это весь каталог: полусоединение с товарами не нужно
+        reservations = reservations.filter(product__in=products.order_by().values('pk'))
+    summary = reservations.aggregate(count=Count('pk'), quantity=Sum('quantity'), expires_at=Max('expires_at'))
+    return summary['count'], summary['quantity'], summary['expires_at']
+
+
+def release_expired_reservations(batch_size=1000):
+    """Удаляет истёкшие резервы пачками, возвращает число удалённых"""
+    released = 0
+    while True:
+        ids = list(StockReservation.objects.expired().values_list('id', flat=True)[:batch_size])
+        if not ids:
+            return released
+        released += StockReservation.objects.filter(id__in=ids).delete()[0]
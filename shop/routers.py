@@ -0,0 +1,97 @@
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core import signing
+
+# Чтения текущего запроса (потока, задачи asyncio) можно отдать реплике
+_replica_reads = ContextVar('replica_reads', default=False)
+
+PIN_COOKIE = 'db_primary'
+PIN_SALT = 'shop.routers.pin'
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+
+@contextmanager
+def replica_reads(enabled=True):
+    """Внутри блока чтения идут на реплики из DATABASE_REPLICAS (если они настроены)"""
+    token = _replica_reads.set(enabled)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def reads_from_replica(view):
+    """Помечает HTML-представление: его GET-запросы можно обслуживать с реплики"""
+    view.replica_reads = True
+    return view
+
+
+class ReplicaRouter:
+    """Записи и чтения по умолчанию — в основную базу; реплики только для помеченных представлений.
+
+    Реплики получают схему и данные репликацией, поэтому миграции на них не применяются.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики — копии основной базы, связи между объектами из разных алиасов допустимы
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in settings.DATABASE_REPLICAS
+
+
+def view_reads_from_replica(view_func, method):
+    """Помеченная функция или действие ViewSet из replica_actions"""
+    if getattr(view_func, 'replica_reads', False):
+        return True
+    actions = getattr(view_func, 'actions', None) or {}
+    action = actions.get(method.lower())
+    return action in getattr(getattr(view_func, 'cls', None), 'replica_actions', ())
+
+
+class ReplicaRoutingMiddleware:
+    """Отдаёт реплике чтения безопасных запросов к каталогу.
+
+    После изменяющего запроса (POST, PUT, PATCH, DELETE) клиент на REPLICA_PIN_SECONDS
+    закрепляется за основной базой подписанной cookie: покупатель сразу видит свой заказ,
+    даже если реплика отстаёт.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        token = _replica_reads.set(False)
+        try:
+            response = self.get_response(request)
+        finally:
+            _replica_reads.reset(token)
+        if request.method not in SAFE_METHODS and settings.DATABASE_REPLICAS:
+            response.set_signed_cookie(PIN_COOKIE, '1', salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS,
+                                       httponly=True, samesite='Lax')
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if (settings.DATABASE_REPLICAS and request.method in SAFE_METHODS
+                and not self.pinned(request) and view_reads_from_replica(view_func, request.method)):
+            _replica_reads.set(True)
+
+    @staticmethod
+    def pinned(request):
+        try:
+            request.get_signed_cookie(PIN_COOKIE, salt=PIN_SALT, max_age=settings.REPLICA_PIN_SECONDS)
+        except (KeyError, signing.BadSignature):
+            return False
+        return True
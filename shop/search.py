@@ -0,0 +1,33 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank, TrigramSimilarity
+from django.db import connections
+from django.db.models import F, Q
+from rest_framework.pagination import LimitOffsetPagination
+
+
+class ProductSearchPagination(LimitOffsetPagination):
+    """Результаты поиска упорядочены по релевантности, поэтому листаются по смещению и с числом совпадений"""
+    default_limit = 20
+    max_limit = 100
+
+
+def search_products(queryset, text):
+    """Фильтрует товары по поисковой строке и сортирует по релевантности.
+
+    На PostgreSQL используется tsvector (конфигурации russian и simple) и триграммы названия,
+    оба условия обслуживаются GIN-индексами. На остальных СУБД — icontains без ранжирования.
+    """
+    text = text.strip()
+    if not text:
+        return queryset
+
+    if connections[queryset.db].vendor != 'postgresql':
+        return queryset.filter(Q(name__icontains=text) | Q(description__icontains=text)).order_by('-id')
+
+    query = (SearchQuery(text, config='russian', search_type='websearch')
+             | SearchQuery(text, config='simple', search_type='websearch'))
+    # alias(), а не annotate(): COUNT для числа совпадений не вычисляет ранг
+    return queryset.filter(
+        Q(search_vector=query) | Q(name__trigram_similar=text)
+    ).alias(
+        rank=SearchRank(F('search_vector'), query) + TrigramSimilarity('name', text)
+    ).order_by('-rank', '-id')
@@ -1,12 +1,28 @@
 from rest_framework import serializers
-from .models import User, Category, Product, CartItem, Order, Review
+from .models import User, Category, Product, CartItem, Order, OrderLine, Review, ApiToken
 
 
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ['id', 'username', 'email', 'user_type', 'balance', 'phone', 'address', 'first_name', 'last_name']
-        read_only_fields = ['id']
+        # Баланс меняется только через журнал (shop/ledger.py)
+        read_only_fields = ['id', 'balance']
+
+
+class ApiTokenSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ApiToken
+        fields = ['id', 'name', 'created_at']
+        read_only_fields = ['id', 'created_at']
+
+
+class UserShortSerializer(serializers.ModelSerializer):
+    """Краткие данные пользователя для вложения в списки"""
+    class Meta:
+        model = User
+        fields = ['id', 'username']
+        read_only_fields = fields
 
 
 class CategorySerializer(serializers.ModelSerializer):
@@ -16,7 +32,7 @@ class CategorySerializer(serializers.ModelSerializer):
 
 
 class ReviewSerializer(serializers.ModelSerializer):
-    user = UserSerializer(read_only=True)
+    user = UserShortSerializer(read_only=True)
     
     class Meta:
         model = Review
@@ -24,21 +40,66 @@ class ReviewSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'created_at']
 
 
+def get_available_stock(product):
+    # available_stock добавляет Product.objects.with_available_stock()
+    return getattr(product, 'available_stock', product.stock)
+
+
+class ProductListSerializer(serializers.ModelSerializer):
+    """Товар в списках: без отзывов и с кратким продавцом"""
+    seller = UserShortSerializer(read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
+    average_rating = serializers.ReadOnlyField()
+    available_stock = serializers.SerializerMethodField()
+    image_srcset = serializers.ReadOnlyField()
+    
+    class Meta:
+        model = Product
+        fields = ['id', 'seller', 'category', 'category_name', 'name', 'price', 'stock', 'available_stock',
+                  'image', 'image_srcset', 'average_rating', 'rating_count', 'created_at']
+        read_only_fields = fields
+    
+    def get_available_stock(self, product):
+        return get_available_stock(product)
+
+
+class ProductShortSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Product
+        fields = ['id', 'name']
+        read_only_fields = fields
+
+
 class ProductSerializer(serializers.ModelSerializer):
-    seller = UserSerializer(read_only=True)
-    category_name = serializers.CharField(source='category.name', read_only=True)
+    seller = UserShortSerializer(read_only=True)
+    category_name = serializers.CharField(source='category.name', read_only=True, default=None)
     average_rating = serializers.ReadOnlyField()
     reviews = ReviewSerializer(many=True, read_only=True)
+    available_stock = serializers.SerializerMethodField()
+    image_srcset = serializers.ReadOnlyField()
     
     class Meta:
         model = Product
-        fields = ['id', 'seller', 'category', 'category_name', 'name', 'description', 
-                  'price', 'stock', 'image', 'average_rating', 'reviews', 'created_at']
-        read_only_fields = ['id', 'created_at']
+        fields = ['id', 'seller', 'category', 'category_name', 'name', 'sku', 'description', 
+                  'price', 'stock', 'available_stock', 'image', 'image_srcset', 'average_rating', 'rating_count',
+                  'reviews', 'created_at']
+        read_only_fields = ['id', 'rating_count', 'created_at']
+    
+    def get_available_stock(self, product):
+        return get_available_stock(product)
+    
+    def validate_sku(self, sku):
+        seller = self.instance.seller if self.instance else self.context['request'].user
+        duplicates = Product.objects.filter(seller=seller, sku=sku)
+        if self.instance:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if sku and duplicates.exists():
+            raise serializers.ValidationError('Товар с таким артикулом уже есть')
+        return sku
 
 
 class CartItemSerializer(serializers.ModelSerializer):
-    product = ProductSerializer(read_only=True)
+    product = ProductListSerializer(read_only=True)
     total_price = serializers.ReadOnlyField()
     
     class Meta:
@@ -47,13 +108,37 @@ class CartItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'added_at']
 
 
+class OrderLineSerializer(serializers.ModelSerializer):
+    """Позиция заказа (и архивного заказа: поля те же)"""
+    product = ProductShortSerializer(read_only=True)
+    
+    class Meta:
+        model = OrderLine
+        fields = ['product', 'quantity', 'price', 'total_price']
+        read_only_fields = fields
+
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """Заказ в списках: участники и позиции в кратком виде"""
+    buyer = UserShortSerializer(read_only=True)
+    seller = UserShortSerializer(read_only=True)
+    lines = OrderLineSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = Order
+        fields = ['id', 'buyer', 'seller', 'lines', 'items_count', 'total_price',
+                  'status', 'is_received', 'created_at', 'updated_at']
+        read_only_fields = fields
+
+
 class OrderSerializer(serializers.ModelSerializer):
     buyer = UserSerializer(read_only=True)
     seller = UserSerializer(read_only=True)
-    product = ProductSerializer(read_only=True)
+    lines = OrderLineSerializer(many=True, read_only=True)
     
     class Meta:
         model = Order
-        fields = ['id', 'buyer', 'seller', 'product', 'quantity', 'total_price', 
-                  'status', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'buyer', 'seller', 'total_price', 'created_at', 'updated_at']
+        fields = ['id', 'buyer', 'seller', 'lines', 'items_count', 'total_price', 
+                  'status', 'is_received', 'created_at', 'updated_at']
+        # Статус меняется только через переходы заказа (shop/orders.py)
+        read_only_fields = fields
@@ -0,0 +1,99 @@
+from django.contrib.auth.signals import user_logged_out
+from django.db import transaction
+from django.db.models.functions import Now
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from . import cache as catalog_cache
+from .auth import forget_token, invalidate_user
+from .images import schedule_after_commit
+from .models import ApiToken, Category, Product, Review, User
+
+
+@receiver(pre_save, sender=Review)
+def remember_review_rating(sender, instance, **kwargs):
+    """Запоминаем прежнюю оценку, чтобы при изменении отзыва поправить агрегаты"""
+    instance._previous_rating = None
+    if instance.pk:
+        instance._previous_rating = (
+            Review.objects.filter(pk=instance.pk).values_list('rating', flat=True).first()
+        )
+
+
+@receiver(post_save, sender=Review)
+def add_review_rating(sender, instance, created, **kwargs):
+    products = Product.objects.filter(pk=instance.product_id)
+    if created:
+        products.apply_rating(instance.rating)
+        return
+
+    previous = getattr(instance, '_previous_rating', None)
+    if previous is not None and int(previous) != int(instance.rating):
+        products.apply_rating(previous, delta=-1)
+        products.apply_rating(instance.rating)
+    else:
+        # Отзывы показываются на странице товара: её валидаторы (ETag) строятся по updated_at
+        products.update(updated_at=Now())
+
+
+@receiver(post_delete, sender=Review)
+def remove_review_rating(sender, instance, **kwargs):
+    Product.objects.filter(pk=instance.product_id).apply_rating(instance.rating, delta=-1)
+
+
+# Кэш каталога: версии сбрасываются после коммита, чтобы параллельный запрос
+# не закэшировал старые данные под новой версией
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_cache(sender, instance, **kwargs):
+    # После удаления Django обнуляет pk у объекта, поэтому запоминаем его сейчас
+    scope = catalog_cache.product_scope(instance.pk)
+    transaction.on_commit(lambda: catalog_cache.bump('products', scope))
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: catalog_cache.bump('categories', 'products'))
+
+
+@receiver(post_save, sender=Review)
+@receiver(post_delete, sender=Review)
+def invalidate_review_cache(sender, instance, **kwargs):
+    transaction.on_commit(lambda: catalog_cache.bump(catalog_cache.product_scope(instance.product_id)))
+
+
+@receiver(pre_save, sender=Product)
+def detect_new_image(sender, instance, update_fields=None, **kwargs):
+    """Новый загруженный файл ещё не сохранён в хранилище (_committed=False)"""
+    instance._new_image = False
+    if 'image' in instance.get_deferred_fields() or (update_fields and 'image' not in update_fields):
+        return
+    if instance.image and not instance.image._committed:
+        instance._new_image = True
+        # Старые миниатюры к новой картинке не подходят
+        instance.image_variants = {}
+
+
+@receiver(post_save, sender=Product)
+def build_image_variants(sender, instance, **kwargs):
+    if getattr(instance, '_new_image', False):
+        schedule_after_commit(instance.pk, instance.image.name)
+
+
+# Кэш пользователей API-токенов (shop/auth.py): пароль, профиль, активность, выход из системы
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(sender, instance, **kwargs):
+    user_id = instance.pk
+    transaction.on_commit(lambda: invalidate_user(user_id))
+
+
+@receiver(user_logged_out)
+def invalidate_tokens_on_logout(sender, request, user, **kwargs):
+    if user is not None:
+        invalidate_user(user.pk)
+
+
+@receiver(post_delete, sender=ApiToken)
+def forget_deleted_token(sender, instance, **kwargs):
+    key_hash = instance.key_hash
+    transaction.on_commit(lambda: forget_token(key_hash))
@@ -0,0 +1,113 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import Count, DecimalField, F, Q, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .models import ACTIVE_ORDERS, ArchivedOrder, Order, Product, SellerStats
+
+STATUS_COUNT_FIELDS = {status: f'{status}_count' for status, _ in Order.STATUS_CHOICES}
+STATS_FIELDS = list(STATUS_COUNT_FIELDS.values()) + ['received_revenue', 'pending_revenue', 'total_stock']
+
+ZERO = Value(Decimal('0'), output_field=DecimalField(max_digits=14, decimal_places=2))
+
+
+def order_contribution(status, is_received, total_price):
+    """Вклад одного заказа в счётчики продавца"""
+    contribution = {STATUS_COUNT_FIELDS[status]: 1}
+    if status == 'received':
+        contribution['received_revenue'] = total_price
+    if status in Order.ACTIVE_STATUSES and not is_received:
+        contribution['pending_revenue'] = total_price
+    return contribution
+
+
+def order_change_delta(before=None, after=None):
+    """Разница счётчиков для заказа; before/after — кортежи (status, is_received, total_price)"""
+    delta = {}
+    if after:
+        for field, value in order_contribution(*after).items():
+            delta[field] = delta.get(field, 0) + value
+    if before:
+        for field, value in order_contribution(*before).items():
+            delta[field] = delta.get(field, 0) - value
+    return delta
+
+
+def adjust_seller_stats(seller_id, **delta):
+    """Атомарно прибавляет delta к счётчикам продавца; вызывать внутри транзакции изменения данных"""
+    updates = {field: F(field) + value for field, value in delta.items() if value}
+    if not updates:
+        return
+    if SellerStats.objects.filter(seller_id=seller_id).update(**updates):
+        return
+    # Строки ещё нет: пересчёт уже видит изменения текущей транзакции
+    try:
+        with transaction.atomic():
+            SellerStats.objects.create(seller_id=seller_id, **compute_seller_stats([seller_id])[seller_id])
+    except IntegrityError:
+        # Строку успела создать параллельная транзакция, наших изменений она не видела
+        SellerStats.objects.filter(seller_id=seller_id).update(**updates)
+
+
+def record_order_change(order, before=None):
+    """Учитывает создание заказа (before=None) или смену его статуса"""
+    after = (order.status, order.is_received, order.total_price)
+    adjust_seller_stats(order.seller_id, **order_change_delta(before, after))
+
+
+def record_orders_created(orders):
+    """Учитывает новые заказы и списанный под них остаток: одно обновление на продавца"""
+    deltas = {}
+    for order in orders:
+        delta = deltas.setdefault(order.seller_id, {})
+        for field, value in order_change_delta(after=(order.status, order.is_received, order.total_price)).items():
+            delta[field] = delta.get(field, 0) + value
+        delta['total_stock'] = delta.get('total_stock', 0) - order.items_count
+    # Продавцы по возрастанию id — единый порядок блокировок строк SellerStats
+    for seller_id in sorted(deltas):
+        adjust_seller_stats(seller_id, **deltas[seller_id])
+
+
+def compute_seller_stats(seller_ids=None):
+    """Полный пересчёт: условная агрегация по заказам и по архиву заказов, один запрос по остаткам товаров"""
+    orders = Order.objects.order_by()
+    archived = ArchivedOrder.objects.order_by()
+    products = Product.objects.order_by()
+    if seller_ids is not None:
+        orders = orders.filter(seller_id__in=seller_ids)
+        archived = archived.filter(seller_id__in=seller_ids)
+        products = products.filter(seller_id__in=seller_ids)
+
+    stats = {seller_id: dict.fromkeys(STATS_FIELDS, 0) for seller_id in seller_ids or []}
+    counters = {
+        **{field: Count('id', filter=Q(status=status)) for status, field in STATUS_COUNT_FIELDS.items()},
+        'received_revenue': Coalesce(Sum('total_price', filter=Q(status='received')), ZERO),
+    }
+    pending_revenue = Coalesce(Sum('total_price', filter=ACTIVE_ORDERS), ZERO)
+    for row in orders.values('seller_id').annotate(**counters, pending_revenue=pending_revenue):
+        stats.setdefault(row.pop('seller_id'), dict.fromkeys(STATS_FIELDS, 0)).update(row)
+    # В архиве только закрытые заказы: они не дают pending_revenue
+    for row in archived.values('seller_id').annotate(**counters):
+        seller_stats = stats.setdefault(row.pop('seller_id'), dict.fromkeys(STATS_FIELDS, 0))
+        for field, value in row.items():
+            seller_stats[field] += value
+
+    for row in products.values('seller_id').annotate(total_stock=Coalesce(Sum('stock'), 0)):
+        stats.setdefault(row['seller_id'], dict.fromkeys(STATS_FIELDS, 0))['total_stock'] = row['total_stock']
+    return stats
+
+
+def refresh_seller_stats(seller_id):
+    values = compute_seller_stats([seller_id])[seller_id]
+    stats, _ = SellerStats.objects.update_or_create(seller_id=seller_id, defaults=values)
+    return stats
+
+
+def get_seller_stats(seller):
+    """Счётчики продавца; при отсутствии строки она создаётся полным пересчётом"""
+    try:
+        return SellerStats.objects.get(seller=seller)
+    except SellerStats.DoesNotExist:
+        with transaction.atomic():
+            return refresh_seller_stats(seller.id)
@@ -0,0 +1,14 @@
+from django import template
+
+register = template.Library()
+
+
+@register.simple_tag(takes_context=True)
+def querystring(context, name, value):
+    """Строка запроса текущей страницы, где параметр name заменён на value; остальные параметры сохраняются.
+
+    Нужна, когда на странице несколько независимых списков: листание одного не сбрасывает курсоры других.
+    """
+    query = context['request'].GET.copy()
+    query[name] = value
+    return '?' + query.urlencode()
@@ -1,3 +1,1267 @@
-from django.test import TestCase
+import json
+import shutil
+import tempfile
+import threading
+from datetime import timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.core.cache import cache
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import IntegrityError, connection, connections
+from django.template.loader import render_to_string
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings, skipUnlessDBFeature
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from . import bulk, cache as catalog_cache
+from .auth import issue_token
+from .benchmarks.generate import TABLES, CopyStream, Plan, order_line_rows, order_rows, review_rows
+from .images import apply_variants, build_variants
+from .metrics import registry as metrics_registry
+from .pagination import KeysetPage
+from .reservations import hold_stock
+from .routers import ReplicaRouter, replica_reads
+from .models import (User, Category, Product, CartItem, Order, OrderLine, ArchivedOrder, Review, SellerStats,
+                     StockReservation, BalanceEntry, ApiToken)
+from .stats import STATS_FIELDS, compute_seller_stats, refresh_seller_stats
+
+
+def create_order(buyer, seller, product, quantity, total_price, **fields):
+    """Заказ из одной позиции"""
+    order = Order.objects.create(buyer=buyer, seller=seller, items_count=quantity, total_price=total_price, **fields)
+    OrderLine.objects.create(order=order, product=product, quantity=quantity, price=product.price,
+                             total_price=total_price)
+    return order
+
+
+class RatingAggregatesTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        self.category = Category.objects.create(name='Книги')
+        self.product = Product.objects.create(
+            seller=self.seller, category=self.category, name='Книга',
+            description='Описание', price=100, stock=10
+        )
+
+    def test_create_and_delete_review_through_api(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post('/api/reviews/', {'product': self.product.id, 'rating': 4, 'comment': 'ok'})
+        self.assertEqual(response.status_code, 201)
+
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.rating_count, 1)
+        self.assertEqual(self.product.average_rating, 4)
+        self.assertEqual(self.product.rating_histogram[4], 1)
+
+        response = self.client.delete(f"/api/reviews/{response.json()['id']}/")
+        self.assertEqual(response.status_code, 204)
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating_4), (0, 0, 0))
+
+    def test_invalid_rating_is_rejected(self):
+        self.client.force_login(self.buyer)
+        response = self.client.post('/api/reviews/', {'product': self.product.id, 'rating': 9, 'comment': 'ok'})
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Review.objects.exists())
+
+    def test_rebuild_command_fixes_drift(self):
+        Review.objects.create(product=self.product, user=self.buyer, rating=5, comment='ok')
+        Product.objects.filter(pk=self.product.pk).update(rating_sum=0, rating_count=7)
+
+        call_command('rebuild_ratings', stdout=StringIO())
+
+        self.product.refresh_from_db()
+        self.assertEqual((self.product.rating_sum, self.product.rating_count, self.product.rating_5), (5, 1, 1))
+
+
+class QueryBudgetTests(TestCase):
+    """Списки API должны укладываться в фиксированное число запросов независимо от объёма данных"""
+
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        category = Category.objects.create(name='Книги')
+        reviewers = [User.objects.create_user(username=f'reviewer{i}', password='pass') for i in range(3)]
+        for i in range(5):
+            product = Product.objects.create(
+                seller=self.seller, category=category, name=f'Товар {i}',
+                description='Описание', price=100 + i, stock=10
+            )
+            for reviewer in reviewers:
+                Review.objects.create(product=product, user=reviewer, rating=5, comment='ok')
+            CartItem.objects.create(user=self.buyer, product=product, quantity=1)
+            create_order(self.buyer, self.seller, product, 1, product.price)
+
+    def test_product_list(self):
+        # валидаторы (ETag: товары и живые резервы), страница товаров
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/products/')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('reviews', response.json()['results'][0])
+
+    def test_product_detail(self):
+        product = Product.objects.first()
+        # валидаторы (ETag), товар с продавцом и категорией, отзывы с авторами
+        with self.assertNumQueries(3):
+            response = self.client.get(f'/api/products/{product.id}/')
+        self.assertEqual(len(response.json()['reviews']), 3)
+
+    def test_cart_list(self):
+        self.client.force_login(self.buyer)
+        # сессия, пользователь, корзина
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cart/')
+        self.assertEqual(len(response.json()), 5)
+
+    def test_order_list(self):
+        for user in (self.buyer, self.seller):
+            self.client.force_login(user)
+            # Сессия, пользователь, страница заказов, их позиции и страница архива (пустая — без позиций)
+            with self.assertNumQueries(5):
+                response = self.client.get('/api/orders/')
+            self.assertEqual(len(response.json()['results']), 5)
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.seller = seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.products = [
+            Product.objects.create(seller=seller, name=f'Товар {i}', description='', price=1, stock=1)
+            for i in range(7)
+        ]
+        # Одинаковое время создания: порядок внутри должен решаться по id
+        Product.objects.update(created_at=timezone.now())
+
+    def test_api_walks_pages_forward_and_back(self):
+        expected = [product.id for product in reversed(self.products)]
+
+        seen, url = [], '/api/products/?page_size=3'
+        pages = []
+        while url:
+            data = self.client.get(url).json()
+            pages.append(data)
+            seen += [product['id'] for product in data['results']]
+            url = data['next']
+        self.assertEqual(seen, expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        back = self.client.get(pages[2]['previous']).json()
+        self.assertEqual([product['id'] for product in back['results']], expected[3:6])
+
+    def test_invalid_cursor(self):
+        self.assertEqual(self.client.get('/api/products/?cursor=garbage').status_code, 404)
+        self.assertEqual(self.client.get('/?cursor=garbage').status_code, 404)
+
+    def test_index_page(self):
+        cache.clear()
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 7)
+
+    def test_profile_and_dashboard_pages(self):
+        buyer = User.objects.create_user(username='buyer', password='pass')
+        for product in self.products:
+            create_order(buyer, self.seller, product, 1, 1)
+
+        self.client.force_login(buyer)
+        response = self.client.get('/profile/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['active_orders']), 7)
+
+        self.client.force_login(self.seller)
+        response = self.client.get('/seller/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['products']), 7)
+        self.assertEqual(response.context['stats']['active_orders'], 7)
+
+    def test_html_links_keep_other_cursors(self):
+        request = RequestFactory().get('/seller/', {'active_cursor': 'abc', 'history_cursor': 'x y'})
+        html = render_to_string('pagination.html', {
+            'page': KeysetPage([], next_cursor='next'), 'param': 'products_cursor',
+        }, request=request)
+        self.assertIn('href="?active_cursor=abc&amp;history_cursor=x+y&amp;products_cursor=next"', html)
+
+
+class ProductSearchTests(TestCase):
+    def test_search_reports_hit_count(self):
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        for name in ('Беспроводные наушники', 'Проводные наушники', 'Чайник'):
+            Product.objects.create(seller=seller, name=name, description='', price=1, stock=1)
+
+        data = self.client.get('/api/products/', {'search': 'наушники', 'limit': 1}).json()
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(len(data['results']), 1)
+        self.assertIsNotNone(data['next'])
+
+
+class SellerStatsTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass', balance=10000)
+
+    def assertStatsConsistent(self):
+        stats = SellerStats.objects.get(seller=self.seller)
+        expected = compute_seller_stats([self.seller.id])[self.seller.id]
+        self.assertEqual({field: getattr(stats, field) for field in STATS_FIELDS}, expected)
+        return stats
+
+    def test_order_lifecycle_keeps_stats_in_sync(self):
+        self.client.force_login(self.seller)
+        response = self.client.post('/api/products/', {'name': 'Товар', 'description': 'x', 'price': 100, 'stock': 5})
+        product_id = response.json()['id']
+        self.assertEqual(self.assertStatsConsistent().total_stock, 5)
+
+        self.client.force_login(self.buyer)
+        cart_item = self.client.post('/api/cart/', {'product_id': product_id, 'quantity': 2}).json()
+        order = self.client.post('/api/orders/', {'cart_item_id': cart_item['id']}).json()
+        stats = self.assertStatsConsistent()
+        self.assertEqual((stats.pending_count, stats.pending_revenue, stats.total_stock), (1, 200, 3))
+
+        self.client.force_login(self.seller)
+        self.client.patch(f"/api/orders/{order['id']}/update_status/", {'status': 'delivered'},
+                          content_type='application/json')
+        self.client.force_login(self.buyer)
+        self.client.post(f"/api/orders/{order['id']}/confirm_received/")
+        stats = self.assertStatsConsistent()
+        self.assertEqual((stats.received_count, stats.received_revenue, stats.pending_revenue), (1, 200, 0))
+
+    def test_dashboard_queries_do_not_grow_with_history(self):
+        product = Product.objects.create(seller=self.seller, name='Товар', description='', price=1, stock=1)
+        self.client.force_login(self.seller)
+
+        def dashboard_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get('/seller/')
+            return len(queries)
+
+        # Строка SellerStats и по заказу в активных и в истории (позиции непустых страниц читаются запросом)
+        create_order(self.buyer, self.seller, product, 1, 1)
+        create_order(self.buyer, self.seller, product, 1, 1, status='received')
+        self.client.get('/seller/')
+        baseline = dashboard_queries()
+        for status_code, _ in Order.STATUS_CHOICES:
+            create_order(self.buyer, self.seller, product, 1, 1, status=status_code)
+        self.assertEqual(dashboard_queries(), baseline)
+
+    def test_reconcile_command(self):
+        product = Product.objects.create(seller=self.seller, name='Товар', description='', price=1, stock=4)
+        create_order(self.buyer, self.seller, product, 1, 50)
+        SellerStats.objects.create(seller=self.seller, pending_count=10)
+
+        call_command('reconcile_seller_stats', stdout=StringIO())
+
+        stats = self.assertStatsConsistent()
+        self.assertEqual((stats.pending_count, stats.pending_revenue, stats.total_stock), (1, 50, 4))
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass', balance=150)
+        self.product = Product.objects.create(seller=seller, name='Товар', description='', price=100, stock=3)
+        self.client.force_login(self.buyer)
+
+    def test_failed_payment_rolls_back_stock(self):
+        cart_item = CartItem.objects.create(user=self.buyer, product=self.product, quantity=2)
+        response = self.client.post('/api/orders/', {'cart_item_id': cart_item.id})
+        self.assertEqual(response.status_code, 400)
+
+        self.product.refresh_from_db()
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.product.stock, self.buyer.balance), (3, 150))
+        self.assertTrue(CartItem.objects.filter(pk=cart_item.pk).exists())
+        self.assertFalse(Order.objects.exists())
+
+    def test_cart_item_is_ordered_once(self):
+        cart_item = CartItem.objects.create(user=self.buyer, product=self.product, quantity=1)
+        self.assertEqual(self.client.post('/api/orders/', {'cart_item_id': cart_item.id}).status_code, 201)
+        self.assertEqual(self.client.post('/api/orders/', {'cart_item_id': cart_item.id}).status_code, 404)
+
+        self.product.refresh_from_db()
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.product.stock, self.buyer.balance, Order.objects.count()), (2, 50, 1))
+
+    def test_checkout_whole_cart(self):
+        self.buyer.balance = 10000
+        self.buyer.save()
+        other = Product.objects.create(seller=self.product.seller, name='Другой', description='', price=7, stock=9)
+        CartItem.objects.create(user=self.buyer, product=self.product, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=other, quantity=3)
+
+        foreign_seller = User.objects.create_user(username='seller2', password='pass', user_type='seller')
+        foreign = Product.objects.create(seller=foreign_seller, name='Чужой', description='', price=5, stock=9)
+        CartItem.objects.create(user=self.buyer, product=foreign, quantity=1)
+
+        response = self.client.post('/api/orders/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        # Один заказ на продавца, товары — его позиции
+        self.assertEqual([(len(order['lines']), order['items_count']) for order in data['orders']], [(2, 5), (1, 1)])
+        self.assertEqual(float(data['total_price']), 226)
+        self.assertEqual(OrderLine.objects.count(), 3)
+
+        self.product.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual((self.product.stock, other.stock), (1, 6))
+        self.assertFalse(CartItem.objects.filter(user=self.buyer).exists())
+        stats = SellerStats.objects.get(seller=self.product.seller)
+        self.assertEqual((stats.pending_count, stats.total_stock), (1, 7))
+
+    def test_checkout_queries_do_not_grow_with_cart(self):
+        sellers = [self.product.seller, User.objects.create_user(username='seller2', password='pass',
+                                                                 user_type='seller')]
+        products = [Product.objects.create(seller=sellers[i % 2], name=f'Товар {i}', description='', price=1,
+                                           stock=100) for i in range(20)]
+        for seller in sellers:
+            refresh_seller_stats(seller.pk)
+
+        def checkout(buyer, items):
+            for product in items:
+                CartItem.objects.create(user=buyer, product=product, quantity=2)
+            self.client.force_login(buyer)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.post('/api/orders/checkout/', {}, content_type='application/json')
+            self.assertEqual(len(response.json()['orders']), 2)
+            return len(queries)
+
+        small = checkout(User.objects.create_user(username='small', password='pass', balance=1000), products[:4])
+        large = checkout(User.objects.create_user(username='large', password='pass', balance=1000), products)
+        # Число запросов зависит от числа продавцов (заказов), а не позиций корзины: сессия, пользователь,
+        # корзина, блокировка товаров, списание, заказы, позиции одним INSERT, остатки одним UPDATE,
+        # удаление корзины с резервами, журнал баланса, счётчики продавцов и итоговая выборка
+        self.assertEqual(large, small)
+        self.assertLessEqual(large, 20)
+
+    def test_checkout_whole_cart_is_all_or_nothing(self):
+        self.buyer.balance = 10000
+        self.buyer.save()
+        other = Product.objects.create(seller=self.product.seller, name='Другой', description='', price=7, stock=1)
+        CartItem.objects.create(user=self.buyer, product=self.product, quantity=2)
+        CartItem.objects.create(user=self.buyer, product=other, quantity=3)
+
+        response = self.client.post('/api/orders/checkout/', {}, content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.stock, 3)
+        self.assertEqual(CartItem.objects.filter(user=self.buyer).count(), 2)
+
+
+@skipUnlessDBFeature('has_select_for_update')
+class CheckoutConcurrencyTests(TransactionTestCase):
+    """Много покупателей одновременно оформляют один «горячий» товар"""
+    buyers_count = 40
+    stock = 25
+
+    def test_no_oversell_under_contention(self):
+        from .checkout import place_order, CheckoutError
+
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        product = Product.objects.create(seller=seller, name='Хит', description='', price=10, stock=self.stock)
+        buyers = [User.objects.create_user(username=f'buyer{i}', password='pass', balance=1000)
+                  for i in range(self.buyers_count)]
+        cart_items = [CartItem.objects.create(user=buyer, product=product, quantity=1) for buyer in buyers]
+
+        barrier = threading.Barrier(self.buyers_count)
+        results = []
+
+        def checkout(buyer, cart_item):
+            try:
+                barrier.wait()
+                place_order(buyer, cart_item.id)
+                results.append(True)
+            except CheckoutError:
+                results.append(False)
+            finally:
+                connection.close()
+
+        threads = [threading.Thread(target=checkout, args=pair) for pair in zip(buyers, cart_items)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        product.refresh_from_db()
+        self.assertEqual(results.count(True), self.stock)
+        self.assertEqual(product.stock, 0)
+        self.assertEqual(OrderLine.objects.filter(product=product).count(), self.stock)
+        self.assertEqual(sum(User.objects.filter(pk__in=[b.pk for b in buyers]).values_list('balance', flat=True)),
+                         1000 * self.buyers_count - 10 * self.stock)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.first = User.objects.create_user(username='first', password='pass', balance=1000)
+        self.second = User.objects.create_user(username='second', password='pass', balance=1000)
+        self.product = Product.objects.create(seller=seller, name='Товар', description='', price=10, stock=3)
+
+    def add_to_cart(self, user, quantity):
+        self.client.force_login(user)
+        return self.client.post('/api/cart/', {'product_id': self.product.id, 'quantity': quantity})
+
+    def test_cart_holds_stock_for_other_shoppers(self):
+        self.assertEqual(self.add_to_cart(self.first, 2).status_code, 201)
+        self.assertEqual(self.add_to_cart(self.second, 2).status_code, 400)
+        self.assertEqual(self.add_to_cart(self.second, 1).status_code, 201)
+
+        product = Product.objects.with_available_stock().get(pk=self.product.pk)
+        self.assertEqual((product.reserved_stock, product.available_stock), (3, 0))
+
+    def test_checkout_respects_foreign_holds(self):
+        self.add_to_cart(self.first, 3)
+        # Резерв первого покупателя истёк, второй успел зарезервировать весь остаток
+        StockReservation.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual(self.add_to_cart(self.second, 3).status_code, 201)
+
+        self.client.force_login(self.first)
+        cart_item = CartItem.objects.get(user=self.first)
+        self.assertEqual(self.client.post('/api/orders/', {'cart_item_id': cart_item.id}).status_code, 400)
+
+        self.client.force_login(self.second)
+        cart_item = CartItem.objects.get(user=self.second)
+        self.assertEqual(self.client.post('/api/orders/', {'cart_item_id': cart_item.id}).status_code, 201)
+        self.assertFalse(StockReservation.objects.filter(cart_item=cart_item.id).exists())
+
+    def test_release_command_sweeps_expired_holds(self):
+        self.add_to_cart(self.first, 1)
+        self.add_to_cart(self.second, 1)
+        StockReservation.objects.filter(cart_item__user=self.first).update(
+            expires_at=timezone.now() - timedelta(minutes=1))
+
+        call_command('release_reservations', stdout=StringIO())
+
+        self.assertEqual(list(StockReservation.objects.values_list('cart_item__user', flat=True)), [self.second.id])
+
+
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.category = Category.objects.create(name='Книги')
+        self.product = Product.objects.create(seller=seller, category=self.category, name='Книга',
+                                              description='', price=10, stock=3)
+
+    def test_warm_anonymous_browsing_needs_no_queries(self):
+        for url in ('/', f'/product/{self.product.id}/', '/api/categories/'):
+            self.client.get(url)
+            with self.assertNumQueries(0):
+                self.assertEqual(self.client.get(url).status_code, 200)
+
+    def test_model_changes_invalidate_cached_pages(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.get(f'/product/{self.product.id}/')
+            self.product.name = 'Новая книга'
+            self.product.save()
+        self.assertContains(self.client.get(f'/product/{self.product.id}/'), 'Новая книга')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.category.name = 'Журналы'
+            self.category.save()
+        self.assertContains(self.client.get(f'/product/{self.product.id}/'), 'Журналы')
+
+        self.client.get('/api/categories/')
+        with self.captureOnCommitCallbacks(execute=True):
+            Category.objects.create(name='Игрушки')
+        self.assertEqual(len(self.client.get('/api/categories/').json()), 2)
+
+    def test_cart_holds_invalidate_product_page(self):
+        url = f'/product/{self.product.id}/'
+        buyer = User.objects.create_user(username='buyer', password='pass')
+        self.client.get(url)
+        self.client.force_login(buyer)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post('/api/cart/', {'product_id': self.product.id, 'quantity': 3})
+        self.assertContains(self.client.get(url), 'В наличии: 0 шт.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f"/api/cart/{response.json()['id']}/")
+        self.assertContains(self.client.get(url), 'В наличии: 3 шт.')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post('/api/cart/batch/', {'items': [{'product_id': self.product.id, 'quantity': 2}]},
+                             content_type='application/json')
+        self.assertContains(self.client.get(url), 'В наличии: 1 шт.')
+
+    def test_evicted_version_does_not_revive_stale_entries(self):
+        self.client.get('/api/categories/')
+        Category.objects.filter(pk=self.category.pk).update(name='Журналы')
+        # Версия вытеснена, а запись со старой версией ещё в кэше
+        cache.delete('catalog:version:categories')
+        self.assertEqual(self.client.get('/api/categories/').json()[0]['name'], 'Журналы')
+
+    def test_hit_and_miss_counters(self):
+        before = catalog_cache.stats.snapshot()
+        self.client.get('/api/categories/')
+        self.client.get('/api/categories/')
+        after = catalog_cache.stats.snapshot()
+        self.assertEqual(after.get(('categories', 'miss'), 0) - before.get(('categories', 'miss'), 0), 1)
+        self.assertEqual(after.get(('categories', 'hit'), 0) - before.get(('categories', 'hit'), 0), 1)
+
+
+class ConditionalRequestTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.category = Category.objects.create(name='Книги')
+        self.product = Product.objects.create(seller=self.seller, category=self.category, name='Книга',
+                                              description='', price=10, stock=3)
+
+    def test_product_list_and_detail_answer_304(self):
+        # только запросы валидаторов, без выборки и сериализации: у списка — товары и резервы,
+        # у карточки — товар вместе с резервами
+        for url, queries in (('/api/products/', 2), (f'/api/products/{self.product.id}/', 1)):
+            response = self.client.get(url)
+            self.assertIn('max-age=0', response['Cache-Control'])
+            with self.assertNumQueries(queries):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+
+    def test_reservations_and_category_change_etag(self):
+        buyer = User.objects.create_user(username='buyer', password='pass')
+        for url in ('/api/products/', f'/api/products/{self.product.id}/', f'/product/{self.product.id}/'):
+            with self.subTest(url=url):
+                response = self.client.get(url)
+                etag = response['ETag']
+                self.assertFalse(response.has_header('Last-Modified'))
+                with self.captureOnCommitCallbacks(execute=True):
+                    cart_item = CartItem.objects.create(user=buyer, product=self.product, quantity=2)
+                    hold_stock(cart_item)
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+                # Удаление мимо API (CartItemViewSet) кэш страницы не сбрасывает — делаем это сами
+                with self.captureOnCommitCallbacks(execute=True):
+                    cart_item.delete()
+                    catalog_cache.bump_products([self.product.id])
+
+                etag = self.client.get(url)['ETag']
+                with self.captureOnCommitCallbacks(execute=True):
+                    self.category.name = 'Журналы'
+                    self.category.save()
+                self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_changes_produce_new_etag(self):
+        url = '/api/products/'
+        etag = self.client.get(url)['ETag']
+        self.assertNotEqual(self.client.get(url, {'category': self.category.id})['ETag'], etag)
+
+        Review.objects.create(product=self.product, user=self.seller, rating=5, comment='ok')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.product.delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_categories_and_product_page(self):
+        for url in ('/api/categories/', f'/product/{self.product.id}/'):
+            response = self.client.get(url)
+            with self.assertNumQueries(0):
+                response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+        self.assertIn('private', response['Cache-Control'])
+
+
+class BulkProductTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.category = Category.objects.create(name='Книги')
+        self.existing = Product.objects.create(seller=self.seller, category=self.category, name='Старое',
+                                               sku='A-1', description='', price=10, stock=5)
+        SellerStats.objects.filter(seller=self.seller).delete()
+        self.client.force_login(self.seller)
+
+    def upload(self, name, content):
+        return self.client.post('/api/products/import/', {'file': SimpleUploadedFile(name, content.encode())})
+
+    def test_csv_import_upserts_and_reports_errors(self):
+        content = (
+            'sku,name,description,price,stock,category\n'
+            f'A-1,Новое,,12.50,7,{self.category.id}\n'
+            'B-2,Второй,Описание,3,1,\n'
+            'C-3,,,-1,x,999\n'
+            'B-2,Дубль,,1,1,\n'
+        )
+        report = self.upload('products.csv', content).json()
+        self.assertEqual((report['created'], report['updated'], report['error_count']), (1, 1, 2))
+        self.assertEqual([error['line'] for error in report['errors']], [4, 5])
+        self.assertEqual(set(report['errors'][0]['errors']), {'name', 'price', 'stock', 'category'})
+
+        self.existing.refresh_from_db()
+        self.assertEqual((self.existing.name, self.existing.stock), ('Новое', 7))
+        self.assertEqual(Product.objects.get(sku='B-2').seller, self.seller)
+        self.assertEqual(SellerStats.objects.get(seller=self.seller).total_stock, 8)
+
+    def test_jsonl_round_trip(self):
+        response = self.client.get('/api/products/export/', {'file_format': 'jsonl'})
+        exported = b''.join(response.streaming_content).decode()
+        self.assertIn('"sku": "A-1"', exported)
+
+        report = self.upload('products.jsonl', exported.replace('Старое', 'Обновлённое') + 'not json\n').json()
+        self.assertEqual((report['created'], report['updated'], report['error_count']), (0, 1, 1))
+        self.assertEqual(Product.objects.get(sku='A-1').name, 'Обновлённое')
+
+    def test_concurrently_created_sku_is_updated_on_retry(self):
+        write_batch = bulk._write_batch
+        attempts = []
+
+        def rival_import_wins(*args):
+            attempts.append(args[1].keys())
+            if len(attempts) == 1:
+                # Параллельный импорт закоммитил тот же артикул, наша вставка упала на ограничении
+                Product.objects.create(seller=self.seller, sku='N-1', name='Чужая загрузка', description='',
+                                       price=1, stock=1)
+                raise IntegrityError('product_seller_sku_uniq')
+            return write_batch(*args)
+
+        with mock.patch('shop.bulk._write_batch', side_effect=rival_import_wins):
+            response = self.upload('products.csv', 'sku,name,price,stock\nN-1,Новый,5,2\n')
+        self.assertEqual(len(attempts), 2)
+        report = response.json()
+        self.assertEqual((report['created'], report['updated'], report['error_count']), (0, 1, 0))
+        self.assertEqual(Product.objects.get(seller=self.seller, sku='N-1').name, 'Новый')
+
+        # Конфликт не уходит — строки пачки попадают в отчёт, а не в ответ 500
+        with mock.patch('shop.bulk._write_batch', side_effect=IntegrityError):
+            response = self.upload('products.csv', 'sku,name,price,stock\nN-2,Новый,5,2\n')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([error['line'] for error in response.json()['errors']], [2])
+
+    def test_csv_export_and_permissions(self):
+        response = self.client.get('/api/products/export/')
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(lines[0], 'sku,name,description,price,stock,category')
+        self.assertEqual(len(lines), 2)
+
+        buyer = User.objects.create_user(username='buyer', password='pass')
+        self.client.force_login(buyer)
+        self.assertEqual(self.upload('products.csv', 'sku,name,price\n').status_code, 403)
+
+
+class OrderExportTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        other = User.objects.create_user(username='other', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        product = Product.objects.create(seller=self.seller, name='Книга', description='', price=10, stock=5)
+        other_product = Product.objects.create(seller=other, name='Чужой', description='', price=10, stock=5)
+        for status in ('pending', 'received', 'cancelled'):
+            create_order(self.buyer, self.seller, product, 1, 10, status=status)
+        create_order(self.buyer, other, other_product, 1, 10)
+
+    def test_seller_exports_own_orders_with_filters(self):
+        self.client.force_login(self.seller)
+        response = self.client.get('/api/orders/export/', {'status': 'received,cancelled', 'seller': 0})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertTrue(lines[0].startswith('id,created_at'))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all('Чужой' not in line for line in lines))
+
+        today = timezone.localdate()
+        response = self.client.get('/api/orders/export/', {'date_to': str(today - timedelta(days=1))})
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 1)
+        self.assertEqual(self.client.get('/api/orders/export/', {'status': 'lost'}).status_code, 400)
+
+        self.client.force_login(self.buyer)
+        self.assertEqual(self.client.get('/api/orders/export/').status_code, 403)
+
+    def test_command_exports_jsonl(self):
+        out = StringIO()
+        call_command('export_orders', '--format', 'jsonl', '--date-from', str(timezone.localdate()), stdout=out)
+        self.assertEqual(len(out.getvalue().splitlines()), 4)
+        self.assertIn('"seller": "other"', out.getvalue())
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp())
+class ImageVariantTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        buffer = BytesIO()
+        Image.new('RGB', (1000, 500), 'red').save(buffer, 'JPEG')
+        self.product = Product.objects.create(seller=seller, name='Фото', description='', price=1, stock=1,
+                                              image=SimpleUploadedFile('photo.jpg', buffer.getvalue()))
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(settings.MEDIA_ROOT, ignore_errors=True)
+        super().tearDownClass()
+
+    def test_only_new_uploads_schedule_variants(self):
+        with mock.patch('shop.images.schedule_variants') as schedule:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.image = SimpleUploadedFile('second.jpg', self.product.image.read())
+                self.product.save()
+            schedule.assert_called_once_with(self.product.pk, self.product.image.name)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                self.product.name = 'Без новой картинки'
+                self.product.save()
+            schedule.assert_called_once()
+
+    def test_variants_are_hashed_resized_and_exposed(self):
+        name = self.product.image.name
+        variants = build_variants(name)
+        self.assertEqual([width for width, _ in variants['webp']], [320, 640])
+        self.assertEqual(build_variants(name), variants)
+        for _, target in variants['jpeg']:
+            with Image.open(default_storage.path(target)) as image:
+                self.assertEqual(image.format, 'JPEG')
+
+        self.assertTrue(apply_variants(self.product.pk, name, variants))
+        response = self.client.get(f'/api/products/{self.product.pk}/')
+        self.assertIn('640w', response.json()['image_srcset']['webp'])
+        self.assertContains(self.client.get('/'), 'type="image/webp"')
+
+        call_command('build_image_variants', stdout=StringIO())
+        self.assertFalse(apply_variants(self.product.pk, 'products/other.jpg', variants))
+
+
+class BalanceLedgerTests(TestCase):
+    def setUp(self):
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        self.client.force_login(self.buyer)
+
+    def ledger_sum(self):
+        return sum(BalanceEntry.objects.filter(user=self.buyer).values_list('amount', flat=True))
+
+    def test_topups_are_exact_and_journaled(self):
+        for _ in range(3):
+            self.client.post('/profile/add-balance/', {'amount': '0.1'})
+        response = self.client.post('/api/users/add_balance/', {'amount': '100,10'})
+        self.assertEqual(response.json()['user']['balance'], '100.40')
+        self.assertEqual(self.client.post('/api/users/add_balance/', {'amount': 'nan'}).status_code, 400)
+        self.assertEqual(self.client.post('/api/users/add_balance/', {'amount': '2000000'}).status_code, 400)
+
+        self.client.patch(f'/api/users/{self.buyer.pk}/', {'balance': '999999'}, content_type='application/json')
+        self.client.patch('/api/users/update_profile/', {'phone': '123'}, content_type='application/json')
+        self.buyer.refresh_from_db()
+        self.assertEqual(self.buyer.balance, Decimal('100.40'))
+        self.assertEqual(self.ledger_sum(), self.buyer.balance)
+
+    def test_checkout_writes_purchase_entries(self):
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.client.post('/api/users/add_balance/', {'amount': '50'})
+        for price in (10, 15):
+            product = Product.objects.create(seller=seller, name='Товар', description='', price=price, stock=1)
+            CartItem.objects.create(user=self.buyer, product=product, quantity=1)
+        self.assertEqual(self.client.post('/api/orders/checkout/').status_code, 201)
+
+        # Оба товара одного продавца: один заказ и одна проводка
+        purchases = BalanceEntry.objects.filter(user=self.buyer, kind=BalanceEntry.PURCHASE)
+        self.assertEqual(list(purchases.values_list('amount', flat=True)), [-25])
+        self.assertTrue(all(entry.order_id for entry in purchases))
+        self.buyer.refresh_from_db()
+        self.assertEqual((self.buyer.balance, self.ledger_sum()), (25, 25))
+
+    def test_register_opening_entry_and_reconcile(self):
+        self.client.post('/register/', {'username': 'new', 'email': 'new@example.com', 'password': 'pass'})
+        new = User.objects.get(username='new')
+        self.assertEqual(list(new.balance_entries.values_list('kind', 'amount')), [('opening', 10000)])
+
+        User.objects.filter(pk=new.pk).update(balance=10005)
+        out = StringIO()
+        call_command('reconcile_balances', '--fix', stdout=out)
+        self.assertIn('разница 5', out.getvalue())
+        call_command('reconcile_balances', stdout=out)
+        self.assertIn('Найдено расхождений: 0', out.getvalue())
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        metrics_registry.reset()
+        self.staff = User.objects.create_user(username='staff', password='pass', is_staff=True)
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        Product.objects.create(seller=seller, name='Товар', description='', price=1, stock=1)
+
+    def test_metrics_are_recorded_per_view(self):
+        self.client.get('/api/products/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+
+        self.client.force_login(self.staff)
+        body = self.client.get('/metrics').content.decode()
+        self.assertIn('magazin_request_db_queries_bucket{view="product-list",le="+Inf"}', body)
+        self.assertIn('magazin_responses_total{view="product-list",method="GET",status="200"}', body)
+        self.assertIn('magazin_response_size_bytes_count{view="product-list"}', body)
+
+    def test_unknown_methods_share_one_label(self):
+        for method in ('BREW', 'X"} 1\nINJECT'):
+            self.client.generic(method, '/api/products/')
+        self.client.force_login(self.staff)
+        body = self.client.get('/metrics').content.decode()
+        self.assertRegex(body, r'magazin_responses_total\{view="product-list",method="other",status="\d+"\} 2\n')
+        self.assertNotIn('INJECT', body)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token_and_server_timing(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer secret')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertNotIn('Server-Timing', self.client.get('/api/products/', HTTP_X_SERVER_TIMING='1'))
+        self.client.force_login(self.staff)
+        timing = self.client.get('/api/products/', HTTP_X_SERVER_TIMING='1')['Server-Timing']
+        self.assertRegex(timing, r'db;dur=[\d.]+;desc="\d+ queries", total;dur=[\d.]+')
+
+    def test_server_timing_for_token_staff(self):
+        _, key = issue_token(self.staff)
+        # API (пользователя подставляет DRF) и обычная страница (токен разбирает middleware)
+        for url in ('/api/products/', '/'):
+            response = self.client.get(url, HTTP_X_SERVER_TIMING='1', HTTP_AUTHORIZATION=f'Bearer {key}')
+            self.assertIn('Server-Timing', response)
+        response = self.client.get('/', HTTP_X_SERVER_TIMING='1', HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_streaming_responses_are_measured(self):
+        self.client.force_login(self.staff)
+        response = self.client.get('/api/orders/export/')
+        b''.join(response.streaming_content)
+        self.assertIn('magazin_response_size_bytes_count{view="order-export"} 1',
+                      self.client.get('/metrics').content.decode())
+
+
+class BenchmarkSuiteTests(TestCase):
+    def test_seed_and_run_report(self):
+        cache.clear()
+        out = StringIO()
+        options = dict(sellers=2, buyers=3, products=20, orders=30, reviews=10, threads=1, iterations=2)
+        call_command('run_benchmarks', stdout=out, stderr=StringIO(), **options)
+        report = json.loads(out.getvalue())
+
+        dataset = report['meta']['dataset']
+        self.assertEqual([dataset[key] for key in ('sellers', 'buyers', 'products', 'reviews')], [2, 3, 20, 10])
+        # к засеянным заказам добавились оформленные сценарием checkout
+        self.assertGreater(dataset['orders'], 30)
+        self.assertEqual(set(report['scenarios']),
+                         {'browse_index', 'search', 'product_detail', 'add_to_cart', 'checkout', 'seller_dashboard'})
+        checkout = report['scenarios']['checkout']
+        self.assertEqual((checkout['requests'], checkout['errors']), (2, 0))
+        self.assertLessEqual(checkout['latency_ms']['p50'], checkout['latency_ms']['p99'])
+        self.assertGreater(checkout['queries']['mean'], 0)
+        # Счётчики продавцов сходятся с полным пересчётом: засеянные данные учтены
+        expected = compute_seller_stats()
+        self.assertEqual(len(expected), 2)
+        for stats in SellerStats.objects.all():
+            self.assertEqual({field: getattr(stats, field) for field in STATS_FIELDS}, expected[stats.seller_id])
+
+        # Повторное заполнение ничего не дублирует и сбрасывает кэш
+        cache.set('catalog:probe', 1)
+        call_command('run_benchmarks', stdout=StringIO(), stderr=StringIO(), **options)
+        self.assertEqual(Product.objects.count(), 20)
+        self.assertIsNone(cache.get('catalog:probe'))
+
+
+class DataGeneratorTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now()
+
+    def make_plan(self):
+        plan = Plan(seed=1, prefix='gen', sellers=5, buyers=20, products=50, orders=200, reviews=60, cart_items=30,
+                    whales=1, whale_share=0.6, zipf=1.1, password='x', now=self.now, category_ids=[1])
+        plan.bases = dict.fromkeys(TABLES, 1)
+        plan.prepare()
+        return plan
+
+    def test_copy_stream_escapes_values(self):
+        stream = CopyStream(iter([(1, None, True, 'a\tb\\c\nd')]))
+        self.assertEqual(stream.read(), '1\t\\N\tt\ta\\tb\\\\c\\nd\n')
+        self.assertEqual(stream.read(), '')
+
+    def test_rows_are_deterministic_and_skewed(self):
+        plan = self.make_plan()
+        reviews = list(review_rows(plan, 0, plan.buyers))
+        self.assertEqual(reviews, list(review_rows(self.make_plan(), 0, plan.buyers)))
+        self.assertEqual(len(reviews), 60)
+        self.assertEqual(len({(row[1], row[2]) for row in reviews}), 60)
+        self.assertEqual(sorted(row[0] for row in reviews), list(range(1, 61)))
+        # Крупный продавец (id 1) получает большую часть товаров
+        self.assertGreater(list(plan.product_sellers).count(1), 20)
+
+    def test_order_lines_match_headers(self):
+        plan = self.make_plan()
+        orders = {row[0]: row for row in order_rows(plan, 0, plan.orders)}
+        lines = list(order_line_rows(plan, 0, plan.orders))
+        self.assertEqual(len(orders), 200)
+        self.assertGreater(len(lines), len(orders))
+        self.assertEqual(len({row[0] for row in lines}), len(lines))
+        for order_id, order in orders.items():
+            own = [line for line in lines if line[1] == order_id]
+            self.assertEqual(order[3], sum(line[3] for line in own))
+            self.assertEqual(Decimal(order[4]), sum(Decimal(line[5]) for line in own))
+            self.assertEqual({plan.product_sellers[line[2] - 1] for line in own}, {order[2]})
+
+    def test_requires_postgresql(self):
+        if connection.vendor == 'postgresql':
+            self.skipTest('Проверка для других СУБД')
+        with self.assertRaises(CommandError):
+            call_command('generate_data', stdout=StringIO(), stderr=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', 'Планы запросов проверяются только на PostgreSQL')
+class QueryPlanTests(TestCase):
+    """Основные выборки заказов, корзины и каталога должны идти по индексам в нужном порядке,
+    без последовательного сканирования и отдельной сортировки"""
+
+    @classmethod
+    def setUpTestData(cls):
+        category_ids = [Category.objects.create(name=f'Категория {i}').id for i in range(10)]
+        sellers = [User.objects.create_user(username=f'seller{i}', password='pass', user_type='seller')
+                   for i in range(5)]
+        buyers = User.objects.bulk_create([User(username=f'buyer{i}', user_type='buyer') for i in range(400)])
+        products = Product.objects.bulk_create([
+            Product(seller=sellers[i % 5], category_id=category_ids[i % 10], name=f'Товар {i}', description='',
+                    price=10, stock=100)
+            for i in range(3000)
+        ])
+        statuses = [status for status, _ in Order.STATUS_CHOICES]
+        Order.objects.bulk_create([
+            Order(buyer=buyers[i % 400], seller=sellers[i % 5], items_count=1,
+                  total_price=10, status=statuses[i % 7], is_received=statuses[i % 7] == 'received')
+            for i in range(10000)
+        ])
+        CartItem.objects.bulk_create([
+            CartItem(user=buyer, product=products[i * 7 + j]) for i, buyer in enumerate(buyers) for j in range(10)
+        ])
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE shop_order, shop_product, shop_cartitem')
+        cls.buyer, cls.seller, cls.category_id = buyers[0], sellers[0], category_ids[0]
+
+    def assertIndexedPlan(self, queryset, table, allow_sort=False):
+        plan = queryset.explain()
+        self.assertNotRegex(plan, rf'Seq Scan on {table}\b', plan)
+        if not allow_sort:
+            self.assertNotRegex(plan, r'\bSort\b', plan)
+
+    def test_order_lists(self):
+        ordering = ('-created_at', '-id')
+        for queryset in (
+            Order.objects.filter(buyer=self.buyer).active(),
+            Order.objects.filter(buyer=self.buyer).history(),
+            Order.objects.filter(seller=self.seller).active(),
+            Order.objects.filter(seller=self.seller).history(),
+            Order.objects.filter(seller=self.seller),
+        ):
+            with self.subTest(query=str(queryset.query)):
+                self.assertIndexedPlan(queryset.order_by(*ordering)[:21], 'shop_order')
+
+        # Выгрузка продавца идёт в порядке id: сортировка отфильтрованных строк допустима
+        exported = Order.objects.filter(seller=self.seller, status__in=['received'],
+                                        created_at__gte=timezone.now() - timedelta(days=30)).order_by('id')
+        self.assertIndexedPlan(exported, 'shop_order', allow_sort=True)
+
+    def test_cart_and_category_catalog(self):
+        self.assertIndexedPlan(CartItem.objects.filter(user=self.buyer).order_by('id'), 'shop_cartitem')
+        self.assertIndexedPlan(
+            Product.objects.filter(category_id=self.category_id).order_by('-created_at', '-id')[:13], 'shop_product'
+        )
+
+
+class ReplicaRouterTests(TestCase):
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_reads_go_to_replica_only_inside_marked_block(self):
+        router = ReplicaRouter()
+        self.assertEqual(router.db_for_read(Product), 'default')
+        with replica_reads():
+            self.assertEqual(router.db_for_read(Product), 'replica')
+            self.assertEqual(router.db_for_write(Product), 'default')
+            with replica_reads(False):
+                self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertEqual(router.db_for_read(Product), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'shop'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_reads_default(self):
+        with replica_reads():
+            self.assertEqual(ReplicaRouter().db_for_read(Product), 'default')
+
+
+@skipUnless('replica' in settings.DATABASES, 'Нужна вторая база: --settings=config.settings_replica_test')
+class ReplicaRoutingTests(TransactionTestCase):
+    # Реплика — отдельное соединение к той же базе: данные должны быть зафиксированы, отсюда TransactionTestCase
+    databases = '__all__'
+
+    def setUp(self):
+        cache.clear()
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.product = Product.objects.create(seller=seller, name='Чайник', description='', price=10, stock=5)
+        self.buyer = User.objects.create_user(username='buyer', password='pass', balance=100)
+        self.client.force_login(self.buyer)
+
+    def replica_queries(self, path):
+        cache.clear()
+        with CaptureQueriesContext(connections['replica']) as replica:
+            self.assertEqual(self.client.get(path).status_code, 200)
+        return len(replica)
+
+    def test_catalog_reads_from_replica_until_write(self):
+        self.assertGreater(self.replica_queries('/api/products/'), 0)
+        self.assertGreater(self.replica_queries(f'/product/{self.product.pk}/'), 0)
+        self.assertEqual(self.replica_queries('/api/orders/'), 0)
+
+        response = self.client.post('/api/cart/', {'product_id': self.product.pk, 'quantity': 1},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        self.assertIn('db_primary', response.cookies)
+        # Закреплён за основной базой: свежая корзина и остатки читаются без отставания реплики
+        self.assertEqual(self.replica_queries('/api/products/'), 0)
+        self.assertEqual(self.replica_queries(f'/product/{self.product.pk}/'), 0)
+
+        self.client.cookies.pop('db_primary')
+        self.assertGreater(self.replica_queries('/api/products/'), 0)
+
+
+class ApiTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(username='buyer', password='secret-pass', balance=100)
+
+    def issue(self):
+        response = self.client.post('/api/tokens/', {'username': 'buyer', 'password': 'secret-pass', 'name': 'cli'},
+                                    content_type='application/json')
+        self.assertEqual(response.status_code, 201)
+        return {'HTTP_AUTHORIZATION': f'Bearer {response.json()["key"]}'}
+
+    def test_token_user_is_cached_and_skips_session_queries(self):
+        auth = self.issue()
+        self.assertEqual(len(ApiToken.objects.get().key_hash), 64)
+        self.assertEqual(self.client.get('/api/users/me/', **auth).json()['username'], 'buyer')
+        with CaptureQueriesContext(connection) as token_queries:
+            self.assertEqual(self.client.get('/api/users/me/', **auth).status_code, 200)
+
+        self.client.force_login(self.user)
+        with CaptureQueriesContext(connection) as session_queries:
+            self.assertEqual(self.client.get('/api/users/me/').status_code, 200)
+        self.assertEqual(len(token_queries), 0)
+        self.assertEqual(len(session_queries) - len(token_queries), 2)
+
+    def test_changes_invalidate_cached_user(self):
+        auth = self.issue()
+        self.client.get('/api/users/me/', **auth)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch('/api/users/update_profile/', {'phone': '+7 900'}, content_type='application/json',
+                              **auth)
+            self.client.post('/api/users/add_balance/', {'amount': '50'}, content_type='application/json', **auth)
+        me = self.client.get('/api/users/me/', **auth).json()
+        self.assertEqual((me['phone'], me['balance']), ('+7 900', '150.00'))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.user.is_active = False
+            self.user.save()
+        self.assertEqual(self.client.get('/api/users/me/', **auth).status_code, 401)
+
+    def test_logout_revokes_token(self):
+        auth = self.issue()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.post('/api/tokens/logout/', **auth).status_code, 204)
+        self.assertFalse(ApiToken.objects.exists())
+        self.assertEqual(self.client.get('/api/users/me/', **auth).status_code, 401)
+        self.assertEqual(self.client.get('/api/users/me/', HTTP_AUTHORIZATION='Bearer wrong').status_code, 401)
+
+
+class OrderTransitionTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass', balance=1000)
+        self.product = Product.objects.create(seller=self.seller, name='Товар', description='', price=10, stock=5)
+        self.orders = {
+            status: create_order(self.buyer, self.seller, self.product, 2, 20, status=status)
+            for status in ('pending', 'accepted', 'shipped', 'received')
+        }
+        self.client.force_login(self.seller)
+
+    def bulk(self, ids, target):
+        return self.client.post('/api/orders/bulk_status/', {'ids': ids, 'status': target},
+                                content_type='application/json')
+
+    def test_bulk_transition_applies_allowed_and_reports_rejected(self):
+        ids = [order.id for order in self.orders.values()]
+        with CaptureQueriesContext(connection) as queries:
+            data = self.bulk(ids, 'processing').json()
+        self.assertEqual(data['changed'], [self.orders['pending'].id, self.orders['accepted'].id])
+        self.assertEqual(data['rejected'], [self.orders['shipped'].id, self.orders['received'].id])
+        self.assertEqual(sum('UPDATE "shop_order"' in query['sql'] for query in queries.captured_queries), 1)
+        self.assertEqual(Order.objects.filter(status='processing').count(), 2)
+
+        stats = SellerStats.objects.get(seller=self.seller)
+        self.assertEqual({field: getattr(stats, field) for field in STATS_FIELDS},
+                         compute_seller_stats([self.seller.id])[self.seller.id])
+
+        self.assertEqual(self.bulk(ids, 'received').status_code, 400)
+        self.assertEqual(self.bulk('1,2', 'shipped').status_code, 400)
+
+    def test_cancel_refunds_and_restocks(self):
+        data = self.bulk([self.orders['pending'].id, self.orders['shipped'].id], 'cancelled').json()
+        self.assertEqual((data['changed'], data['rejected']), ([self.orders['pending'].id], [self.orders['shipped'].id]))
+        self.buyer.refresh_from_db()
+        self.product.refresh_from_db()
+        self.assertEqual((self.buyer.balance, self.product.stock), (1020, 7))
+        refund = BalanceEntry.objects.get(kind=BalanceEntry.REFUND)
+        self.assertEqual((refund.amount, refund.order_id), (20, self.orders['pending'].id))
+
+    def test_single_update_follows_state_machine(self):
+        url = f"/api/orders/{self.orders['shipped'].id}/update_status/"
+        self.assertEqual(self.client.patch(url, {'status': 'pending'}, content_type='application/json').status_code,
+                         400)
+        response = self.client.patch(url, {'status': 'delivered'}, content_type='application/json')
+        self.assertEqual(response.json()['status'], 'delivered')
+
+        # В обход переходов статус не меняется, заказ не удаляется
+        detail = f"/api/orders/{self.orders['pending'].id}/"
+        self.assertEqual(self.client.patch(detail, {'status': 'cancelled'}, content_type='application/json')
+                         .status_code, 405)
+        self.assertEqual(self.client.delete(detail).status_code, 405)
+        self.assertEqual(Order.objects.get(pk=self.orders['pending'].id).status, 'pending')
+
+        other = User.objects.create_user(username='other', password='pass', user_type='seller')
+        self.client.force_login(other)
+        self.assertEqual(self.bulk([self.orders['pending'].id], 'accepted').json()['rejected'],
+                         [self.orders['pending'].id])
+
+
+class ArchiveOrdersTests(TestCase):
+    def setUp(self):
+        self.seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        self.product = Product.objects.create(seller=self.seller, name='Товар', description='', price=10, stock=5)
+        self.orders = {
+            status: create_order(self.buyer, self.seller, self.product, 1, 10, status=status)
+            for status in ('pending', 'received', 'cancelled')
+        }
+        self.stats_before = compute_seller_stats([self.seller.id])[self.seller.id]
+        Order.objects.update(updated_at=timezone.now() - timedelta(days=60))
+
+    def test_command_moves_closed_orders(self):
+        out = StringIO()
+        call_command('archive_orders', '--batch-size', '1', stdout=out)
+        self.assertIn('2', out.getvalue())
+        self.assertEqual(list(Order.objects.values_list('status', flat=True)), ['pending'])
+        self.assertEqual(set(ArchivedOrder.objects.values_list('id', flat=True)),
+                         {self.orders['received'].id, self.orders['cancelled'].id})
+        self.assertEqual(compute_seller_stats([self.seller.id])[self.seller.id], self.stats_before)
+
+    def test_history_and_api_read_archive(self):
+        call_command('archive_orders', stdout=StringIO())
+        self.client.force_login(self.buyer)
+        response = self.client.get('/profile/')
+        self.assertEqual(len(response.context['history_orders']), 2)
+
+        data = self.client.get('/api/orders/').json()
+        self.assertEqual([order['id'] for order in data['results']],
+                         sorted((order.id for order in self.orders.values()), reverse=True))
+        received_id = self.orders['received'].id
+        self.assertEqual(self.client.get(f'/api/orders/{received_id}/').json()['status'], 'received')
+
+        self.client.force_login(self.seller)
+        response = self.client.get('/api/orders/export/')
+        self.assertEqual(len(b''.join(response.streaming_content).decode().splitlines()), 4)
+
+
+class CartBatchTests(TestCase):
+    def setUp(self):
+        seller = User.objects.create_user(username='seller', password='pass', user_type='seller')
+        self.buyer = User.objects.create_user(username='buyer', password='pass')
+        self.products = [
+            Product.objects.create(seller=seller, name=f'Товар {i}', description='', price=10 + i, stock=5)
+            for i in range(4)
+        ]
+        self.client.force_login(self.buyer)
+
+    def batch(self, items):
+        return self.client.post('/api/cart/batch/', {'items': items}, content_type='application/json')
+
+    def test_batch_upserts_and_holds_stock(self):
+        CartItem.objects.create(user=self.buyer, product=self.products[0], quantity=1)
+        items = [{'product_id': product.id, 'quantity': 2} for product in self.products]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch(items + [{'product_id': self.products[1].id}])
+        self.assertEqual(response.status_code, 201)
+        # Не зависит от числа товаров: сессия, пользователь, точка сохранения и её снятие,
+        # блокировка с проверкой, upsert, два запроса резервов, сводка
+        self.assertEqual(len(queries), 9)
+
+        self.assertEqual(dict(CartItem.objects.values_list('product_id', 'quantity')),
+                         {self.products[0].id: 3, self.products[1].id: 3, self.products[2].id: 2,
+                          self.products[3].id: 2})
+        self.assertEqual(StockReservation.objects.get(product=self.products[0]).quantity, 3)
+        data = response.json()
+        self.assertEqual((data['items_count'], float(data['total_price'])), (10, 10 * 3 + 11 * 3 + 12 * 2 + 13 * 2))
+        self.assertEqual(float(data['items'][0]['line_total']), 30)
+
+        with self.assertNumQueries(3):
+            self.assertEqual(self.client.get('/api/cart/summary/').json(), data)
+
+    def test_batch_is_all_or_nothing(self):
+        response = self.batch([{'product_id': self.products[0].id, 'quantity': 1},
+                               {'product_id': self.products[1].id, 'quantity': 6}])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('Товар 1', response.json()['error'])
+        self.assertFalse(CartItem.objects.exists())
+
+        self.assertEqual(self.batch([{'product_id': 0, 'quantity': 1}]).status_code, 400)
+        self.assertEqual(self.batch([{'product_id': self.products[0].id, 'quantity': 0}]).status_code, 400)
+        self.assertEqual(self.batch('1,2').status_code, 400)
+        self.assertEqual(self.client.get('/api/cart/summary/').json(),
+                         {'items': [], 'items_count': 0, 'total_price': 0})
+
+
+class FacetTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.sellers = [User.objects.create_user(username=f'seller{i}', password='pass', user_type='seller')
+                        for i in range(2)]
+        self.books, self.toys = Category.objects.create(name='Книги'), Category.objects.create(name='Игрушки')
+        # (продавец, категория, цена, остаток, сумма оценок, число оценок)
+        specs = [(0, self.books, 100, 1, 9, 2), (0, self.books, 700, 0, 0, 0), (1, self.books, 2000, 3, 5, 1),
+                 (1, self.toys, 300, 0, 6, 2), (1, self.toys, 25000, 2, 0, 0)]
+        self.products = [
+            Product.objects.create(seller=self.sellers[seller], category=category, name=f'Товар {i}',
+                                   description='', price=price, stock=stock, rating_sum=rating_sum,
+                                   rating_count=rating_count)
+            for i, (seller, category, price, stock, rating_sum, rating_count) in enumerate(specs)
+        ]
+
+    def product_ids(self, **params):
+        return sorted(product['id'] for product in self.client.get('/api/products/', params).json()['results'])
+
+    def test_list_filters(self):
+        ids = [product.id for product in self.products]
+        self.assertEqual(self.product_ids(price='500-1000'), [ids[1]])
+        self.assertEqual(self.product_ids(price='20000-'), [ids[4]])
+        self.assertEqual(self.product_ids(in_stock='1', category=self.books.id), [ids[0], ids[2]])
+        self.assertEqual(self.product_ids(min_rating=4), [ids[0], ids[2]])
+        self.assertEqual(self.product_ids(seller=self.sellers[0].id, min_rating=3), [ids[0]])
+
+    def test_facet_counts(self):
+        data = self.client.get('/api/products/facets/', {'in_stock': '1'}).json()
+        self.assertEqual(data['total'], 3)
+        self.assertEqual(data['categories'], [{'id': self.books.id, 'name': 'Книги', 'count': 2},
+                                              {'id': self.toys.id, 'name': 'Игрушки', 'count': 1}])
+        self.assertEqual([seller['count'] for seller in data['sellers']], [2, 1])
+        self.assertEqual({price['key']: price['count'] for price in data['price']},
+                         {'0-500': 1, '500-1000': 0, '1000-5000': 1, '5000-20000': 0, '20000-': 1})
+        self.assertEqual([step['count'] for step in data['rating']], [2, 2, 2, 2])
+        self.assertEqual(data['in_stock'], 3)
+
+        # Повторный запрос с теми же фильтрами — из кэша
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/products/facets/', {'in_stock': '1'}).json(), data)
+        with self.captureOnCommitCallbacks(execute=True):
+            Product.objects.create(seller=self.sellers[0], category=self.toys, name='Новый', description='',
+                                   price=50, stock=1)
+        self.assertEqual(self.client.get('/api/products/facets/', {'in_stock': '1'}).json()['total'], 4)
+
+    def test_index_shows_category_counts(self):
+        self.assertContains(self.client.get('/'), 'Книги (3)')
+
+    def test_invalid_filters(self):
+        for params in ({'price': '1-2'}, {'min_rating': '6'}, {'category': 'x'}):
+            self.assertEqual(self.client.get('/api/products/', params).status_code, 400)
+            self.assertEqual(self.client.get('/api/products/facets/', params).status_code, 400)
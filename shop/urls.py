@@ -4,6 +4,7 @@ from . import views
 
 router = DefaultRouter()
 router.register(r'users', views.UserViewSet)
+router.register(r'tokens', views.ApiTokenViewSet, basename='token')
 router.register(r'categories', views.CategoryViewSet)
 router.register(r'products', views.ProductViewSet)
 router.register(r'cart', views.CartItemViewSet, basename='cart')
@@ -23,6 +24,7 @@ urlpatterns = [
     path('profile/confirm-order/<int:order_id>/', views.confirm_order_received, name='confirm_order_received'),
     path('seller/', views.seller_dashboard, name='seller_dashboard'),
     path('seller/add-stock/<int:product_id>/', views.add_product_stock, name='add_product_stock'),
+    path('metrics', views.metrics_view, name='metrics'),
     
     # API
     path('api/', include(router.urls)),
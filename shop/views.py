@@ -1,22 +1,90 @@
+from decimal import Decimal
+from django.conf import settings
+from django.http import Http404, HttpResponse, HttpResponseForbidden, StreamingHttpResponse
+from django.utils.crypto import constant_time_compare
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, logout, authenticate
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
-from django.db.models import Q
-from rest_framework import viewsets, status
+from django.db import transaction
+from django.db.models import Avg, Count, IntegerField, OuterRef, Prefetch, Subquery
+from django.db.models.functions import Coalesce
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from .models import User, Category, Product, CartItem, Order, Review
-from .serializers import (UserSerializer, CategorySerializer, ProductSerializer, 
-                          CartItemSerializer, OrderSerializer, ReviewSerializer)
+from . import cache as catalog_cache
+from .auth import CachedTokenAuthentication, issue_token
+from .cart import CartError, add_to_cart, cart_summary, parse_cart_items
+from .bulk import (CONTENT_TYPES, ImportFormatError, detect_format, export_orders, export_products, import_products,
+                   parse_order_filters, read_rows)
+from .orders import TransitionError, parse_order_ids, transition_orders
+from .models import (User, Category, Product, CartItem, Order, OrderLine, ArchivedOrder, ArchivedOrderLine, Review,
+                     BalanceEntry, ApiToken)
+from .checkout import CheckoutError, checkout_cart, place_order
+from .ledger import credit, parse_amount
+from .metrics import registry as metrics_registry
+from .facets import apply_facet_filters, cached_facet_counts, parse_facet_filters
+from .conditional import (CATEGORIES_CACHE_CONTROL, PRIVATE_REVALIDATE, ConditionalMixin, collection_validators,
+                          make_etag, not_modified, set_validators)
+from .pagination import InvalidCursor, KeysetPagination, paginate_keyset
+from .reservations import hold_stock, reservations_version
+from .routers import reads_from_replica
+from .search import ProductSearchPagination, search_products
+from .stats import adjust_seller_stats, get_seller_stats, record_order_change, refresh_seller_stats
+from .serializers import (ApiTokenSerializer, UserSerializer, CategorySerializer, ProductSerializer, ProductListSerializer,
+                          CartItemSerializer, OrderSerializer, OrderListSerializer, ReviewSerializer)
+
+
+# Поля, которые читают списочные сериализаторы (для .only())
+PRODUCT_LIST_FIELDS = ('id', 'seller__id', 'seller__username', 'category__id', 'category__name', 'name',
+                       'price', 'stock', 'image', 'image_variants', 'rating_sum', 'rating_count', 'created_at')
+ORDER_LIST_FIELDS = ('id', 'buyer__id', 'buyer__username', 'seller__id', 'seller__username',
+                     'items_count', 'total_price', 'status', 'is_received', 'created_at', 'updated_at')
+
+
+def prefetch_lines(line_model=OrderLine):
+    """Позиции страницы заказов одним запросом (line_model — OrderLine или ArchivedOrderLine)"""
+    lines = line_model.objects.select_related('product').only(
+        'order_id', 'product__id', 'product__name', 'quantity', 'price', 'total_price'
+    ).order_by('id')
+    return Prefetch('lines', queryset=lines)
+
+
+def received_orders_count(line_model):
+    """Выражение: число полученных заказов с товаром по позициям line_model (OrderLine или ArchivedOrderLine)"""
+    lines = line_model.objects.filter(product=OuterRef('pk'), order__status='received').order_by().values('product')
+    return Coalesce(Subquery(lines.annotate(count=Count('id')).values('count'), output_field=IntegerField()), 0)
+
+
+def keyset_page(request, queryset, param='cursor', page_size=12):
+    """Страница для HTML-представлений: курсор берётся из GET-параметра param"""
+    try:
+        return paginate_keyset(queryset, request.GET.get(param), page_size)
+    except InvalidCursor:
+        raise Http404('Неверный курсор')
 
 
 # Web Views
+@reads_from_replica
 def index(request):
-    products = Product.objects.all()[:12]
-    categories = Category.objects.all()
-    return render(request, 'index.html', {'products': products, 'categories': categories})
+    # Каталог кэшируется целиком: при тёплом кэше анонимный просмотр не обращается к базе
+    cursor = request.GET.get('cursor')
+    products = catalog_cache.get_or_compute(
+        'index', cursor or 'first', ['products'],
+        lambda: keyset_page(request, Product.objects.with_available_stock())
+    )
+    categories = catalog_cache.get_or_compute(
+        'categories', 'all', ['categories'], lambda: list(Category.objects.all())
+    )
+    facets = cached_facet_counts({})
+    counts = {category['id']: category['count'] for category in facets['categories']}
+    return render(request, 'index.html', {
+        'products': products,
+        'categories': [(category, counts.get(category.id, 0)) for category in categories],
+        'facets': facets,
+    })
 
 
 def register_view(request):
@@ -30,9 +98,9 @@ def register_view(request):
             messages.error(request, 'Пользователь с таким именем уже существует')
             return redirect('register')
         
-        user = User.objects.create_user(username=username, email=email, password=password, user_type=user_type)
-        user.balance = 10000  # Начальный баланс
-        user.save()
+        with transaction.atomic():
+            user = User.objects.create_user(username=username, email=email, password=password, user_type=user_type)
+            credit(user, Decimal('10000'), BalanceEntry.OPENING)  # Начальный баланс
         login(request, user)
         messages.success(request, 'Регистрация успешна!')
         return redirect('index')
@@ -62,30 +130,53 @@ def logout_view(request):
     return redirect('index')
 
 
+@reads_from_replica
 def product_detail(request, pk):
-    product = get_object_or_404(Product, pk=pk)
-    reviews = product.reviews.all()
-    return render(request, 'product_detail.html', {'product': product, 'reviews': reviews})
+    def load():
+        product = Product.objects.select_related('seller', 'category').with_available_stock().filter(pk=pk).first()
+        if product is None:
+            return None
+        return product, list(product.reviews.select_related('user'))
+    
+    # Страница показывает и название категории: переименование сбрасывает её вместе с товаром
+    cached = catalog_cache.get_or_compute('product', pk, ['categories', catalog_cache.product_scope(pk)], load)
+    if cached is None:
+        raise Http404('Товар не найден')
+    product, reviews = cached
+    # Шапка страницы зависит от пользователя (баланс), поэтому он входит в ETag;
+    # остаток за вычетом резервов и категория не меняют updated_at — они входят в ETag,
+    # а Last-Modified не отдаём (как и в API товаров).
+    # При непоказанных flash-сообщениях страницу отдаём полностью
+    etag = make_etag(product.pk, product.updated_at, product.available_stock,
+                     *catalog_cache.get_versions('categories'),
+                     request.user.pk, getattr(request.user, 'balance', ''))
+    if not len(messages.get_messages(request)):
+        response = not_modified(request, etag)
+        if response is not None:
+            return set_validators(response, etag, cache_control=PRIVATE_REVALIDATE)
+    response = render(request, 'product_detail.html', {'product': product, 'reviews': reviews})
+    return set_validators(response, etag, cache_control=PRIVATE_REVALIDATE)
 
 
 @login_required
 def profile_view(request):
-    cart_items = CartItem.objects.filter(user=request.user)
+    # Суммы позиций и итог корзины считаются в том же запросе
+    cart_items = list(
+        CartItem.objects.filter(user=request.user).select_related('product').with_totals().order_by('id')
+    )
     # Активные заказы (не в истории)
-    active_orders = Order.objects.filter(
-        buyer=request.user,
-        status__in=['pending', 'accepted', 'processing', 'shipped', 'delivered']
-    ).exclude(is_received=True).order_by('-created_at')
-    
-    # История заказов (получены или отменены)
-    history_orders = Order.objects.filter(
-        buyer=request.user
-    ).filter(
-        Q(status__in=['received', 'cancelled']) | Q(is_received=True)
-    ).order_by('-created_at')
+    orders = Order.objects.select_related('seller').prefetch_related(prefetch_lines()).filter(buyer=request.user)
+    active_orders = keyset_page(request, orders.active(), param='active_cursor', page_size=20)
+    
+    # История заказов (получены или отменены): горячая таблица и архив
+    archived = ArchivedOrder.objects.select_related('seller').prefetch_related(prefetch_lines(ArchivedOrderLine))
+    history_orders = keyset_page(
+        request, [orders.history(), archived.filter(buyer=request.user)], param='history_cursor', page_size=20
+    )
     
     return render(request, 'profile.html', {
         'cart_items': cart_items,
+        'cart_total': cart_items[0].cart_total if cart_items else 0,
         'active_orders': active_orders,
         'history_orders': history_orders
     })
@@ -114,7 +205,8 @@ def edit_profile(request):
         request.user.email = email
         request.user.phone = phone
         request.user.address = address
-        request.user.save()
+        # Только изменённые поля: полное сохранение затёрло бы параллельное изменение баланса
+        request.user.save(update_fields=['first_name', 'last_name', 'email', 'phone', 'address'])
         
         messages.success(request, 'Личные данные успешно обновлены!')
         return redirect('profile')
@@ -127,17 +219,12 @@ def add_balance(request):
     """Пополнение баланса"""
     if request.method == 'POST':
         try:
-            amount = float(request.POST.get('amount', 0))
-            if amount <= 0:
-                messages.error(request, 'Сумма должна быть больше нуля')
-            elif amount > 1000000:
-                messages.error(request, 'Максимальная сумма пополнения: 1,000,000 ₽')
-            else:
-                request.user.balance = float(request.user.balance) + amount
-                request.user.save()
-                messages.success(request, f'Баланс пополнен на {amount:,.2f} ₽')
-        except (ValueError, TypeError):
-            messages.error(request, 'Неверная сумма')
+            amount = parse_amount(request.POST.get('amount', 0))
+        except ValueError as e:
+            messages.error(request, str(e))
+        else:
+            credit(request.user, amount)
+            messages.success(request, f'Баланс пополнен на {amount:,.2f} ₽')
     
     return redirect('profile')
 
@@ -152,9 +239,12 @@ def confirm_order_received(request, order_id):
     elif order.is_received:
         messages.info(request, 'Заказ уже подтверждён')
     else:
-        order.is_received = True
-        order.status = 'received'
-        order.save()
+        before = (order.status, order.is_received, order.total_price)
+        with transaction.atomic():
+            order.is_received = True
+            order.status = 'received'
+            order.save()
+            record_order_change(order, before)
         messages.success(request, 'Спасибо! Получение заказа подтверждено')
     
     return redirect('profile')
@@ -173,8 +263,10 @@ def add_product_stock(request, product_id):
             elif quantity > 10000:
                 messages.error(request, 'Максимальное количество: 10,000 шт.')
             else:
-                product.stock += quantity
-                product.save()
+                with transaction.atomic():
+                    product.stock += quantity
+                    product.save()
+                    adjust_seller_stats(product.seller_id, total_stock=quantity)
                 messages.success(request, f'Добавлено {quantity} шт. к товару "{product.name}"')
         except (ValueError, TypeError):
             messages.error(request, 'Неверное количество')
@@ -192,74 +284,42 @@ def seller_dashboard(request):
     products = Product.objects.filter(seller=request.user)
     
     # Активные заказы (не в истории)
-    active_orders = Order.objects.filter(
-        seller=request.user,
-        status__in=['pending', 'accepted', 'processing', 'shipped', 'delivered']
-    ).exclude(is_received=True).order_by('-created_at')
-    
-    # История заказов (получены или отменены)
-    history_orders = Order.objects.filter(
-        seller=request.user
-    ).filter(
-        Q(status__in=['received', 'cancelled']) | Q(is_received=True)
-    ).order_by('-created_at')
-    
-    # Статистика
-    from django.db.models import Sum, Count, Avg
-    from decimal import Decimal
-    
-    # Общая статистика
-    total_products = products.count()
-    total_orders = Order.objects.filter(seller=request.user).count()
-    active_orders_count = active_orders.count()
-    completed_orders_count = history_orders.filter(status='received').count()
-    
-    # Финансовая статистика
-    total_revenue = Order.objects.filter(
-        seller=request.user,
-        status='received'
-    ).aggregate(total=Sum('total_price'))['total'] or Decimal('0')
-    
-    pending_revenue = active_orders.aggregate(
-        total=Sum('total_price')
-    )['total'] or Decimal('0')
-    
-    # Статистика по товарам
-    total_stock = products.aggregate(total=Sum('stock'))['total'] or 0
-    avg_price = products.aggregate(avg=Avg('price'))['avg'] or Decimal('0')
-    
-    # Популярные товары (по количеству заказов)
-    from django.db.models import Count as CountFunc
-    popular_products = Product.objects.filter(
-        seller=request.user,
-        order__status='received'
-    ).annotate(
-        orders_count=CountFunc('order')
-    ).order_by('-orders_count')[:5]
+    orders = Order.objects.select_related('buyer').prefetch_related(prefetch_lines()).filter(seller=request.user)
+    active_orders = orders.active()
+    
+    # История заказов (получены или отменены): горячая таблица и архив
+    archived = ArchivedOrder.objects.select_related('buyer').prefetch_related(prefetch_lines(ArchivedOrderLine))
+    history_orders = [orders.history(), archived.filter(seller=request.user)]
+    
+    # Статистика: счётчики заказов и остатков хранятся в SellerStats
+    stats = get_seller_stats(request.user)
+    product_stats = products.aggregate(total=Count('id'), avg_price=Avg('price'))
+    
+    # Популярные товары (по количеству полученных заказов, включая архив)
+    popular_products = Product.objects.filter(seller=request.user).annotate(
+        orders_count=received_orders_count(OrderLine) + received_orders_count(ArchivedOrderLine)
+    ).filter(orders_count__gt=0).order_by('-orders_count')[:5]
     
     # Статистика по статусам
     status_stats = {}
     for status_code, status_name in Order.STATUS_CHOICES:
-        count = Order.objects.filter(
-            seller=request.user,
-            status=status_code
-        ).count()
+        count = stats.status_count(status_code)
         if count > 0:
             status_stats[status_name] = count
     
     context = {
-        'products': products,
-        'active_orders': active_orders,
-        'history_orders': history_orders,
+        'products': keyset_page(request, products, param='products_cursor', page_size=20),
+        'active_orders': keyset_page(request, active_orders, param='active_cursor', page_size=20),
+        'history_orders': keyset_page(request, history_orders, param='history_cursor', page_size=20),
         'stats': {
-            'total_products': total_products,
-            'total_orders': total_orders,
-            'active_orders': active_orders_count,
-            'completed_orders': completed_orders_count,
-            'total_revenue': total_revenue,
-            'pending_revenue': pending_revenue,
-            'total_stock': total_stock,
-            'avg_price': avg_price,
+            'total_products': product_stats['total'],
+            'total_orders': stats.total_orders,
+            'active_orders': stats.active_orders,
+            'completed_orders': stats.received_count,
+            'total_revenue': stats.received_revenue,
+            'pending_revenue': stats.pending_revenue,
+            'total_stock': stats.total_stock,
+            'avg_price': product_stats['avg_price'] or Decimal('0'),
             'popular_products': popular_products,
             'status_stats': status_stats,
         }
@@ -268,6 +328,15 @@ def seller_dashboard(request):
     return render(request, 'seller_dashboard.html', context)
 
 
+def metrics_view(request):
+    """Метрики процесса в формате Prometheus: для персонала или по токену METRICS_TOKEN"""
+    token = settings.METRICS_TOKEN
+    authorization = request.headers.get('Authorization', '')
+    if not (request.user.is_staff or (token and constant_time_compare(authorization, f'Bearer {token}'))):
+        return HttpResponseForbidden('Доступ запрещен')
+    return HttpResponse(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+
 # API ViewSets
 class UserViewSet(viewsets.ModelViewSet):
     queryset = User.objects.all()
@@ -282,25 +351,16 @@ class UserViewSet(viewsets.ModelViewSet):
     def add_balance(self, request):
         """API для пополнения баланса"""
         try:
-            amount = float(request.data.get('amount', 0))
-            if amount <= 0:
-                return Response({'error': 'Сумма должна быть больше нуля'}, 
-                              status=status.HTTP_400_BAD_REQUEST)
-            if amount > 1000000:
-                return Response({'error': 'Максимальная сумма: 1,000,000 ₽'}, 
-                              status=status.HTTP_400_BAD_REQUEST)
-            
-            request.user.balance = float(request.user.balance) + amount
-            request.user.save()
-            
-            serializer = self.get_serializer(request.user)
-            return Response({
-                'message': f'Баланс пополнен на {amount:,.2f} ₽',
-                'user': serializer.data
-            })
-        except (ValueError, TypeError):
-            return Response({'error': 'Неверная сумма'}, 
-                          status=status.HTTP_400_BAD_REQUEST)
+            amount = parse_amount(request.data.get('amount', 0))
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        credit(request.user, amount)
+        serializer = self.get_serializer(request.user)
+        return Response({
+            'message': f'Баланс пополнен на {amount:,.2f} ₽',
+            'user': serializer.data
+        })
     
     @action(detail=False, methods=['patch'], permission_classes=[IsAuthenticated])
     def update_profile(self, request):
@@ -332,7 +392,7 @@ class UserViewSet(viewsets.ModelViewSet):
         if address is not None:
             user.address = address
         
-        user.save()
+        user.save(update_fields=['first_name', 'last_name', 'email', 'phone', 'address'])
         
         serializer = self.get_serializer(user)
         return Response({
@@ -341,29 +401,173 @@ class UserViewSet(viewsets.ModelViewSet):
         })
 
 
+class ApiTokenViewSet(mixins.ListModelMixin, mixins.DestroyModelMixin, viewsets.GenericViewSet):
+    """Токены API текущего пользователя: выпуск, список, отзыв"""
+    serializer_class = ApiTokenSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        return ApiToken.objects.filter(user=self.request.user).order_by('-created_at')
+    
+    def get_permissions(self):
+        if self.action == 'create':
+            return [AllowAny()]
+        return super().get_permissions()
+    
+    def create(self, request):
+        """Выпуск токена: из сессии или по логину и паролю; ключ показывается только в этом ответе"""
+        user = request.user
+        if not user.is_authenticated:
+            user = authenticate(request, username=request.data.get('username'),
+                                password=request.data.get('password'))
+            if user is None:
+                return Response({'error': 'Неверное имя пользователя или пароль'},
+                                status=status.HTTP_400_BAD_REQUEST)
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        token, key = issue_token(user, serializer.validated_data.get('name', ''))
+        return Response({**self.get_serializer(token).data, 'key': key}, status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['post'])
+    def logout(self, request):
+        """Отзывает токен, которым подписан запрос"""
+        if not isinstance(request.successful_authenticator, CachedTokenAuthentication):
+            return Response({'error': 'Запрос выполнен не по токену'}, status=status.HTTP_400_BAD_REQUEST)
+        ApiToken.objects.filter(key_hash=request.auth).delete()
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
+    # Действия, чьи GET-запросы можно читать с реплики (см. shop/routers.py)
+    replica_actions = ('list', 'retrieve')
+    
+    def list(self, request, *args, **kwargs):
+        def load():
+            queryset = self.get_queryset()
+            etag, last_modified = collection_validators(queryset)
+            return list(self.get_serializer(queryset, many=True).data), etag, last_modified
+        
+        # Валидаторы хранятся вместе с телом: повторный запрос не трогает БД
+        data, etag, last_modified = catalog_cache.get_or_compute('categories', 'api-list', ['categories'], load)
+        response = not_modified(request, etag, last_modified) or Response(data)
+        return set_validators(response, etag, last_modified, CATEGORIES_CACHE_CONTROL)
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(ConditionalMixin, viewsets.ModelViewSet):
     queryset = Product.objects.all()
     serializer_class = ProductSerializer
+    pagination_class = KeysetPagination
+    replica_actions = ('list', 'retrieve', 'facets')
+    
+    @property
+    def paginator(self):
+        if self.request.query_params.get('search'):
+            self.pagination_class = ProductSearchPagination
+        return super().paginator
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return ProductListSerializer
+        return ProductSerializer
     
     def get_queryset(self):
-        queryset = Product.objects.all()
-        category = self.request.query_params.get('category', None)
+        queryset = Product.objects.select_related('seller', 'category').with_available_stock()
+        if self.action == 'list':
+            queryset = queryset.only(*PRODUCT_LIST_FIELDS)
+        else:
+            queryset = queryset.prefetch_related(
+                Prefetch('reviews', queryset=Review.objects.select_related('user'))
+            )
+        return self.filter_products(queryset)
+    
+    def get_facet_filters(self):
+        try:
+            return parse_facet_filters(self.request.query_params)
+        except ValueError as e:
+            raise ValidationError({'error': str(e)})
+    
+    def filter_products(self, queryset):
         search = self.request.query_params.get('search', None)
         
-        if category:
-            queryset = queryset.filter(category_id=category)
+        queryset = apply_facet_filters(queryset, self.get_facet_filters())
         if search:
-            queryset = queryset.filter(Q(name__icontains=search) | Q(description__icontains=search))
+            queryset = search_products(queryset, search)
         
         return queryset
     
+    @action(detail=False, methods=['get'])
+    def facets(self, request):
+        """Счётчики фасетов (категории, продавцы, цены, рейтинг, наличие) для фильтров из строки запроса"""
+        return Response(cached_facet_counts(self.get_facet_filters()))
+    
+    # available_stock зависит от живых резервов, category_name — от категории: ни то ни другое не меняет
+    # Product.updated_at, поэтому их версии входят в ETag. Last-Modified товары не отдают: истечение
+    # резерва не оставляет даты, и If-Modified-Since подтвердил бы устаревший остаток.
+    
+    def get_list_validators(self, request):
+        # Без аннотаций и JOIN-ов: агрегат идёт по индексу updated_at;
+        # курсор и фильтры входят в ETag через строку запроса
+        products = self.filter_products(Product.objects.all())
+        etag, _ = collection_validators(products, request.get_full_path(), *reservations_version(products),
+                                        *catalog_cache.get_versions('categories'))
+        return etag, None
+    
+    def get_detail_validators(self, request):
+        try:
+            row = Product.objects.filter(pk=self.kwargs['pk']).with_available_stock().values_list(
+                'updated_at', 'available_stock'
+            ).first()
+        except (ValueError, TypeError):
+            row = None
+        if row is None:
+            return None, None
+        return make_etag(self.kwargs['pk'], *row, *catalog_cache.get_versions('categories')), None
+    
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[IsAuthenticated])
+    def bulk_import(self, request):
+        """Массовая загрузка товаров из CSV/JSONL: создание и обновление по артикулу"""
+        if request.user.user_type != 'seller':
+            return Response({'error': 'Доступ запрещен'}, status=status.HTTP_403_FORBIDDEN)
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({'error': 'Файл не передан'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            fmt = detect_format(upload.name, request.data.get('file_format'))
+            report = import_products(request.user, read_rows(upload, fmt))
+        except ImportFormatError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(report)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """Потоковая выгрузка товаров продавца в CSV/JSONL"""
+        fmt = request.query_params.get('file_format', 'csv')
+        if fmt not in CONTENT_TYPES:
+            return Response({'error': 'Поддерживаются только файлы CSV и JSONL'}, status=status.HTTP_400_BAD_REQUEST)
+        response = StreamingHttpResponse(
+            export_products(Product.objects.filter(seller=request.user), fmt), content_type=CONTENT_TYPES[fmt]
+        )
+        response['Content-Disposition'] = f'attachment; filename="products.{fmt}"'
+        return response
+    
+    @transaction.atomic
     def perform_create(self, serializer):
-        serializer.save(seller=self.request.user)
+        product = serializer.save(seller=self.request.user)
+        adjust_seller_stats(product.seller_id, total_stock=product.stock)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        old_stock = serializer.instance.stock
+        product = serializer.save()
+        adjust_seller_stats(product.seller_id, total_stock=product.stock - old_stock)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+        # Вместе с товаром каскадно удаляются его заказы
+        refresh_seller_stats(instance.seller_id)
 
 
 class CartItemViewSet(viewsets.ModelViewSet):
@@ -371,92 +575,185 @@ class CartItemViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     
     def get_queryset(self):
-        return CartItem.objects.filter(user=self.request.user)
+        return CartItem.objects.filter(user=self.request.user).select_related(
+            'product__seller', 'product__category'
+        ).only('id', 'quantity', 'added_at', *(f'product__{field}' for field in PRODUCT_LIST_FIELDS))
     
     def create(self, request):
         product_id = request.data.get('product_id')
-        quantity = int(request.data.get('quantity', 1))
-        
-        product = get_object_or_404(Product, id=product_id)
-        
-        # Проверка наличия товара
-        if product.stock <= 0:
-            return Response(
-                {'error': 'Товар отсутствует на складе'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if product.stock < quantity:
-            return Response(
-                {'error': f'Недостаточно товара. Доступно: {product.stock} шт.'},
-                status=status.HTTP_400_BAD_REQUEST
+        try:
+            quantity = int(request.data.get('quantity', 1))
+        except (ValueError, TypeError):
+            quantity = 0
+        if quantity < 1:
+            return Response({'error': 'Неверное количество'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        with transaction.atomic():
+            # Блокировка строки товара упорядочивает резервирование последних единиц
+            product = get_object_or_404(
+                Product.objects.select_for_update(of=('self',)).select_related('seller', 'category')
+                .with_available_stock(exclude_user=request.user),
+                id=product_id
             )
-        
-        cart_item, created = CartItem.objects.get_or_create(
-            user=request.user,
-            product=product,
-            defaults={'quantity': quantity}
-        )
-        
-        if not created:
-            new_quantity = cart_item.quantity + quantity
-            if new_quantity > product.stock:
+            available = product.available_stock
+            cart_item = CartItem.objects.filter(user=request.user, product=product).first()
+            in_cart = cart_item.quantity if cart_item else 0
+            
+            # Проверка наличия товара с учётом чужих резервов
+            if available <= 0:
                 return Response(
-                    {'error': f'Недостаточно товара. Доступно: {product.stock} шт., в корзине: {cart_item.quantity} шт.'},
+                    {'error': 'Товар отсутствует на складе'},
                     status=status.HTTP_400_BAD_REQUEST
                 )
-            cart_item.quantity = new_quantity
-            cart_item.save()
+            
+            if in_cart + quantity > available:
+                error = f'Недостаточно товара. Доступно: {available} шт.'
+                if in_cart:
+                    error += f', в корзине: {in_cart} шт.'
+                return Response({'error': error}, status=status.HTTP_400_BAD_REQUEST)
+            
+            if cart_item is None:
+                cart_item = CartItem.objects.create(user=request.user, product=product, quantity=quantity)
+            else:
+                cart_item.quantity = in_cart + quantity
+                cart_item.save(update_fields=['quantity'])
+            hold_stock(cart_item)
         
         serializer = self.get_serializer(cart_item)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        cart_item = serializer.instance
+        product = Product.objects.select_for_update(of=('self',)).with_available_stock(
+            exclude_user=self.request.user
+        ).get(pk=cart_item.product_id)
+        quantity = serializer.validated_data.get('quantity', cart_item.quantity)
+        if quantity > product.available_stock:
+            raise ValidationError({'error': f'Недостаточно товара. Доступно: {product.available_stock} шт.'})
+        hold_stock(serializer.save())
+    
+    def perform_destroy(self, instance):
+        # Резерв удаляется каскадно: остаток на странице товара снова доступен
+        product_id = instance.product_id
+        instance.delete()
+        transaction.on_commit(lambda: catalog_cache.bump_products([product_id]))
+    
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """Добавление нескольких товаров: {"items": [{"product_id": 1, "quantity": 2}, ...]}; ответ — сводка корзины"""
+        try:
+            add_to_cart(request.user, parse_cart_items(request.data.get('items')))
+        except CartError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(cart_summary(request.user), status=status.HTTP_201_CREATED)
+    
+    @action(detail=False, methods=['get'])
+    def summary(self, request):
+        """Суммы позиций и итог корзины, посчитанные в базе"""
+        return Response(cart_summary(request.user))
 
 
-class OrderViewSet(viewsets.ModelViewSet):
+class OrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin,
+                   viewsets.GenericViewSet):
+    """Заказы не правятся и не удаляются напрямую: статус меняют только update_status, bulk_status
+    и confirm_received, которые ведут счётчики продавца, возвраты и остатки"""
     serializer_class = OrderSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return OrderSerializer
     
     def get_queryset(self):
         user = self.request.user
         if user.user_type == 'seller':
-            return Order.objects.filter(seller=user)
-        return Order.objects.filter(buyer=user)
-    
-    def create(self, request):
-        cart_item_id = request.data.get('cart_item_id')
-        cart_item = get_object_or_404(CartItem, id=cart_item_id, user=request.user)
-        
-        if cart_item.product.stock < cart_item.quantity:
-            return Response({'error': 'Недостаточно товара на складе'}, status=status.HTTP_400_BAD_REQUEST)
-        
-        total_price = cart_item.total_price
-        
-        if request.user.balance < total_price:
-            return Response({'error': 'Недостаточно средств на балансе'}, status=status.HTTP_400_BAD_REQUEST)
+            queryset = Order.objects.filter(seller=user)
+        else:
+            queryset = Order.objects.filter(buyer=user)
         
-        # Создаем заказ
-        order = Order.objects.create(
-            buyer=request.user,
-            seller=cart_item.product.seller,
-            product=cart_item.product,
-            quantity=cart_item.quantity,
-            total_price=total_price
+        queryset = queryset.select_related('buyer', 'seller').prefetch_related(prefetch_lines())
+        if self.action == 'list':
+            return queryset.only(*ORDER_LIST_FIELDS)
+        return queryset
+    
+    def get_archive_queryset(self):
+        user = self.request.user
+        archived = ArchivedOrder.objects.select_related('buyer', 'seller').prefetch_related(
+            prefetch_lines(ArchivedOrderLine)
         )
-        
-        # Списываем средства
-        request.user.balance -= total_price
-        request.user.save()
-        
-        # Обновляем склад
-        cart_item.product.stock -= cart_item.quantity
-        cart_item.product.save()
-        
-        # Удаляем из корзины
-        cart_item.delete()
+        if user.user_type == 'seller':
+            return archived.filter(seller=user)
+        return archived.filter(buyer=user)
+    
+    def list(self, request):
+        """Заказы вместе с архивными, от новых к старым"""
+        page = self.paginate_queryset([self.get_queryset(), self.get_archive_queryset().only(*ORDER_LIST_FIELDS)])
+        return self.get_paginated_response(self.get_serializer(page, many=True).data)
+    
+    def retrieve(self, request, pk=None):
+        try:
+            return super().retrieve(request, pk=pk)
+        except Http404:
+            # Закрытый заказ мог уйти в архив (команда archive_orders)
+            order = get_object_or_404(self.get_archive_queryset(), pk=pk)
+            return Response(self.get_serializer(order).data)
+    
+    @action(detail=False, methods=['get'], permission_classes=[IsAuthenticated])
+    def export(self, request):
+        """Потоковая выгрузка заказов в CSV/JSONL: продавец — свои, администратор — любые"""
+        user = request.user
+        if not user.is_staff and user.user_type != 'seller':
+            return Response({'error': 'Доступ запрещен'}, status=status.HTTP_403_FORBIDDEN)
+        params = request.query_params
+        fmt = params.get('file_format', 'csv')
+        if fmt not in CONTENT_TYPES:
+            return Response({'error': 'Поддерживаются только файлы CSV и JSONL'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            filters = parse_order_filters(
+                seller=params.get('seller') if user.is_staff else user.pk,
+                status=params.get('status'), date_from=params.get('date_from'), date_to=params.get('date_to'),
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        querysets = [Order.objects.filter(**filters), ArchivedOrder.objects.filter(**filters)]
+        response = StreamingHttpResponse(export_orders(querysets, fmt), content_type=CONTENT_TYPES[fmt])
+        response['Content-Disposition'] = f'attachment; filename="orders.{fmt}"'
+        return response
+    
+    def create(self, request):
+        try:
+            order = place_order(request.user, request.data.get('cart_item_id'))
+        except CheckoutError as error:
+            return Response({'error': str(error)}, status=error.status_code)
         
         serializer = self.get_serializer(order)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
     
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def checkout(self, request):
+        """Оформление всей корзины (или позиций из cart_item_ids) одним запросом"""
+        cart_item_ids = request.data.get('cart_item_ids')
+        if cart_item_ids is not None and not isinstance(cart_item_ids, list):
+            return Response({'error': 'cart_item_ids должен быть списком'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            orders = checkout_cart(request.user, cart_item_ids)
+        except CheckoutError as error:
+            return Response({'error': str(error)}, status=error.status_code)
+        
+        orders = Order.objects.filter(id__in=[order.id for order in orders]).select_related(
+            'buyer', 'seller'
+        ).prefetch_related(prefetch_lines()).only(*ORDER_LIST_FIELDS).order_by('id')
+        serializer = OrderListSerializer(orders, many=True)
+        return Response({
+            'orders': serializer.data,
+            'total_price': sum(order.total_price for order in orders),
+            'balance': request.user.balance,
+        }, status=status.HTTP_201_CREATED)
+    
     @action(detail=True, methods=['patch'], permission_classes=[IsAuthenticated])
     def update_status(self, request, pk=None):
         order = self.get_object()
@@ -464,14 +761,28 @@ class OrderViewSet(viewsets.ModelViewSet):
         if order.seller != request.user:
             return Response({'error': 'Доступ запрещен'}, status=status.HTTP_403_FORBIDDEN)
         
-        new_status = request.data.get('status')
-        if new_status in dict(Order.STATUS_CHOICES):
-            order.status = new_status
-            order.save()
-            serializer = self.get_serializer(order)
-            return Response(serializer.data)
-        
-        return Response({'error': 'Неверный статус'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            changed, _ = transition_orders(request.user, [order.pk], request.data.get('status'))
+        except TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        if not changed:
+            return Response({'error': f'Заказ в статусе «{order.get_status_display()}» нельзя перевести в этот статус'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        order.refresh_from_db()
+        serializer = self.get_serializer(order)
+        return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'], permission_classes=[IsAuthenticated])
+    def bulk_status(self, request):
+        """Смена статуса списка заказов продавца: {"ids": [...], "status": "shipped"}"""
+        if request.user.user_type != 'seller':
+            return Response({'error': 'Доступ запрещен'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            order_ids = parse_order_ids(request.data.get('ids'))
+            changed, rejected = transition_orders(request.user, order_ids, request.data.get('status'))
+        except TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({'changed': changed, 'rejected': rejected})
     
     @action(detail=True, methods=['post'], permission_classes=[IsAuthenticated])
     def confirm_received(self, request, pk=None):
@@ -487,9 +798,12 @@ class OrderViewSet(viewsets.ModelViewSet):
         if order.is_received:
             return Response({'message': 'Заказ уже подтверждён'}, status=status.HTTP_200_OK)
         
-        order.is_received = True
-        order.status = 'received'
-        order.save()
+        before = (order.status, order.is_received, order.total_price)
+        with transaction.atomic():
+            order.is_received = True
+            order.status = 'received'
+            order.save()
+            record_order_change(order, before)
         
         serializer = self.get_serializer(order)
         return Response({
@@ -499,9 +813,10 @@ class OrderViewSet(viewsets.ModelViewSet):
 
 
 class ReviewViewSet(viewsets.ModelViewSet):
-    queryset = Review.objects.all()
+    queryset = Review.objects.select_related('user')
     serializer_class = ReviewSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = KeysetPagination
     
     def create(self, request, *args, **kwargs):
         product_id = request.data.get('product')
@@ -511,6 +826,13 @@ class ReviewViewSet(viewsets.ModelViewSet):
         if not product_id:
             return Response({'error': 'Не указан товар'}, status=status.HTTP_400_BAD_REQUEST)
         
+        try:
+            rating = int(rating)
+        except (ValueError, TypeError):
+            rating = None
+        if rating is None or not 1 <= rating <= 5:
+            return Response({'error': 'Оценка должна быть от 1 до 5'}, status=status.HTTP_400_BAD_REQUEST)
+        
         try:
             product = Product.objects.get(id=product_id)
         except Product.DoesNotExist:
@@ -520,12 +842,22 @@ class ReviewViewSet(viewsets.ModelViewSet):
         if Review.objects.filter(product=product, user=request.user).exists():
             return Response({'error': 'Вы уже оставили отзыв на этот товар'}, status=status.HTTP_400_BAD_REQUEST)
         
-        review = Review.objects.create(
-            product=product,
-            user=request.user,
-            rating=rating,
-            comment=comment
-        )
+        # Отзыв и агрегаты рейтинга товара сохраняются в одной транзакции
+        with transaction.atomic():
+            review = Review.objects.create(
+                product=product,
+                user=request.user,
+                rating=rating,
+                comment=comment
+            )
         
         serializer = self.get_serializer(review)
         return Response(serializer.data, status=status.HTTP_201_CREATED)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()